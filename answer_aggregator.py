@@ -0,0 +1,313 @@
+# answer_aggregator.py
+import csv
+import itertools
+import json
+import os
+import threading
+import time
+import config
+import answer_parser
+import run_manifest
+
+CONVERGENCE_CHECK_ROWS = 50 # 每个 (画像类型, 模型) 每新增这么多行才重新判断一次是否收敛
+
+
+def _import_numpy():
+    """按需导入 numpy（只有运行中才需要），未安装时返回None"""
+    try:
+        import numpy as np
+    except ImportError: # 需要 pip install numpy
+        return None
+    return np
+
+
+class _GroupCounts:
+    """一个 (画像类型, 模型) 的计数数组"""
+
+    def __init__(self, np, num_questions, num_options):
+        self.options = np.zeros((num_questions, num_options), dtype=np.int64) # [题目, 选项] 有效答案数
+        self.statuses = np.zeros((num_questions, 4), dtype=np.int64) # [题目, 状态码] 答案数
+        self.rows = 0
+        self.converged = False
+        self.checked_rows = 0 # 上次判断收敛时的行数
+
+
+class AnswerAggregator:
+    """
+    运行中的在线汇总：每写入一行结果就把答案累加到 (画像类型, 模型, 题目, 选项) 的 numpy 计数数组，
+    随时可以算出答案分布、平均熵、错误率和模型间一致度，定期写出快照供运行中查看，
+    并可判断某组合的答案分布是否已经收敛（用于提前停止）
+    """
+
+    def __init__(self):
+        self.active = False
+        self._np = None
+        self._lock = threading.Lock()
+        self._groups = {}
+        self._seeded = set()
+        self._last_checkpoint = 0.0
+
+    def start_run(self, survey_questions):
+        """按问卷重置计数；AGGREGATE_ENABLED 关闭或未安装 numpy 时不汇总"""
+        with self._lock:
+            self._groups = {}
+            self._seeded = set()
+            self.active = False
+            if not config.AGGREGATE_ENABLED:
+                return
+            self._np = _import_numpy()
+            if self._np is None:
+                print("警告：未安装 numpy，跳过在线汇总（pip install numpy）。")
+                return
+            self.question_ids = [str(q["id"]) for q in survey_questions]
+            labels = [answer_parser.canonical_labels(q) for q in survey_questions]
+            self._option_index = [{label: index for index, label in enumerate(options)} for options in labels]
+            self._num_options = self._np.array([len(options) for options in labels])
+            self._choice = self._num_options > 1 # 开放题和单选项题不计算熵和收敛
+            self._width = max(1, int(self._num_options.max(initial=0)))
+            self._last_checkpoint = time.monotonic()
+            self.active = True
+
+    # --- 累加 ---
+    def add_row(self, row):
+        """row: 结果CSV的一行 [persona_id, persona_type, model, sample_index, 答案...]"""
+        if not self.active or len(row) < 4:
+            return
+        np = self._np
+        answers = row[4:4 + len(self.question_ids)]
+        positions, options, statuses = [], [], []
+        for position, answer in enumerate(answers):
+            status = answer_parser.status_of(answer)
+            statuses.append(status)
+            if status == answer_parser.STATUS_OK:
+                option = self._option_index[position].get(answer)
+                if option is not None:
+                    positions.append(position)
+                    options.append(option)
+        with self._lock:
+            group = self._groups.get((row[1], row[2]))
+            if group is None:
+                group = self._groups[(row[1], row[2])] = _GroupCounts(np, len(self.question_ids), self._width)
+            # 同一行中每题只出现一次，花式索引的 += 不会漏计
+            group.options[positions, options] += 1
+            group.statuses[np.arange(len(statuses)), statuses] += 1
+            group.rows += 1
+            due = time.monotonic() - self._last_checkpoint >= config.AGGREGATE_CHECKPOINT_INTERVAL
+        if due:
+            self.checkpoint()
+
+    def seed_from_results(self, output_file):
+        """续跑时先把结果CSV中已有的行计入（同一单元重复出现时只计一次）；每个文件只读一次"""
+        if not self.active or output_file in self._seeded or not os.path.exists(output_file):
+            return
+        self._seeded.add(output_file)
+        seen = set()
+        with open(output_file, 'r', newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                if len(row) < 4:
+                    continue
+                key = run_manifest.unit_key(*row[:4])
+                if key not in seen:
+                    seen.add(key)
+                    self.add_row(row)
+
+    def wrap(self, writer, output_file):
+        """包装结果写入器，每写一行同时计入汇总"""
+        self.seed_from_results(output_file)
+        return AggregatingWriter(writer, self)
+
+    # --- 统计 ---
+    def distributions(self, persona_type, model_name):
+        """[题目, 选项] 的答案比例；没有有效答案的题目整行为0"""
+        np = self._np
+        with self._lock:
+            counts = self._groups[(persona_type, model_name)].options.copy()
+        totals = counts.sum(axis=1, keepdims=True)
+        return np.divide(counts, totals, out=np.zeros(counts.shape), where=totals > 0)
+
+    def _entropy(self, distributions):
+        """每道选择题按选项数归一化的熵（0 表示答案完全一致，1 表示均匀分布）"""
+        np = self._np
+        with np.errstate(divide="ignore", invalid="ignore"):
+            terms = np.where(distributions > 0, distributions * np.log(distributions), 0.0)
+        log_k = np.log(np.maximum(self._num_options, 2))
+        return -terms.sum(axis=1) / log_k
+
+    def _max_standard_error(self, group):
+        """各选择题各选项比例的标准误中的最大值，以及有效答案最少的题目的答案数"""
+        np = self._np
+        counts = group.options[self._choice]
+        if not len(counts):
+            return 0.0, group.rows
+        totals = counts.sum(axis=1, keepdims=True)
+        p = np.divide(counts, totals, out=np.zeros(counts.shape), where=totals > 0)
+        se = np.sqrt(p * (1 - p) / np.maximum(totals, 1))
+        return float(se.max()), int(totals.min())
+
+    def converged(self, persona_type, model_name):
+        """该组合每道选择题的有效答案数都达到 AGGREGATE_MIN_SAMPLES 且标准误都不超过 AGGREGATE_CONVERGENCE_SE"""
+        if not self.active:
+            return False
+        with self._lock:
+            group = self._groups.get((persona_type, model_name))
+            if group is None:
+                return False
+            if not group.converged and group.rows - group.checked_rows >= CONVERGENCE_CHECK_ROWS:
+                group.checked_rows = group.rows
+                se, min_answers = self._max_standard_error(group)
+                group.converged = min_answers >= config.AGGREGATE_MIN_SAMPLES and se <= config.AGGREGATE_CONVERGENCE_SE
+            return group.converged
+
+    def _agreement(self, distributions_by_model):
+        """模型两两之间答案分布的重合度 sum(min(p, q))，对两者都有答案的题目和所有模型对取平均；不足两个模型时返回None"""
+        np = self._np
+        values = []
+        for first, second in itertools.combinations(distributions_by_model.values(), 2):
+            both = (first.sum(axis=1) > 0) & (second.sum(axis=1) > 0)
+            if both.any():
+                values.append(float(np.minimum(first[both], second[both]).sum(axis=1).mean()))
+        return sum(values) / len(values) if values else None
+
+    def summary(self):
+        """{画像类型: {"models": {模型: 统计}, "agreement": 模型间一致度}}"""
+        if not self.active:
+            return {}
+        with self._lock:
+            keys = sorted(self._groups)
+        summary = {}
+        for persona_type, group_keys in itertools.groupby(keys, key=lambda key: key[0]):
+            models = {}
+            distributions_by_model = {}
+            for _, model_name in group_keys:
+                with self._lock:
+                    group = self._groups[(persona_type, model_name)]
+                    statuses = group.statuses.sum(axis=0)
+                    se, min_answers = self._max_standard_error(group)
+                    rows = group.rows
+                distributions = self.distributions(persona_type, model_name)
+                distributions_by_model[model_name] = distributions
+                answered = (distributions.sum(axis=1) > 0) & self._choice
+                total = int(statuses.sum())
+                models[model_name] = {
+                    "rows": rows,
+                    "error_rate": 1 - int(statuses[answer_parser.STATUS_OK]) / total if total else None,
+                    "mean_entropy": float(self._entropy(distributions)[answered].mean()) if answered.any() else None,
+                    "max_standard_error": se,
+                    "min_answers": min_answers,
+                    "converged": min_answers >= config.AGGREGATE_MIN_SAMPLES and se <= config.AGGREGATE_CONVERGENCE_SE,
+                }
+            summary[persona_type] = {"models": models, "agreement": self._agreement(distributions_by_model)}
+        return summary
+
+    # --- 快照 ---
+    def checkpoint(self, counts_path=None, summary_path=None):
+        """写出计数快照 (.npz) 和汇总 (JSON)，先写临时文件再替换；只涉及很小的数组，可以频繁调用"""
+        if not self.active:
+            return
+        counts_path = counts_path or config.AGGREGATE_CHECKPOINT_FILE
+        summary_path = summary_path or config.AGGREGATE_SUMMARY_FILE
+        with self._lock:
+            self._last_checkpoint = time.monotonic()
+            arrays = {}
+            for (persona_type, model_name), group in self._groups.items():
+                arrays[f"options:{persona_type}:{model_name}"] = group.options.copy()
+                arrays[f"statuses:{persona_type}:{model_name}"] = group.statuses.copy()
+        with open(counts_path + ".tmp", 'wb') as f:
+            self._np.savez(f, question_ids=self._np.array(self.question_ids), **arrays)
+        os.replace(counts_path + ".tmp", counts_path)
+        data = {"updated_at": time.strftime("%Y-%m-%d %H:%M:%S"), "persona_types": self.summary()}
+        with open(summary_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(summary_path + ".tmp", summary_path)
+
+    def finish_run(self):
+        """写出最终快照并打印汇总"""
+        if not self.active or not self._groups:
+            return
+        self.checkpoint()
+        print("答案分布汇总:")
+        for line in summary_lines(self.summary()):
+            print(line)
+
+
+class AggregatingWriter:
+    """把写入的每一行同时计入汇总，接口与 run_manifest.ResultWriter 相同"""
+
+    def __init__(self, writer, aggregator):
+        self.writer = writer
+        self.aggregator = aggregator
+
+    def existing_keys(self):
+        return self.writer.existing_keys()
+
+    def write_row(self, row):
+        self.writer.write_row(row)
+        self.aggregator.add_row(row)
+
+    def close(self):
+        self.writer.close()
+
+
+def _fmt(value, spec):
+    return format(value, spec) if value is not None else "-"
+
+
+def summary_lines(summary):
+    """汇总的文字报告，每个 (画像类型, 模型) 一行，另加每个画像类型的模型间一致度"""
+    lines = []
+    for persona_type, entry in summary.items():
+        for model_name, stats in entry["models"].items():
+            lines.append(
+                f"  {persona_type} / {model_name}: {stats['rows']} 行，错误率 {_fmt(stats['error_rate'], '.1%')}，"
+                f"平均熵 {_fmt(stats['mean_entropy'], '.3f')}，最大标准误 {_fmt(stats['max_standard_error'], '.3f')}"
+                f"{'（已收敛）' if stats['converged'] else ''}"
+            )
+        if entry["agreement"] is not None:
+            lines.append(f"  {persona_type} 模型间一致度: {entry['agreement']:.3f}")
+    return lines
+
+
+def load_summary(path=None):
+    """读取运行中写出的JSON汇总，不存在时返回None"""
+    path = path or config.AGGREGATE_SUMMARY_FILE
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_counts(path=None):
+    """读取计数快照：(题号列表, {(画像类型, 模型): (选项计数, 状态计数)})"""
+    np = _import_numpy()
+    if np is None:
+        raise ImportError("读取汇总快照需要安装 numpy")
+    groups = {}
+    with np.load(path or config.AGGREGATE_CHECKPOINT_FILE) as data:
+        question_ids = [str(q_id) for q_id in data["question_ids"]]
+        for name in data.files:
+            kind, _, rest = name.partition(":")
+            if kind != "options":
+                continue
+            persona_type, model_name = rest.split(":", 1)
+            groups[(persona_type, model_name)] = (data[name], data[f"statuses:{rest}"])
+    return question_ids, groups
+
+
+def rebuild_from_results(survey_questions, output_files):
+    """结果文件被改写（例如修复环节）后，按结果CSV重新计算汇总并写出快照"""
+    aggregator = get_aggregator()
+    aggregator.start_run(survey_questions)
+    for output_file in output_files:
+        aggregator.seed_from_results(output_file)
+    if aggregator.active and aggregator._groups:
+        aggregator.checkpoint()
+
+
+_aggregator = AnswerAggregator()
+
+
+def get_aggregator():
+    """获取进程内共享的在线汇总器"""
+    return _aggregator
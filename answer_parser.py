@@ -0,0 +1,279 @@
+# answer_parser.py
+import bisect
+import math
+import re
+import persona_loader
+
+# 每道题的解析状态码
+STATUS_OK = 0
+STATUS_MISSING = 1      # 回复中没有该题
+STATUS_NO_RESPONSE = 2  # 整个请求没有回复
+STATUS_INVALID = 3      # 有答案但不是合法选项
+
+ERROR_MISSING = "ERROR_MISSING"
+ERROR_NO_RESPONSE = "ERROR_NO_RESPONSE"
+ERROR_INVALID = "ERROR_INVALID"
+
+STATUS_OF_VALUE = {
+    ERROR_MISSING: STATUS_MISSING,
+    "ERROR_NOT_FOUND": STATUS_MISSING, # 旧版解析器的占位值
+    ERROR_NO_RESPONSE: STATUS_NO_RESPONSE,
+    ERROR_INVALID: STATUS_INVALID,
+}
+
+# 全角字母、数字和标点转半角，只用于（很短的）答案部分
+_FULLWIDTH = str.maketrans(
+    {chr(code): chr(code - 0xFEE0) for code in range(0xFF01, 0xFF5F)} | {"\u3000": " "}
+)
+# 一行答案，例如 "题号1：3"、"问题 2: [B]"、"第3题：4"、"4. C"、"５）2"
+# 以换行符开头（解析时在文本前补一个换行），正则引擎可以直接跳到行首而不必逐字符尝试；
+# \d 同时匹配全角数字，int() 也能直接转换，因此无需先整体转半角
+_ANSWER_LINE = re.compile(
+    r"\n[ \t\u3000]*(?:\*\*)?(?:题号|问题|第)?[ \t\u3000]*(\d+)[ \t\u3000]*题?(?:\*\*)?[ \t\u3000]*"
+    r"[:：.．、)）][ \t\u3000]*(.*)"
+)
+# 答案开头的选项编号，允许被括号包裹，后面可以跟说明文字
+_ANSWER_LABEL = re.compile(r"^[\[(【〔<《\"'“]*\s*([0-9A-Za-z]+)\s*(?:[\])】〕>》(（\"'”.。,，、:;；\s]|$)")
+_ANSWER_WRAPPERS = "[]()【】〔〕<>《》\"'“”*.。 "
+# logprobs 中答案位置的token可能带着前面的分隔符或括号，例如 "：3"、" [2"
+_TOKEN_PREFIX = " \t\u3000:：.．、)）[(【〔<《\"'“*"
+_TOKEN_LABEL = re.compile(r"[0-9A-Za-z]+")
+
+
+class SurveyParser:
+    """
+    按问卷解析LLM回复：校验题号和选项，返回每题答案与状态码，并累计统计而不逐行打印。
+    """
+
+    def __init__(self, survey_questions):
+        self.question_ids = [int(q["id"]) for q in survey_questions]
+        self._id_keys = [str(q_id) for q_id in self.question_ids]
+        self._id_key_set = frozenset(self._id_keys)
+        self._index_of = {key: index for index, key in enumerate(self._id_keys)}
+        self._codes = [persona_loader.option_codes(q) for q in survey_questions]
+        self._labels = [canonical_labels(q) for q in survey_questions]
+        # 常见写法直接查表得到规范编号，只有查不到时才走较慢的清洗逻辑
+        self._lookup = [
+            {key: labels[code - 1] for key, code in codes.items()}
+            for codes, labels in zip(self._codes, self._labels)
+        ]
+        self.stats = {
+            "responses": 0,
+            "no_response": 0,
+            "answers_ok": 0,
+            "answers_missing": 0,
+            "answers_invalid": 0,
+            "unparsed_lines": 0,
+            "unknown_question_ids": 0,
+        }
+
+    def parse(self, response_text):
+        """返回 (答案列表, 状态码列表)，顺序与问卷题目一致；同一题重复作答时以最后一次为准"""
+        num_questions = len(self.question_ids)
+        stats = self.stats
+        stats["responses"] += 1
+        if not response_text:
+            stats["no_response"] += 1
+            return [ERROR_NO_RESPONSE] * num_questions, [STATUS_NO_RESPONSE] * num_questions
+
+        pairs = _ANSWER_LINE.findall("\n" + response_text)
+        found = dict(pairs)
+        if not found.keys() <= self._id_key_set:
+            found = self._normalize_ids(found)
+
+        # 快速路径：绝大多数答案可以直接查表得到规范编号
+        get_raw = found.get
+        answers = [table.get(get_raw(key)) for table, key in zip(self._lookup, self._id_keys)]
+        statuses = [STATUS_OK] * num_questions
+        missing = invalid = 0
+        for index, answer in enumerate(answers):
+            if answer is not None:
+                continue
+            raw_answer = get_raw(self._id_keys[index])
+            if raw_answer is None:
+                answers[index] = ERROR_MISSING
+                statuses[index] = STATUS_MISSING
+                missing += 1
+                continue
+            answer = self._validate(index, raw_answer)
+            if answer is None:
+                answers[index] = ERROR_INVALID
+                statuses[index] = STATUS_INVALID
+                invalid += 1
+            else:
+                answers[index] = answer
+
+        stats["answers_ok"] += num_questions - missing - invalid
+        stats["answers_invalid"] += invalid
+        stats["answers_missing"] += missing
+        # 非空行数按 "总行数 - 连续换行数" 估算，避免再扫描一遍文本
+        lines = response_text.count("\n") + 1 - response_text.count("\n\n")
+        stats["unparsed_lines"] += max(lines - len(pairs), 0)
+        return answers, statuses
+
+    def _normalize_ids(self, found):
+        """处理全角数字、前导零等写法的题号，并统计问卷中不存在的题号"""
+        normalized = {}
+        for q_id, raw_answer in found.items():
+            key = str(int(q_id))
+            if key in self._id_key_set:
+                normalized[key] = raw_answer
+            else:
+                self.stats["unknown_question_ids"] += 1
+        return normalized
+
+    def parse_answers(self, response_text):
+        """只返回答案列表，与旧版 parse_llm_response 的返回值兼容"""
+        return self.parse(response_text)[0]
+
+    def parse_logprobs(self, result):
+        """
+        解析 llm_interface.get_llm_logprobs 的结果，返回 (答案列表, 分布列表)。
+        答案取自贪心解码的文本；分布为每题各选项的概率（按选项顺序，已在选项上归一化），
+        无法得到分布的题目（未作答、开放题、候选token中没有任何选项）为None
+        """
+        distributions = [None] * len(self.question_ids)
+        if not result:
+            return self.parse_answers(None), distributions
+        text = result["text"]
+        answers = self.parse_answers(text)
+        tokens = result["tokens"]
+        token_starts = []
+        offset = 0
+        for _, byte_length, _ in tokens:
+            token_starts.append(offset)
+            offset += byte_length
+
+        for match in _ANSWER_LINE.finditer("\n" + text):
+            index = self._index_of.get(str(int(match.group(1))))
+            if index is None or not self._codes[index]:
+                continue
+            # 补在开头的换行符使位置多1
+            byte_offset = len(text[:match.start(2) - 1].encode("utf-8"))
+            position = bisect.bisect_right(token_starts, byte_offset) - 1
+            distribution = self._token_distribution(index, tokens, position)
+            if distribution is not None:
+                distributions[index] = distribution
+        return answers, distributions
+
+    def _token_distribution(self, index, tokens, position):
+        """从答案位置开始，跳过只含分隔符/括号的token，把候选token的概率累加到对应选项上"""
+        codes = self._codes[index]
+        for token, _, alternatives in tokens[max(position, 0):position + 3]:
+            if _token_option(token, codes) is None:
+                if token.strip(_TOKEN_PREFIX):
+                    return None
+                continue
+            probabilities = [0.0] * len(self._labels[index])
+            mass = 0.0
+            for alt_token, logprob in alternatives:
+                code = _token_option(alt_token, codes)
+                if code:
+                    p = math.exp(logprob)
+                    probabilities[code - 1] += p
+                    mass += p
+            return [p / mass for p in probabilities] if mass > 0 else None
+        return None
+
+    def answer_stream(self, question_ids=None):
+        """创建流式回复的增量解析器，question_ids 为本次请求包含的题目（默认整份问卷）"""
+        return AnswerStream(self, question_ids)
+
+    def _is_valid(self, index, raw_answer):
+        return self._lookup[index].get(raw_answer) is not None or self._validate(index, raw_answer) is not None
+
+    def _validate(self, index, raw_answer):
+        """清洗答案（全角转半角、去括号、取开头编号）后校验，合法时返回规范化的选项编号，否则返回None"""
+        raw_answer = raw_answer.rstrip()
+        if not raw_answer.isascii():
+            raw_answer = raw_answer.translate(_FULLWIDTH)
+        codes = self._codes[index]
+        if not codes:
+            # 没有选项的开放题：任何非空答案都接受
+            answer = raw_answer.strip(_ANSWER_WRAPPERS)
+            return answer or None
+        code = codes.get(raw_answer) or codes.get(raw_answer.strip(_ANSWER_WRAPPERS))
+        if code is None:
+            match = _ANSWER_LABEL.match(raw_answer)
+            if match:
+                code = codes.get(match.group(1).upper())
+        if code is None:
+            return None
+        return self._labels[index][code - 1]
+
+
+class AnswerStream:
+    """
+    流式回复的增量解析：逐段喂入文本，每读完一行就检查其中的答案，
+    期望的题目全部得到合法答案后 complete 为 True，调用方即可提前结束生成。
+    只做判断，不计入解析统计；完整文本 (text) 仍由 SurveyParser.parse 正式解析
+    """
+
+    def __init__(self, parser, question_ids=None):
+        self.parser = parser
+        ids = parser._id_keys if question_ids is None else [str(int(q_id)) for q_id in question_ids]
+        self._remaining = set(ids)
+        self._parts = []
+        self._line = "" # 尚未读完的一行
+
+    @property
+    def complete(self):
+        return not self._remaining
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+    def feed(self, delta):
+        """喂入一段文本，返回是否已经齐全；未以换行结束的最后一行暂不解析（"1" 可能是 "10" 的开头）"""
+        if not delta:
+            return self.complete
+        self._parts.append(delta)
+        if "\n" not in delta:
+            self._line += delta
+            return self.complete
+        lines = (self._line + delta).split("\n")
+        self._line = lines.pop()
+        for line in lines:
+            match = _ANSWER_LINE.match("\n" + line)
+            if match is None:
+                continue
+            key = str(int(match.group(1)))
+            index = self.parser._index_of.get(key)
+            if index is not None and key in self._remaining and self.parser._is_valid(index, match.group(2).rstrip()):
+                self._remaining.discard(key)
+        return self.complete
+
+
+def canonical_labels(question):
+    """每个选项的规范编号：选项自带编号（如 "A"）时用它，否则用序号"""
+    labels = []
+    for index, option in enumerate(question.get('options', []), start=1):
+        label = persona_loader.option_label(option)
+        labels.append(label if label is not None else str(index))
+    return labels
+
+
+def _token_option(token, codes):
+    """候选token对应的选项序号，例如 "：3"、" B" -> 对应选项；不是选项编号时返回None"""
+    token = token.lstrip(_TOKEN_PREFIX)
+    if not token.isascii():
+        token = token.translate(_FULLWIDTH)
+    match = _TOKEN_LABEL.match(token)
+    return codes.get(match.group(0).upper()) if match else None
+
+
+def status_of(value):
+    """CSV中的答案值 -> 状态码"""
+    return STATUS_OF_VALUE.get(value, STATUS_OK)
+
+
+def format_stats(stats):
+    total = stats["answers_ok"] + stats["answers_missing"] + stats["answers_invalid"]
+    ok_ratio = stats["answers_ok"] / total if total else 0
+    return (
+        f"解析 {stats['responses']} 条回复（无回复 {stats['no_response']}），"
+        f"有效答案 {stats['answers_ok']}/{total} ({ok_ratio:.1%})，"
+        f"缺失 {stats['answers_missing']}，无效 {stats['answers_invalid']}，"
+        f"无法解析的行 {stats['unparsed_lines']}，未知题号 {stats['unknown_question_ids']}"
+    )
@@ -0,0 +1,369 @@
+# batch_runner.py
+import json
+import os
+import re
+import time
+import uuid
+import config
+import answer_parser
+import llm_interface
+import result_sink
+import survey_planner
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def make_custom_id(persona_type, persona_id, model_name, sample_indices, chunk_index=0):
+    return json.dumps(
+        [persona_type, str(persona_id), model_name, list(sample_indices), chunk_index], ensure_ascii=False
+    )
+
+
+def parse_custom_id(custom_id):
+    """
+    返回 (persona_type, persona_id, model_name, sample_indices, chunk_index)；
+    旧版ID没有样本序号和问卷分块序号，即第0个样本、第0块
+    """
+    fields = json.loads(custom_id)
+    defaults = [[0], 0]
+    fields += defaults[len(fields) - 3:]
+    persona_type, persona_id, model_name, sample_indices, chunk_index = fields
+    return persona_type, persona_id, model_name, sample_indices, chunk_index
+
+
+# --- 批处理后端 ---
+class OpenAIBatchBackend:
+    """通过 OpenAI Batch API 提交和查询批处理任务"""
+
+    def __init__(self, base_url=None, api_key=None):
+        self.client = llm_interface.get_openai_client(
+            "openai", base_url or config.OPENAI_BASE_URL, api_key or config.OPENAI_API_KEY
+        )
+
+    def upload(self, path):
+        with open(path, 'rb') as f:
+            return self.client.files.create(file=f, purpose="batch").id
+
+    def create(self, input_file_id):
+        batch = self.client.batches.create(
+            input_file_id=input_file_id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=config.BATCH_COMPLETION_WINDOW,
+        )
+        return batch.id
+
+    def retrieve(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        return {
+            "status": batch.status,
+            "output_file_id": batch.output_file_id,
+            "error_file_id": batch.error_file_id,
+        }
+
+    def content(self, file_id):
+        return self.client.files.content(file_id).text
+
+
+def _canned_answers(body):
+    """本地替身的默认回复：对提示词中出现的每个题号回答第一个选项"""
+    prompt = body["messages"][-1]["content"]
+    question_ids = re.findall(r"^(\d+)\. ", prompt, flags=re.MULTILINE)
+    return "\n".join(f"{q_id}：1" for q_id in question_ids)
+
+
+class LocalBatchBackend:
+    """离线测试用的批处理替身：在本地目录中模拟上传、排队、完成和下载"""
+
+    def __init__(self, work_dir=os.path.join(config.BATCH_DIR, "local"), responder=_canned_answers, polls_until_done=1):
+        self.work_dir = work_dir
+        self.responder = responder
+        self.polls_until_done = polls_until_done
+        os.makedirs(work_dir, exist_ok=True)
+
+    def _path(self, object_id):
+        return os.path.join(self.work_dir, object_id)
+
+    def upload(self, path):
+        file_id = f"file-local-{uuid.uuid4().hex}"
+        with open(path, 'rb') as src, open(self._path(file_id), 'wb') as dst:
+            dst.write(src.read())
+        return file_id
+
+    def create(self, input_file_id):
+        batch_id = f"batch-local-{uuid.uuid4().hex}"
+        with open(self._path(batch_id), 'w', encoding='utf-8') as f:
+            json.dump({"input_file_id": input_file_id, "polls": 0, "output_file_id": None}, f)
+        return batch_id
+
+    def retrieve(self, batch_id):
+        with open(self._path(batch_id), 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        state["polls"] += 1
+        if state["output_file_id"] is None and state["polls"] > self.polls_until_done:
+            state["output_file_id"] = self._run(state["input_file_id"])
+        with open(self._path(batch_id), 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        status = "completed" if state["output_file_id"] else "in_progress"
+        return {"status": status, "output_file_id": state["output_file_id"], "error_file_id": None}
+
+    def _run(self, input_file_id):
+        output_file_id = f"file-local-{uuid.uuid4().hex}"
+        with open(self._path(input_file_id), 'r', encoding='utf-8') as src, \
+                open(self._path(output_file_id), 'w', encoding='utf-8') as dst:
+            for line in src:
+                request = json.loads(line)
+                completion = {
+                    "object": "chat.completion",
+                    "model": request["body"]["model"],
+                    "choices": [{
+                        "index": index,
+                        "message": {"role": "assistant", "content": self.responder(request["body"])},
+                        "finish_reason": "stop",
+                    } for index in range(request["body"].get("n", 1))],
+                }
+                dst.write(json.dumps({
+                    "id": f"batch_req_{uuid.uuid4().hex}",
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "body": completion},
+                    "error": None,
+                }, ensure_ascii=False) + "\n")
+        return output_file_id
+
+    def content(self, file_id):
+        with open(self._path(file_id), 'r', encoding='utf-8') as f:
+            return f.read()
+
+
+def get_batch_backend(name=None):
+    name = name or config.BATCH_BACKEND
+    if name == "openai":
+        return OpenAIBatchBackend()
+    if name == "local":
+        return LocalBatchBackend()
+    raise ValueError(f"未知的批处理后端 '{name}'，可选值为 'openai' 或 'local'")
+
+
+# --- 生成批处理文件 ---
+def render_batch_files(simulation_tasks, plans, models_to_run, manifest, batch_dir=None):
+    """
+    将所有未完成的 (persona, model) 单元渲染为批处理JSONL文件，一个单元尚缺的全部样本用 n 合并为一个请求，
+    问卷分块时每块一个请求（plans: persona_type -> survey_planner.SurveyPlan）。
+    每个文件只含一个模型，并按请求数和字节数上限切分。返回 [(文件路径, 模型), ...]
+    """
+    batch_dir = batch_dir or config.BATCH_DIR
+    os.makedirs(batch_dir, exist_ok=True)
+    run_tag = time.strftime("%Y%m%d_%H%M%S")
+    open_files = {} # model_name -> [file, path, 请求数, 字节数, 序号]
+    batch_files = []
+
+    def rotate(model_name):
+        current = open_files.get(model_name)
+        part = 1
+        if current:
+            current[0].close()
+            part = current[4] + 1
+        safe_model = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+        path = os.path.join(batch_dir, f"batch_{run_tag}_{safe_model}_{part:03d}.jsonl")
+        open_files[model_name] = [open(path, 'w', encoding='utf-8'), path, 0, 0, part]
+        batch_files.append((path, model_name))
+
+    try:
+        for persona_type, personas, prompt_template in simulation_tasks:
+            prompt_builders = plans[persona_type].prompt_builders(prompt_template)
+            for persona in personas:
+                final_prompts = None
+                for provider, model_list in models_to_run.items():
+                    if provider != "openai":
+                        continue
+                    for model_name in model_list:
+                        sample_indices = manifest.pending_samples(
+                            persona['id'], persona_type, model_name, config.SAMPLES_PER_UNIT
+                        )
+                        if not sample_indices:
+                            continue
+                        if final_prompts is None:
+                            final_prompts = [build_prompt(persona['description']) for build_prompt in prompt_builders]
+                        extra_params = llm_interface.text_request_params(
+                            {"n": len(sample_indices)} if len(sample_indices) > 1 else None
+                        )
+                        for chunk_index, final_prompt in enumerate(final_prompts):
+                            line = json.dumps({
+                                "custom_id": make_custom_id(
+                                    persona_type, persona['id'], model_name, sample_indices, chunk_index
+                                ),
+                                "method": "POST",
+                                "url": BATCH_ENDPOINT,
+                                "body": llm_interface.build_chat_request(
+                                    final_prompt, model_name, config.TEMPERATURE,
+                                    plans[persona_type].max_tokens(chunk_index), extra_params
+                                ),
+                            }, ensure_ascii=False) + "\n"
+                            size = len(line.encode('utf-8'))
+                            current = open_files.get(model_name)
+                            if (current is None or current[2] >= config.BATCH_MAX_REQUESTS_PER_FILE
+                                    or current[3] + size > config.BATCH_MAX_FILE_BYTES):
+                                rotate(model_name)
+                                current = open_files[model_name]
+                            current[0].write(line)
+                            current[2] += 1
+                            current[3] += size
+    finally:
+        for current in open_files.values():
+            current[0].close()
+
+    skipped = [p for p in models_to_run if p != "openai"]
+    if skipped:
+        print(f"警告：批处理模式仅支持 OpenAI 兼容接口，已跳过供应商: {', '.join(skipped)}")
+    return batch_files
+
+
+# --- 任务状态 ---
+def _jobs_path(batch_dir):
+    return os.path.join(batch_dir or config.BATCH_DIR, "batch_jobs.json")
+
+
+def load_jobs(batch_dir=None):
+    path = _jobs_path(batch_dir)
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_jobs(jobs, batch_dir=None):
+    """按 batch_id 合并写入任务记录"""
+    merged = {job["batch_id"]: job for job in load_jobs(batch_dir)}
+    for job in jobs:
+        merged[job["batch_id"]] = job
+    jobs = list(merged.values())
+    # 先写临时文件再替换，避免中断时留下损坏的状态文件
+    path = _jobs_path(batch_dir)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(jobs, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def submit_batch_files(batch_files, backend, batch_dir=None):
+    """上传并提交批处理文件，返回任务记录列表"""
+    jobs = []
+    for path, model_name in batch_files:
+        input_file_id = backend.upload(path)
+        batch_id = backend.create(input_file_id)
+        print(f"  已提交批处理任务 {batch_id} ({model_name}, {os.path.basename(path)})")
+        jobs.append({
+            "batch_id": batch_id,
+            "model": model_name,
+            "input_path": path,
+            "input_file_id": input_file_id,
+            "status": "submitted",
+            "ingested": False,
+        })
+        save_jobs([jobs[-1]], batch_dir)
+    return jobs
+
+
+def poll_batches(jobs, backend, poll_interval=None, batch_dir=None):
+    """轮询直到所有任务进入终止状态"""
+    poll_interval = config.BATCH_POLL_INTERVAL if poll_interval is None else poll_interval
+    while True:
+        active = [job for job in jobs if job["status"] not in TERMINAL_STATUSES]
+        if not active:
+            return jobs
+        for job in active:
+            info = backend.retrieve(job["batch_id"])
+            job.update(info)
+        save_jobs(jobs, batch_dir)
+        waiting = [job for job in jobs if job["status"] not in TERMINAL_STATUSES]
+        if waiting:
+            print(f"  {len(waiting)} 个批处理任务进行中，{poll_interval} 秒后再次查询...")
+            time.sleep(poll_interval)
+
+
+def ingest_batch_output(job, backend, parser, plans, writers, manifest, partial_units):
+    """
+    读取批处理输出，解析后写入对应的结果CSV，返回写入的行数。
+    问卷分块时同一单元的各块可能分布在不同文件中，先暂存在 partial_units 中，凑齐所有块后再合并写入
+    """
+    written = 0
+    for file_id in (job.get("output_file_id"), job.get("error_file_id")):
+        if not file_id:
+            continue
+        for line in backend.content(file_id).splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            persona_type, persona_id, model_name, sample_indices, chunk_index = parse_custom_id(record["custom_id"])
+            if persona_type not in writers:
+                continue
+            response = record.get("response") or {}
+            if response.get("status_code") != 200:
+                # 失败的请求不记为完成，下一次运行会重新提交
+                print(f"警告：批处理请求失败 {record['custom_id']}: {record.get('error') or response.get('body')}")
+                continue
+            llm_interface.record_token_usage(model_name, response["body"].get("usage"))
+            choices = sorted(response["body"]["choices"], key=lambda choice: choice["index"])
+            texts = [
+                choice["message"]["content"].strip() if choice["message"]["content"] else None
+                for choice in choices
+            ]
+            plan = plans[persona_type]
+            unit = (persona_type, persona_id, model_name, tuple(sample_indices))
+            chunk_texts = partial_units.setdefault(unit, {})
+            chunk_texts[chunk_index] = texts
+            if len(chunk_texts) < plan.num_chunks:
+                continue
+            del partial_units[unit]
+            # 返回的回复数少于请求的样本数时，缺少的样本不记为完成，下次运行会重新提交
+            num_returned = min(len(chunk_texts[index]) for index in range(plan.num_chunks))
+            for pos, sample_index in enumerate(sample_indices[:num_returned]):
+                if manifest.is_done(persona_id, persona_type, model_name, sample_index):
+                    continue
+                answers_list = plan.parse(parser, [chunk_texts[index][pos] for index in range(plan.num_chunks)])
+                writers[persona_type].write_row([persona_id, persona_type, model_name, sample_index] + answers_list)
+                manifest.mark_done(persona_id, persona_type, model_name, sample_index)
+                written += 1
+    return written
+
+
+def run_batch(simulation_tasks, survey_formatted_local, survey_questions, models_to_run, output_files, manifest, backend=None):
+    """批处理模式：渲染并提交（或继续轮询已提交的）任务，完成后写入结果CSV"""
+    backend = backend or get_batch_backend()
+    parser = answer_parser.SurveyParser(survey_questions)
+    plans = {
+        persona_type: survey_planner.plan_survey(survey_questions, prompt_template, models_to_run, survey_formatted_local)
+        for persona_type, _, prompt_template in simulation_tasks
+    }
+    writers = {}
+    partial_units = {}
+    try:
+        for persona_type, _, _ in simulation_tasks:
+            writers[persona_type] = result_sink.open_result_writer(persona_type, output_files[persona_type], survey_questions)
+            manifest.reconcile(writers[persona_type].existing_keys())
+
+        jobs = [job for job in load_jobs() if not job["ingested"]]
+        if jobs:
+            print(f"\n--- 继续处理 {len(jobs)} 个未完成的批处理任务 ---")
+        else:
+            batch_files = render_batch_files(simulation_tasks, plans, models_to_run, manifest)
+            if not batch_files:
+                print("没有需要提交的批处理请求。")
+                return
+            print(f"\n--- 提交 {len(batch_files)} 个批处理文件 ---")
+            jobs = submit_batch_files(batch_files, backend)
+
+        poll_batches(jobs, backend)
+        for job in jobs:
+            if job["status"] == "completed":
+                written = ingest_batch_output(job, backend, parser, plans, writers, manifest, partial_units)
+                print(f"  批处理任务 {job['batch_id']} 已导入 {written} 行结果。")
+            else:
+                print(f"警告：批处理任务 {job['batch_id']} 状态为 {job['status']}，其中的单元将在下次运行时重新提交。")
+            job["ingested"] = True
+            save_jobs([job])
+        if partial_units:
+            print(f"警告：{len(partial_units)} 个单元的问卷分块未全部成功，这些单元将在下次运行时重新提交。")
+    finally:
+        for writer in writers.values():
+            writer.close()
@@ -0,0 +1,140 @@
+# benchmarks/bench_parser.py
+"""
+解析器微基准：对比 answer_parser.SurveyParser 与旧版逐行 split 解析器的吞吐量。
+
+语料来源（按优先级）：
+  --corpus FILE   JSONL文件，每行是回复字符串或 {"response": "..."}
+  --from-cache    从回复缓存 (config.RESPONSE_CACHE_PATH) 中读取真实回复
+  默认            按问卷生成混合格式（全角、括号、多余说明等）的合成回复
+
+用法: python benchmarks/bench_parser.py --from-cache --repeat 5
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import answer_parser
+import persona_loader
+
+
+def legacy_parse(response_text, num_questions_local):
+    """重构前 main.parse_llm_response 的实现（含逐行打印警告），作为对照基线"""
+    answers = {}
+    if not response_text:
+        return ["ERROR_NO_RESPONSE"] * num_questions_local
+    expected_ids = set(range(1, num_questions_local + 1))
+    found_ids = set()
+    for line in response_text.strip().split('\n'):
+        line = line.strip()
+        if not line: continue
+        parts = line.split('：')
+        if len(parts) != 2:
+            parts = line.split(':')
+        if len(parts) == 2:
+            try:
+                q_id = int(parts[0].strip().replace('题号', '').replace('问题', ''))
+                if q_id in expected_ids:
+                    answers[q_id] = parts[1].strip()
+                    found_ids.add(q_id)
+                else:
+                    print(f"警告：解析到无效题号 {q_id} 在行: '{line}'")
+            except ValueError:
+                print(f"警告：无法解析题号或答案格式不符，行: '{line}'")
+        else:
+            print(f"警告：无法解析行，格式不符: '{line}'")
+    for missing_id in expected_ids - found_ids:
+        answers[missing_id] = "ERROR_MISSING"
+    return [answers.get(i, "ERROR_NOT_FOUND") for i in range(1, num_questions_local + 1)]
+
+
+def synthetic_survey(num_questions):
+    labels = ["1. 非常同意", "2. 同意", "3. 一般", "4. 不同意", "5. 非常不同意"]
+    return [{"id": i, "text": f"问题{i}", "options": labels} for i in range(1, num_questions + 1)]
+
+
+def synthetic_corpus(survey, size, seed=0):
+    rng = random.Random(seed)
+    styles = [
+        lambda q, a: f"{q}：{a}",
+        lambda q, a: f"题号{q}：{a}",
+        lambda q, a: f"{q}: [{a}]",
+        lambda q, a: f"{str(q).translate(str.maketrans('0123456789', '０１２３４５６７８９'))}：{a}",
+        lambda q, a: f"问题{q}：{a}（我比较倾向这个）",
+    ]
+    corpus = []
+    for _ in range(size):
+        style = rng.choice(styles)
+        lines = ["好的，以下是我的回答："] if rng.random() < 0.2 else []
+        for q in survey:
+            if rng.random() < 0.03:
+                continue # 模拟漏答
+            lines.append(style(q["id"], rng.randint(1, len(q["options"]) + (1 if rng.random() < 0.02 else 0))))
+        if rng.random() < 0.1:
+            lines.append("以上就是我的全部回答，谢谢。")
+        corpus.append("\n".join(lines))
+    return corpus
+
+
+def load_corpus(args, survey):
+    if args.corpus:
+        with open(args.corpus, 'r', encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        return [r["response"] if isinstance(r, dict) else r for r in records]
+    if args.from_cache:
+        with sqlite3.connect(config.RESPONSE_CACHE_PATH) as conn:
+            return [row[0] for row in conn.execute("SELECT response FROM responses LIMIT ?", (args.size,))]
+    return synthetic_corpus(survey, args.size)
+
+
+def bench(func, corpus, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for response_text in corpus:
+            func(response_text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def report(label, seconds, count):
+    print(f"{label:<24} {count / seconds:>12,.0f} 条/秒  ({seconds * 1e6 / count:.1f} µs/条)")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="问卷回复解析器微基准")
+    arg_parser.add_argument("--corpus", help="JSONL格式的回复语料")
+    arg_parser.add_argument("--from-cache", action="store_true", help="使用回复缓存中的真实回复")
+    arg_parser.add_argument("--survey", help="问卷JSON文件，默认使用合成问卷")
+    arg_parser.add_argument("--questions", type=int, default=30, help="合成问卷的题目数")
+    arg_parser.add_argument("--size", type=int, default=20000, help="合成语料/缓存读取的条数")
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    survey = persona_loader.load_survey(args.survey) if args.survey else synthetic_survey(args.questions)
+    corpus = load_corpus(args, survey)
+    if not corpus:
+        print("语料为空。")
+        return
+    print(f"语料 {len(corpus)} 条，问卷 {len(survey)} 题")
+
+    parser = answer_parser.SurveyParser(survey)
+    # 旧版解析器的警告打印是其开销的一部分，这里写到 devnull 以免刷屏
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        legacy_time = bench(lambda text: legacy_parse(text, len(survey)), corpus, args.repeat)
+    report("legacy (split+print)", legacy_time, len(corpus))
+    parser_time = bench(parser.parse, corpus, args.repeat)
+    report("SurveyParser", parser_time, len(corpus))
+    print(f"加速比: {legacy_time / parser_time:.2f}x")
+    print(answer_parser.format_stats(parser.stats))
+
+
+if __name__ == "__main__":
+    main()
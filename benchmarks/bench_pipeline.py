@@ -0,0 +1,277 @@
+# benchmarks/bench_pipeline.py
+"""
+端到端吞吐量基准：启动本地替身服务器 (mock_llm_server.py)，在不同画像数量和并发度下运行
+main.run_all_simulations，报告 请求数/秒、p50/p95/p99 请求延迟、解析耗时和峰值内存。
+
+每组参数在独立子进程中运行（峰值内存互不影响），输出文件写在临时目录，不会改动 outputs/。
+
+用法:
+  python benchmarks/bench_pipeline.py --personas 100,1000 --concurrency 8,32,128
+  python benchmarks/bench_pipeline.py --modes async,sequential --latency-ms 50 --rate-limit-rate 0.02 --json bench.json
+  python benchmarks/bench_pipeline.py --token-ms 5 --ramble-tokens 300 --stream   # 对比流式提前断开
+  python benchmarks/bench_pipeline.py --stall-rate 0.02 --stall-ms 3000 --hedge     # 对比对冲请求对长尾的影响
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+BENCH_MODEL = "gpt-4o"
+
+
+def percentile(values, q):
+    """线性插值的分位数，values 为空时返回None"""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+# --- 子进程：运行一组参数 ---
+def _instrument(llm_interface, answer_parser):
+    """包装API调用和解析函数以记录耗时，只在基准子进程中使用"""
+    latencies = []
+    parse_time = [0.0]
+
+    def timed(func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - start)
+        return wrapper
+
+    def timed_async(func):
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - start)
+        return wrapper
+
+    original_parse = answer_parser.SurveyParser.parse
+
+    def timed_parse(self, response_text):
+        start = time.perf_counter()
+        try:
+            return original_parse(self, response_text)
+        finally:
+            parse_time[0] += time.perf_counter() - start
+
+    # 按一次逻辑调用计时（含对冲请求和故障转移），被取消的对冲请求不单独计入
+    llm_interface._call_openai = timed(llm_interface._call_openai)
+    llm_interface._call_openai_async = timed_async(llm_interface._call_openai_async)
+    answer_parser.SurveyParser.parse = timed_parse
+    return latencies, parse_time
+
+
+def run_worker(params):
+    work_dir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    os.chdir(work_dir) # config 中的 outputs/ 等相对路径都落在临时目录
+    os.environ.update({
+        "OPENAI_BASE_URL": params["base_url"],
+        "OPENAI_API_KEY": "sk-mock",
+        "RESPONSE_CACHE_MODE": "off",
+        "RESUME_RUNS": "0",
+        "STREAM_RESPONSES": "1" if params.get("stream") else "0",
+        "HEDGE_REQUESTS": "1" if params.get("hedge") else "0",
+    })
+    sys.path.insert(0, REPO_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    import config
+    import answer_parser
+    import llm_interface
+    import main as simulation
+    import persona_loader
+    from bench_parser import synthetic_survey
+
+    concurrency = params["concurrency"]
+    config.MAX_CONCURRENT_REQUESTS = concurrency
+    config.PROVIDER_CONCURRENCY = {"openai": concurrency}
+    config.MODEL_CONCURRENCY = {BENCH_MODEL: concurrency}
+    config.RATE_LIMITS = {BENCH_MODEL: {"rpm": 10 ** 7, "tpm": 10 ** 10}}
+    config.HTTP_POOL_MAX_CONNECTIONS = max(config.HTTP_POOL_MAX_CONNECTIONS, concurrency)
+    config.HTTP_POOL_MAX_KEEPALIVE = max(config.HTTP_POOL_MAX_KEEPALIVE, concurrency)
+    latencies, parse_time = _instrument(llm_interface, answer_parser)
+
+    survey = synthetic_survey(params["questions"])
+    personas = [
+        {"id": f"bench_{i}", "description": f"我是第{i}位受访者，今年{20 + i % 50}岁。"}
+        for i in range(params["personas"])
+    ]
+    template = "请以下面的身份回答问卷。\n1. 身份\n{persona_description}\n2. 问卷\n{survey_questions_formatted}\n"
+    output_file = os.path.join(config.OUTPUT_DIR, "results_bench.csv")
+
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        simulation.run_all_simulations(
+            [("bench", personas, template)],
+            persona_loader.format_survey_questions(survey),
+            survey,
+            {"openai": [BENCH_MODEL]},
+            {"bench": output_file},
+            mode=params["mode"],
+            resume=False,
+        )
+    wall = time.perf_counter() - start
+
+    usage = llm_interface.get_token_usage().get(BENCH_MODEL, {})
+    requests = usage.get("requests", 0)
+    with open(output_file, "r", encoding="utf-8") as f:
+        rows = sum(1 for _ in f) - 1
+    return {
+        "mode": params["mode"],
+        "personas": params["personas"],
+        "concurrency": concurrency,
+        "rows": rows,
+        "requests": requests,
+        "wall_s": wall,
+        "requests_per_s": requests / wall if wall else None,
+        "latency_p50_ms": _ms(percentile(latencies, 50)),
+        "latency_p95_ms": _ms(percentile(latencies, 95)),
+        "latency_p99_ms": _ms(percentile(latencies, 99)),
+        "parse_us_per_row": parse_time[0] * 1e6 / rows if rows else None,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, # Linux 下单位为KB
+    }
+
+
+def _ms(seconds):
+    return seconds * 1000 if seconds is not None else None
+
+
+# --- 主进程：启动替身服务器并遍历参数组合 ---
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_server(args):
+    port = _free_port()
+    command = [
+        sys.executable, os.path.join(BENCH_DIR, "mock_llm_server.py"),
+        "--port", str(port),
+        "--latency", args.latency,
+        "--latency-ms", str(args.latency_ms),
+        "--latency-sigma", str(args.latency_sigma),
+        "--error-rate", str(args.error_rate),
+        "--rate-limit-rate", str(args.rate_limit_rate),
+        "--seed", "0",
+        "--token-ms", str(args.token_ms),
+        "--ramble-tokens", str(args.ramble_tokens),
+        "--stall-rate", str(args.stall_rate),
+        "--stall-ms", str(args.stall_ms),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline() # 启动完成后打印一行地址
+    if not line:
+        raise RuntimeError("替身服务器启动失败")
+    return process, f"http://127.0.0.1:{port}/v1"
+
+
+def run_case(params):
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", json.dumps(params)],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    )
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        print(f"  参数组合 {params} 运行失败 (退出码 {completed.returncode})")
+        return None
+    return json.loads(lines[-1])
+
+
+def _fmt(value, spec):
+    return format(value, spec) if value is not None else "-"
+
+
+def print_table(results):
+    header = (f"{'mode':<11}{'personas':>9}{'conc':>6}{'rows':>8}{'req/s':>9}"
+              f"{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'parse µs/行':>12}{'RSS MB':>9}")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['mode']:<11}{r['personas']:>9}{r['concurrency']:>6}{r['rows']:>8}"
+            f"{_fmt(r['requests_per_s'], '>9.1f')}{_fmt(r['latency_p50_ms'], '>9.1f')}"
+            f"{_fmt(r['latency_p95_ms'], '>9.1f')}{_fmt(r['latency_p99_ms'], '>9.1f')}"
+            f"{_fmt(r['parse_us_per_row'], '>12.1f')}{_fmt(r['peak_rss_mb'], '>9.1f')}"
+        )
+
+
+def _int_list(value):
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="模拟流水线端到端吞吐量基准（使用本地替身服务器）")
+    arg_parser.add_argument("--personas", type=_int_list, default=[100, 1000], help="画像数量，逗号分隔")
+    arg_parser.add_argument("--concurrency", type=_int_list, default=[8, 32, 128], help="并发度，逗号分隔")
+    arg_parser.add_argument("--modes", default="async", help="执行模式，逗号分隔: async,sequential")
+    arg_parser.add_argument("--questions", type=int, default=30)
+    arg_parser.add_argument("--latency", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    arg_parser.add_argument("--latency-ms", type=float, default=100)
+    arg_parser.add_argument("--latency-sigma", type=float, default=0.5)
+    arg_parser.add_argument("--error-rate", type=float, default=0.0)
+    arg_parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    arg_parser.add_argument("--token-ms", type=float, default=0.0, help="替身服务器每生成一个token的耗时（毫秒）")
+    arg_parser.add_argument("--ramble-tokens", type=int, default=0, help="替身服务器在答案后追加的说明文字长度")
+    arg_parser.add_argument("--stream", action="store_true", help="开启流式请求（答案齐全即断开）")
+    arg_parser.add_argument("--stall-rate", type=float, default=0.0, help="替身服务器额外卡住 --stall-ms 的请求比例")
+    arg_parser.add_argument("--stall-ms", type=float, default=5000)
+    arg_parser.add_argument("--hedge", action="store_true", help="开启对冲请求（HEDGE_REQUESTS）")
+    arg_parser.add_argument("--base-url", help="使用已在运行的替身服务器，而不是自动启动")
+    arg_parser.add_argument("--json", help="把结果另存为JSON，便于对比不同版本")
+    arg_parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(json.loads(args.worker))))
+        return
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server, base_url = start_mock_server(args)
+    results = []
+    try:
+        modes = [mode for mode in args.modes.split(",") if mode]
+        for mode, personas, concurrency in itertools.product(modes, args.personas, args.concurrency):
+            if mode == "sequential" and concurrency != args.concurrency[0]:
+                continue # 顺序模式与并发度无关，只跑一次
+            print(f"运行 mode={mode} personas={personas} concurrency={concurrency} ...", flush=True)
+            result = run_case({
+                "base_url": base_url, "mode": mode, "personas": personas,
+                "concurrency": concurrency, "questions": args.questions, "stream": args.stream,
+                "hedge": args.hedge,
+            })
+            if result:
+                results.append(result)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print()
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+# benchmarks/mock_llm_server.py
+"""
+本地 OpenAI 兼容替身服务器，用于离线测量流水线自身的开销，不产生任何API费用。
+
+- POST /v1/chat/completions：按提示词中的题目（"N. 题目" 格式）逐题随机选择一个选项作答，
+  支持 n、logprobs/top_logprobs、stop、stream 和 max_tokens 截断，返回 usage 及 x-ratelimit-* 响应头；
+  可在答案后追加一段"啰嗦"的说明文字并按每token耗时模拟生成速度，用于衡量停止序列和流式提前断开的效果
+- 延迟分布可配置（fixed / uniform / lognormal），可按比例注入 429 和 500 错误，以及卡住很久才返回的"掉队"请求
+- GET /v1/models、GET /stats：模型列表和服务器端计数
+
+用法:
+  python benchmarks/mock_llm_server.py --port 8765 --latency lognormal --latency-ms 400 --rate-limit-rate 0.02
+  然后设置 OPENAI_BASE_URL=http://127.0.0.1:8765/v1 运行 main.py
+"""
+import argparse
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_QUESTION = re.compile(r"^(\d+)\. .*\n[ \t]*(.*)$", re.MULTILINE)
+_OPTION_LABEL = re.compile(r"(?:^|\s)([0-9A-Za-z]{1,3})[.．、)）]")
+
+
+class MockSettings:
+    """替身服务器的行为参数"""
+
+    def __init__(self, latency="lognormal", latency_ms=300.0, latency_sigma=0.5, error_rate=0.0,
+                 rate_limit_rate=0.0, retry_after_ms=500, missing_rate=0.0, seed=None, token_ms=0.0, ramble_tokens=0,
+                 stall_rate=0.0, stall_ms=5000.0):
+        self.latency = latency
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after_ms = retry_after_ms
+        self.missing_rate = missing_rate # 每道题漏答的概率
+        self.token_ms = token_ms # 每生成一个token的耗时
+        self.ramble_tokens = ramble_tokens # 答案之后追加的说明文字长度
+        self.stall_rate = stall_rate # 额外卡住 stall_ms 的请求比例，模拟长尾
+        self.stall_ms = stall_ms
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "ok": 0, "rate_limited": 0, "errors": 0, "streams_cancelled": 0}
+
+    def sample_latency(self):
+        """返回本次请求的延迟秒数"""
+        with self.lock:
+            if self.latency == "fixed":
+                delay = self.latency_ms
+            elif self.latency == "uniform":
+                delay = self.rng.uniform(0, 2 * self.latency_ms)
+            else:
+                # latency_ms 为中位数
+                delay = self.rng.lognormvariate(math.log(max(self.latency_ms, 1e-3)), self.latency_sigma)
+            if self.stall_rate and self.rng.random() < self.stall_rate:
+                delay += self.stall_ms
+        return delay / 1000
+
+    def roll(self):
+        """决定本次请求的结果: "ok"、"rate_limited" 或 "error" """
+        with self.lock:
+            self.counts["requests"] += 1
+            value = self.rng.random()
+            if value < self.rate_limit_rate:
+                outcome = "rate_limited"
+            elif value < self.rate_limit_rate + self.error_rate:
+                outcome = "error"
+            else:
+                outcome = "ok"
+            self.counts[outcome if outcome != "error" else "errors"] += 1
+            return outcome
+
+    def choose(self, options):
+        with self.lock:
+            return self.rng.choice(options)
+
+    def skip(self):
+        with self.lock:
+            return self.rng.random() < self.missing_rate
+
+
+def canned_answer(prompt, settings):
+    """对提示词中的每道题随机选一个选项，按 "题号N：选项" 逐行作答"""
+    lines = []
+    for q_id, options_line in _QUESTION.findall(prompt):
+        if settings.skip():
+            continue
+        labels = _OPTION_LABEL.findall(options_line) or ["1"]
+        lines.append(f"{q_id}：{settings.choose(labels)}")
+    return "\n".join(lines)
+
+
+_RAMBLE = "以上就是我的回答。补充说明一下，我在回答时考虑了自己的实际情况和平时的想法，"
+
+
+def _ramble(length):
+    """模拟模型在答案之后继续输出的说明文字（中文约每字1个token）"""
+    return "\n\n" + (_RAMBLE * (length // len(_RAMBLE) + 1))[:length]
+
+
+def _apply_stop(content, stop):
+    """在第一个停止序列处截断，返回 (文本, 是否命中)"""
+    if isinstance(stop, str):
+        stop = [stop]
+    positions = [content.find(sequence) for sequence in stop or [] if sequence]
+    positions = [position for position in positions if position >= 0]
+    if not positions:
+        return content, False
+    return content[:min(positions)], True
+
+
+def _estimate_tokens(text):
+    ascii_chars = sum(1 for ch in text if ch.isascii())
+    return (len(text) - ascii_chars) + ascii_chars // 4 + 1
+
+
+def _logprobs_for(content, top_logprobs):
+    """把回复切成单字符token，答案位置给出几个候选选项的概率"""
+    tokens = []
+    for ch in content:
+        alternatives = [{"token": ch, "logprob": math.log(0.7), "bytes": list(ch.encode("utf-8"))}]
+        if ch.isalnum() and top_logprobs > 1:
+            others = [c for c in "12345ABCDE" if c != ch][:top_logprobs - 1]
+            weight = 0.3 / len(others)
+            alternatives += [{"token": c, "logprob": math.log(weight), "bytes": [ord(c)]} for c in others]
+        tokens.append({
+            "token": ch, "logprob": alternatives[0]["logprob"], "bytes": list(ch.encode("utf-8")),
+            "top_logprobs": alternatives[:top_logprobs],
+        })
+    return {"content": tokens}
+
+
+def generate_contents(body, settings):
+    """每个 choice 的 (回复文本, finish_reason)，已按 stop 和 max_tokens 截断"""
+    prompt = body["messages"][-1]["content"]
+    max_tokens = body.get("max_tokens") or 4096
+    contents = []
+    for _ in range(body.get("n") or 1):
+        content = canned_answer(prompt, settings)
+        if settings.ramble_tokens:
+            content += _ramble(settings.ramble_tokens)
+        content, _ = _apply_stop(content, body.get("stop"))
+        finish_reason = "stop"
+        if _estimate_tokens(content) > max_tokens:
+            # 按 max_tokens 粗略截断
+            content = content[:max_tokens * 2]
+            finish_reason = "length"
+        contents.append((content, finish_reason))
+    return contents
+
+
+def _usage(body, contents):
+    prompt_tokens = sum(_estimate_tokens(m["content"]) for m in body["messages"])
+    completion_tokens = sum(_estimate_tokens(content) for content, _ in contents)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def build_completion(body, settings, contents=None):
+    contents = contents or generate_contents(body, settings)
+    choices = []
+    for index, (content, finish_reason) in enumerate(contents):
+        choice = {
+            "index": index,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": finish_reason,
+        }
+        if body.get("logprobs"):
+            choice["logprobs"] = _logprobs_for(content, body.get("top_logprobs") or 1)
+        choices.append(choice)
+    return {
+        "id": f"chatcmpl-mock-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": choices,
+        "usage": _usage(body, contents),
+    }
+
+
+def stream_events(body, contents, settings):
+    """
+    按 SSE 分片依次产出 (等待秒数, 事件数据)。每个字符作为一个token，各 choice 轮流输出，
+    最后是 finish_reason、可选的 usage 分片和 [DONE]
+    """
+    base = {
+        "id": f"chatcmpl-mock-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+    }
+    delay = settings.token_ms / 1000
+    yield 0, {**base, "choices": [
+        {"index": index, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}
+        for index in range(len(contents))
+    ]}
+    longest = max((len(content) for content, _ in contents), default=0)
+    for position in range(longest):
+        deltas = [
+            {"index": index, "delta": {"content": content[position]}, "finish_reason": None}
+            for index, (content, _) in enumerate(contents) if position < len(content)
+        ]
+        yield delay, {**base, "choices": deltas}
+    yield 0, {**base, "choices": [
+        {"index": index, "delta": {}, "finish_reason": finish_reason}
+        for index, (_, finish_reason) in enumerate(contents)
+    ]}
+    if (body.get("stream_options") or {}).get("include_usage"):
+        yield 0, {**base, "choices": [], "usage": _usage(body, contents)}
+
+
+_RATE_LIMIT_HEADERS = {
+    "x-ratelimit-limit-requests": "100000",
+    "x-ratelimit-remaining-requests": "99999",
+    "x-ratelimit-limit-tokens": "100000000",
+    "x-ratelimit-remaining-tokens": "99999999",
+}
+
+
+def make_handler(settings):
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # 支持长连接，与真实接口一致
+        disable_nagle_algorithm = True # 响应头和正文分两次写出，不关闭 Nagle 会与延迟确认叠加出约40ms的额外延迟
+
+        def _send_json(self, status, payload, headers=None):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            try:
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                # 客户端已取消请求（例如对冲请求中落后的一方）
+                self.close_connection = True
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+            elif self.path.rstrip("/").endswith("/stats"):
+                with settings.lock:
+                    self._send_json(200, dict(settings.counts))
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("content-length", 0))
+            raw_body = self.rfile.read(length)
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            try:
+                body = json.loads(raw_body)
+            except json.JSONDecodeError:
+                self._send_json(400, {"error": {"message": "invalid json", "type": "invalid_request_error"}})
+                return
+            time.sleep(settings.sample_latency())
+            outcome = settings.roll()
+            if outcome == "rate_limited":
+                self._send_json(
+                    429,
+                    {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error"}},
+                    {"retry-after-ms": str(settings.retry_after_ms)},
+                )
+            elif outcome == "error":
+                self._send_json(500, {"error": {"message": "Internal error (mock)", "type": "server_error"}})
+            elif body.get("stream"):
+                self._send_stream(body)
+            else:
+                contents = generate_contents(body, settings)
+                # 非流式请求要等全部token生成完才返回
+                longest = max((len(content) for content, _ in contents), default=0)
+                time.sleep(settings.token_ms * longest / 1000)
+                self._send_json(200, build_completion(body, settings, contents), _RATE_LIMIT_HEADERS)
+
+        def _send_stream(self, body):
+            self.send_response(200)
+            self.send_header("content-type", "text/event-stream")
+            for name, value in _RATE_LIMIT_HEADERS.items():
+                self.send_header(name, value)
+            # 没有 content-length，以关闭连接表示结束
+            self.send_header("connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            try:
+                for delay, event in stream_events(body, generate_contents(body, settings), settings):
+                    if delay:
+                        time.sleep(delay)
+                    self.wfile.write(b"data: " + json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n\n")
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # 客户端拿到全部答案后提前断开
+                with settings.lock:
+                    settings.counts["streams_cancelled"] += 1
+
+        def log_message(self, format, *args):
+            pass # 压测时不逐条打印访问日志
+
+    return MockHandler
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024 # 高并发时避免连接被拒绝
+
+
+def start_server(settings=None, host="127.0.0.1", port=0):
+    """在后台线程启动替身服务器，返回 (server, base_url)；port=0 时自动选择空闲端口"""
+    settings = settings or MockSettings()
+    server = _MockHTTPServer((host, port), make_handler(settings))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="本地 OpenAI 兼容替身服务器")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8765)
+    arg_parser.add_argument("--latency", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    arg_parser.add_argument("--latency-ms", type=float, default=300, help="固定延迟/均值/中位数（毫秒）")
+    arg_parser.add_argument("--latency-sigma", type=float, default=0.5, help="lognormal 分布的 sigma")
+    arg_parser.add_argument("--error-rate", type=float, default=0.0, help="返回500的比例")
+    arg_parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回429的比例")
+    arg_parser.add_argument("--retry-after-ms", type=int, default=500)
+    arg_parser.add_argument("--missing-rate", type=float, default=0.0, help="每道题漏答的概率")
+    arg_parser.add_argument("--seed", type=int, default=None)
+    arg_parser.add_argument("--token-ms", type=float, default=0.0, help="每生成一个token的耗时（毫秒）")
+    arg_parser.add_argument("--ramble-tokens", type=int, default=0, help="答案之后追加的说明文字长度（token）")
+    arg_parser.add_argument("--stall-rate", type=float, default=0.0, help="额外卡住 --stall-ms 的请求比例")
+    arg_parser.add_argument("--stall-ms", type=float, default=5000)
+    args = arg_parser.parse_args()
+
+    settings = MockSettings(
+        latency=args.latency, latency_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, retry_after_ms=args.retry_after_ms,
+        missing_rate=args.missing_rate, seed=args.seed, token_ms=args.token_ms, ramble_tokens=args.ramble_tokens,
+        stall_rate=args.stall_rate, stall_ms=args.stall_ms,
+    )
+    server, base_url = start_server(settings, args.host, args.port)
+    print(f"替身服务器已启动: {base_url}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,39 @@
 # config.py
+import copy
 import os
-from dotenv import load_dotenv
+from dotenv import dotenv_values, find_dotenv
+
+# 导入本模块没有副作用：.env 只读取不写入 os.environ，输出目录也要到真正运行时才创建（见 prepare_runtime）
+# 已设置的环境变量优先于 .env 中的同名项
+_DOTENV = dotenv_values(find_dotenv())
+
+
+def _getenv(name, default=None):
+    value = os.environ.get(name)
+    if value is None:
+        value = _DOTENV.get(name)
+    return default if value is None else value
 
-load_dotenv()
 
 # --- API Keys ---
 # (保持不变)
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "YOUR_OPENAI_API_KEY_HERE")
-ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "YOUR_ANTHROPIC_API_KEY_HERE")
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", "YOUR_GOOGLE_API_KEY_HERE")
-ZHIPUAI_API_KEY = os.getenv("ZHIPUAI_API_KEY", "YOUR_ZHIPUAI_API_KEY_HERE") # 新增
-BAIDU_API_KEY = os.getenv("BAIDU_API_KEY", "YOUR_BAIDU_API_KEY_HERE")       # 新增
-BAIDU_SECRET_KEY = os.getenv("BAIDU_SECRET_KEY", "YOUR_BAIDU_SECRET_KEY_HERE") # 新增
+OPENAI_API_KEY = _getenv("OPENAI_API_KEY", "YOUR_OPENAI_API_KEY_HERE")
+ANTHROPIC_API_KEY = _getenv("ANTHROPIC_API_KEY", "YOUR_ANTHROPIC_API_KEY_HERE")
+GOOGLE_API_KEY = _getenv("GOOGLE_API_KEY", "YOUR_GOOGLE_API_KEY_HERE")
+ZHIPUAI_API_KEY = _getenv("ZHIPUAI_API_KEY", "YOUR_ZHIPUAI_API_KEY_HERE") # 新增
+BAIDU_API_KEY = _getenv("BAIDU_API_KEY", "YOUR_BAIDU_API_KEY_HERE")       # 新增
+BAIDU_SECRET_KEY = _getenv("BAIDU_SECRET_KEY", "YOUR_BAIDU_SECRET_KEY_HERE") # 新增
 
 # --- API Base URLs ---
 # 添加Base URL配置，同样建议用环境变量设置
 # 在 .env 文件中添加类似:
 # OPENAI_BASE_URL="https://api.your-proxy.com/v1"
 # ZHIPUAI_BASE_URL="https://open.bigmodel.cn/api/paas/v4/" # 智谱官方地址示例
-OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", None) # 默认None表示使用官方地址
-ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL", None)
-GOOGLE_BASE_URL = os.getenv("GOOGLE_BASE_URL", None) # Google Gemini可能不需要设置base_url，取决于库
-ZHIPUAI_BASE_URL = os.getenv("ZHIPUAI_BASE_URL", None) # 新增
-BAIDU_BASE_URL = os.getenv("BAIDU_BASE_URL", None)     # 新增
+OPENAI_BASE_URL = _getenv("OPENAI_BASE_URL", None) # 默认None表示使用官方地址
+ANTHROPIC_BASE_URL = _getenv("ANTHROPIC_BASE_URL", None)
+GOOGLE_BASE_URL = _getenv("GOOGLE_BASE_URL", None) # Google Gemini可能不需要设置base_url，取决于库
+ZHIPUAI_BASE_URL = _getenv("ZHIPUAI_BASE_URL", None) # 新增
+BAIDU_BASE_URL = _getenv("BAIDU_BASE_URL", None)     # 新增
 
 # --- Model Names ---
 # (可以添加更多国内模型)
@@ -53,15 +64,221 @@ DATA_FILES = {
     "cognitive": os.path.join(DATA_DIR, "cognitive_profiles.json"),
 }
 
+# --- Prompt Layout ---
+# "original": 按模板原有顺序；"prefix_cache": 指令和问卷在前、画像在最后，
+# 同类画像共享逐字节相同的前缀，可命中供应商侧的提示词缓存（会改变提示词顺序，对比实验时请保持一致）
+PROMPT_LAYOUT = _getenv("PROMPT_LAYOUT", "original")
+
 # --- Simulation Parameters ---
 # (保持不变)
 TEMPERATURE = 0.8
 MAX_TOKENS_PER_RESPONSE = 500
-REQUEST_DELAY = 1
+REQUEST_DELAY = 1 # 旧版固定延迟，现由下方的限流器取代，仅保留以兼容旧脚本
+
+# --- Response Length ---
+# 按问卷题数推算每次请求的 max_tokens（不超过 MAX_TOKENS_PER_RESPONSE），模型在最后一题后继续说明时不会一直写到上限
+DERIVE_MAX_TOKENS = _getenv("DERIVE_MAX_TOKENS", "1") != "0"
+DERIVED_MAX_TOKENS_SLACK = 40 # 推算值之外额外预留的token数
+# 回复中出现这些字符串时停止生成（OpenAI 最多4个），用于截掉答案之后的说明文字；设为 [] 关闭
+STOP_SEQUENCES = ["\n\n\n", "\n注：", "\n说明：", "\n解释："]
+# 流式请求：边接收边增量解析，本次请求的题目全部得到合法答案后立即断开，节省生成token和等待时间（仅 OpenAI 兼容接口）
+STREAM_RESPONSES = _getenv("STREAM_RESPONSES", "0") != "0"
+
+# --- Scoring Mode ---
+# "sample": 按 TEMPERATURE 采样文本答案（默认）；
+# "logprobs": 对支持 logprobs 的模型只调用一次，读取每题答案位置上各选项token的概率，
+# 结果CSV中保存概率最高的答案，另在 *_distributions.csv 中保存完整的答案分布
+SCORING_MODE = _getenv("SCORING_MODE", "sample")
+LOGPROB_MODELS = ["gpt-4o", "gpt-3.5-turbo"] # 返回 top_logprobs 的模型，其余模型仍按文本采样
+LOGPROB_TOP_K = 20 # 每个位置返回的候选token数（OpenAI上限为20），需不少于选项数
+LOGPROB_TEMPERATURE = 0 # 概率与温度无关，贪心解码使各题答案位置稳定
+
+# --- Survey Chunking ---
+# "auto": 预计回复超出 MAX_TOKENS_PER_RESPONSE 或提示词超出上下文时，把问卷拆成多块并行请求，再按题号合并；"off": 始终整份问卷一次请求
+SURVEY_CHUNKING = _getenv("SURVEY_CHUNKING", "auto")
+MODEL_CONTEXT_TOKENS = {
+    "gpt-4o": 128000,
+    "gpt-3.5-turbo": 16385,
+}
+DEFAULT_CONTEXT_TOKENS = 8192
+ANSWER_TOKENS_PER_QUESTION = 8 # 一行 "题号：选项编号" 约占的token数
+OPEN_ANSWER_TOKENS = 80 # 没有选项的开放题预留的token数
+RESPONSE_TOKEN_MARGIN = 0.8 # 只按 MAX_TOKENS_PER_RESPONSE 的这一比例规划，给模型的额外说明留余量
+PERSONA_TOKEN_ALLOWANCE = 600 # 规划时为画像描述预留的token数
+
+# --- Repair Pass ---
+# 修复环节（python main.py repair，或设置 REPAIR_AFTER_RUN=1 在运行结束后自动执行）：只把结果中缺失/无效的题目
+# 连同原人设再问一次，答案合并回结果CSV的原有行，来源记录在 *_provenance.csv 中
+REPAIR_AFTER_RUN = _getenv("REPAIR_AFTER_RUN", "0") != "0"
+REPAIR_STATUSES = ["ERROR_MISSING", "ERROR_NO_RESPONSE", "ERROR_INVALID"] # 需要修复的答案
+REPAIR_MAX_ROUNDS = 2 # 每个单元最多修复的轮数（跨多次运行累计）
+
+# --- Multi-Sample ---
+# 每个 (人设, 模型) 独立采样的次数，结果中每个样本一行，用 sample_index 区分
+SAMPLES_PER_UNIT = int(_getenv("SAMPLES_PER_UNIT", "1"))
+# 这些模型支持 n>1，一次请求返回多个样本，提示词只发送和计费一次；其余模型逐个样本请求
+MULTI_CHOICE_MODELS = ["gpt-4o", "gpt-3.5-turbo"]
+MAX_CHOICES_PER_REQUEST = 16 # 单次请求的样本数上限，超过时拆成多次请求
+
+# --- Response Cache ---
+# "readwrite": 命中则直接返回，未命中调用API并写入；"replay": 只读回放，未命中不调用API；"off": 关闭
+RESPONSE_CACHE_MODE = _getenv("RESPONSE_CACHE_MODE", "readwrite")
+RESPONSE_CACHE_PATH = os.path.join(OUTPUT_DIR, "response_cache.sqlite")
+RESPONSE_CACHE_MAX_ENTRIES = 1_000_000
+RESPONSE_CACHE_MAX_AGE_DAYS = 90 # None 表示永不过期
+
+# --- Rate Limits ---
+# 按模型设置每分钟请求数(rpm)与每分钟token数(tpm)，会根据响应中的 x-ratelimit-* 头自动校正
+RATE_LIMITS = {
+    "gpt-4o": {"rpm": 500, "tpm": 30000},
+    "gpt-3.5-turbo": {"rpm": 3500, "tpm": 200000},
+}
+DEFAULT_RATE_LIMIT = {"rpm": 60, "tpm": 60000}
+MAX_RETRIES = 5          # 429/超时等暂时性错误的最大重试次数
+RETRY_BASE_DELAY = 1     # 指数退避的基础秒数
+RETRY_MAX_DELAY = 60     # 单次退避的最大秒数
+
+# --- Concurrency Parameters ---
+# 执行模式: "async" 为并发调度（默认），"sequential" 为逐条调用的旧版循环，"batch" 为离线批处理，
+# "queue" 为基于任务队列的多进程/多机运行（见下方 Job Queue）
+EXECUTION_MODE = _getenv("EXECUTION_MODE", "async")
+MAX_CONCURRENT_REQUESTS = 32 # 全局同时在途的请求上限
+# 按供应商/模型限制并发数，未列出的使用默认值
+PROVIDER_CONCURRENCY = {
+    "openai": 16,
+}
+MODEL_CONCURRENCY = {
+    "gpt-4o": 8,
+    "gpt-3.5-turbo": 8,
+}
+DEFAULT_PROVIDER_CONCURRENCY = 8
+DEFAULT_MODEL_CONCURRENCY = 4
+
+# --- Endpoint Routing ---
+# 同一模型可列出多个 OpenAI 兼容端点（官方、代理、本地 Ollama/vLLM），请求按 weight / 观测延迟 加权分配，
+# 某个端点重试后仍失败时转移到其他端点；未列出的模型使用 llm_interface.resolve_provider 中的单一端点
+MODEL_ENDPOINTS = {
+    # "gpt-4o": [
+    #     {"name": "official", "base_url": None, "api_key": OPENAI_API_KEY},
+    #     {"name": "proxy", "base_url": "https://api.your-proxy.com/v1", "api_key": _getenv("PROXY_API_KEY"), "weight": 0.5},
+    # ],
+    # "Qwen2-7B-Instruct": [
+    #     {"name": "vllm-a", "base_url": "http://10.0.0.11:8000/v1", "api_key": "EMPTY"},
+    #     {"name": "vllm-b", "base_url": "http://10.0.0.12:8000/v1", "api_key": "EMPTY"},
+    # ],
+}
+ROUTER_LATENCY_EWMA_ALPHA = 0.2 # 端点延迟滑动平均中最新一次请求的权重
+# 对冲请求（仅并发/队列模式）：耗时超过该模型近期延迟的 HEDGE_LATENCY_PERCENTILE 分位数仍未返回时，向另一个端点
+# （只有一个端点时为同一端点）补发请求，取最先返回的有效结果并取消其余请求；约多发 (100-分位数)% 的请求
+HEDGE_REQUESTS = _getenv("HEDGE_REQUESTS", "0") != "0"
+HEDGE_LATENCY_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20 # 该模型至少完成这么多次请求后才开始补发
+HEDGE_MIN_DELAY = 0.5 # 补发前至少等待的秒数
+HEDGE_MAX_EXTRA = 1 # 每次调用最多补发的请求数
+HEDGE_WINDOW = 1000 # 计算分位数时保留的最近延迟样本数
+
+# --- Circuit Breaker ---
+# 每个供应商（经 MODEL_ENDPOINTS 路由的模型单独计）连续 CIRCUIT_FAILURE_THRESHOLD 次调用失败（已含重试和故障转移）后熔断：
+# CIRCUIT_COOLDOWN 秒内该供应商的单元直接跳过，不写入结果，续跑时重试；冷却结束后放行 CIRCUIT_HALF_OPEN_PROBES 个探测请求，
+# 成功则恢复，失败则冷却时间加倍（最多 CIRCUIT_MAX_COOLDOWN 秒）。无法调用的模型（供应商未实现、Key 未配置）只提示一次并跳过
+CIRCUIT_BREAKER_ENABLED = _getenv("CIRCUIT_BREAKER_ENABLED", "1") != "0"
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_COOLDOWN = 30 # 秒
+CIRCUIT_MAX_COOLDOWN = 600
+CIRCUIT_HALF_OPEN_PROBES = 1
+
+# --- HTTP Connection Pool ---
+# 同步和异步客户端共用的连接池与超时设置
+HTTP_POOL_MAX_CONNECTIONS = 64
+HTTP_POOL_MAX_KEEPALIVE = 32
+HTTP_KEEPALIVE_EXPIRY = 60 # 空闲长连接保留秒数
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_READ_TIMEOUT = 120
 
 # --- Persona Generation Parameters ---
 # (保持不变)
 NUM_PERSONACHAT_SENTENCES = 5
+# 通用人设：按种子从 personachat 句子库中抽取 NUM_PERSONACHAT_SENTENCES 句组成一个人设，组合去重；同一种子总是生成相同的人设
+# 组合总数超过 int64 时，句子库按种子打乱后均分为若干组，每个人设的句子取自同一组（仍然不重复）
+NUM_GENERAL_PERSONAS = int(_getenv("NUM_GENERAL_PERSONAS", "10"))
+GENERAL_PERSONA_SEED = int(_getenv("GENERAL_PERSONA_SEED", "0"))
+# 分片 "k/n"：只生成序号 i % n == k 的人设，n 个 worker 各自生成自己的一份，无需保存完整列表
+GENERAL_PERSONA_SHARD = _getenv("GENERAL_PERSONA_SHARD", "0/1")
+GENERAL_PERSONA_BLOCK_SIZE = 100_000 # 每块向量化生成的组合数上限
+
+# --- Telemetry ---
+# 每个模拟单元记录排队/网络耗时、token、重试、解析状态和估算费用，写入JSONL轨迹；
+# 运行结束时导出 Prometheus 文本格式指标并打印按模型的汇总；METRICS_PORT 非0时另开 /metrics 端点
+TELEMETRY_ENABLED = _getenv("TELEMETRY_ENABLED", "1") != "0"
+TELEMETRY_TRACE_FILE = os.path.join(OUTPUT_DIR, "telemetry_trace.jsonl")
+METRICS_FILE = os.path.join(OUTPUT_DIR, "metrics.prom")
+METRICS_PORT = int(_getenv("METRICS_PORT", "0"))
+# 每百万token的美元价格，用于估算费用（请以供应商官网的最新价格为准）
+MODEL_PRICES = {
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    "gpt-3.5-turbo": {"input": 0.50, "output": 1.50},
+}
+
+# --- Online Aggregation ---
+# 运行中每写入一行结果就累加到 (画像类型, 模型, 题目, 选项) 的计数数组，实时计算答案分布的熵、错误率和模型间一致度，
+# 每 AGGREGATE_CHECKPOINT_INTERVAL 秒写出快照（.npz 计数 + JSON 汇总），运行中可用 python main.py inspect 查看
+AGGREGATE_ENABLED = _getenv("AGGREGATE_ENABLED", "1") != "0"
+AGGREGATE_CHECKPOINT_FILE = os.path.join(OUTPUT_DIR, "aggregate_counts.npz")
+AGGREGATE_SUMMARY_FILE = os.path.join(OUTPUT_DIR, "aggregate_summary.json")
+AGGREGATE_CHECKPOINT_INTERVAL = 30 # 秒
+# 提前停止：某 (画像类型, 模型) 每道选择题的有效答案数都达到 AGGREGATE_MIN_SAMPLES、各选项比例的标准误都不超过
+# AGGREGATE_CONVERGENCE_SE 后，不再调度该组合剩余的单元（只对 async 和 sequential 模式生效）
+AGGREGATE_STOP_WHEN_CONVERGED = _getenv("AGGREGATE_STOP_WHEN_CONVERGED", "0") != "0"
+AGGREGATE_MIN_SAMPLES = 100
+AGGREGATE_CONVERGENCE_SE = 0.02
+
+# --- Checkpointing ---
+# 运行清单记录已完成的 (persona_id, persona_type, model)，重新运行时只补跑缺失的单元
+RUN_MANIFEST_FILE = os.path.join(OUTPUT_DIR, "run_manifest.jsonl")
+RESUME_RUNS = _getenv("RESUME_RUNS", "1") != "0" # 设为 "0" 则清空旧结果重新开始
+CHECKPOINT_FSYNC_EVERY = 20 # 每写入多少行强制落盘一次
+
+# --- Job Queue ---
+# 队列模式下，协调进程把所有 (人设, 模型, 样本) 单元写入SQLite任务队列，本机启动 JOB_QUEUE_LOCAL_WORKERS 个 worker 进程
+# （含协调进程自身，并发和限流额度按进程数平分）领取运行，完成后把结果导出到 OUTPUT_FILES。
+# 其他机器可挂载同一数据库文件，以 `python main.py worker`（或 JOB_QUEUE_ROLE=worker）启动加入（各机器的限流额度请自行分配）
+JOB_QUEUE_PATH = _getenv("JOB_QUEUE_PATH", os.path.join(OUTPUT_DIR, "job_queue.sqlite"))
+JOB_QUEUE_ROLE = _getenv("JOB_QUEUE_ROLE", "coordinator") # "coordinator": 入队、运行并导出；"worker": 只领取运行
+JOB_QUEUE_LOCAL_WORKERS = int(_getenv("JOB_QUEUE_LOCAL_WORKERS", "1"))
+JOB_LEASE_SECONDS = 300 # 租约时长，worker 超过这么久没有续约即视为已崩溃
+JOB_HEARTBEAT_INTERVAL = 60 # 续约间隔秒数，应明显小于租约时长
+JOB_MAX_ATTEMPTS = 3 # 每个任务最多领取次数（含崩溃后被接手和无回复重试）
+JOB_CLAIM_BATCH = 32 # 每次领取的任务数
+JOB_POLL_INTERVAL = 5 # 队列暂时为空但仍有他人持有的任务时的轮询间隔
+JOB_ENQUEUE_BATCH = 5000 # 入队时每个事务写入的人设数
+JOB_QUEUE_BUSY_TIMEOUT = 60 # 数据库被其他进程锁住时的最长等待秒数
+
+# --- Batch Mode ---
+# 批处理模式将请求渲染为 Batch API 的JSONL文件，提交后轮询，完成后导入结果CSV
+BATCH_BACKEND = _getenv("BATCH_BACKEND", "openai") # "openai" 或离线测试用的 "local"
+BATCH_DIR = os.path.join(OUTPUT_DIR, "batch")
+BATCH_MAX_REQUESTS_PER_FILE = 50000
+BATCH_MAX_FILE_BYTES = 190 * 1024 * 1024 # 官方上限为200MB，留出余量
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_POLL_INTERVAL = 60 # 秒
+
+# --- Silicon Persona Columns ---
+# 人口统计CSV列 -> 第一人称短语，依次拼接成描述；(列名, 短语模板, 缺失时的默认值)
+# 根据你的CGSS文件的实际列名调整，或追加更多变量
+SILICON_PHRASES = [
+    ("age", "我今年{}岁，", "未知年龄"),
+    ("gender", "性别{}。", "未知性别"),
+    ("education", "我的最高学历是{}。", "未知学历"),
+    ("occupation", "我目前的职业是{}，", "未知职业"),
+    ("income_level", "个人年收入大致在{}范围。", "未知收入"),
+    ("residence_type", "我住在{}。", "未知地区"),
+]
+SILICON_CHUNK_SIZE = 100_000 # 分块读取的行数
+# 分层抽样：SILICON_SAMPLE_SIZE 为0时使用全部行，否则按 SILICON_SAMPLE_STRATA 列分层、按比例抽取这么多人设；
+# 同一种子总是抽到相同的行，续跑和修复时会重新抽到同一批人设
+SILICON_SAMPLE_SIZE = int(_getenv("SILICON_SAMPLE_SIZE", "0"))
+SILICON_SAMPLE_STRATA = [column.strip() for column in _getenv("SILICON_SAMPLE_STRATA", "gender,residence_type").split(",") if column.strip()]
+SILICON_SAMPLE_SEED = int(_getenv("SILICON_SAMPLE_SEED", "0"))
 
 # --- Output Files ---
 # (保持不变)
@@ -71,6 +288,60 @@ OUTPUT_FILES = {
     "cognitive": os.path.join(OUTPUT_DIR, "results_cognitive_persona.csv"),
 }
 
-# --- Ensure output directory exists ---
-# (保持不变)
-os.makedirs(OUTPUT_DIR, exist_ok=True)
\ No newline at end of file
+# --- Result Formats ---
+# CSV 始终写入（也是断点续跑的依据）；加入 "parquet" 则同时按 persona_type/model 分区写入紧凑编码的Parquet（需要 pyarrow）
+RESULT_FORMATS = ["csv"]
+PARQUET_DIR = os.path.join(OUTPUT_DIR, "parquet")
+PARQUET_ROW_GROUP_SIZE = 10000
+
+
+# --- Resolved Settings ---
+class Settings:
+    """解析后的只读配置快照，属性名与本模块的常量相同；可以序列化，用于把同一份配置交给 spawn 出的子进程"""
+    __slots__ = ("_values",)
+
+    def __init__(self, values):
+        object.__setattr__(self, "_values", copy.deepcopy(dict(values)))
+
+    def __getattr__(self, name):
+        try:
+            return copy.deepcopy(self._values[name])
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError("配置快照是只读的，请用 config.resolve(覆盖项) 生成新的快照")
+
+    def __reduce__(self):
+        return (Settings, (self._values,))
+
+    def as_dict(self):
+        return copy.deepcopy(self._values)
+
+
+def _setting_names():
+    return [name for name in globals() if name.isupper() and not name.startswith("_")]
+
+
+def resolve(**overrides):
+    """把当前配置（默认值、.env、环境变量及运行中修改过的值）连同 overrides 解析为只读快照"""
+    names = _setting_names()
+    unknown = sorted(set(overrides) - set(names))
+    if unknown:
+        raise ValueError(f"未知的配置项: {unknown}")
+    values = {name: globals()[name] for name in names}
+    values.update(overrides)
+    return Settings(values)
+
+
+def apply(settings):
+    """把快照写回本模块，其余模块照常通过 config.X 读取"""
+    globals().update(settings.as_dict())
+
+
+def prepare_runtime():
+    """真正开始运行前调用：把 .env 写入 os.environ（供SDK读取代理等变量，子进程也会继承）并创建输出目录"""
+    for name, value in _DOTENV.items():
+        if value is not None:
+            os.environ.setdefault(name, value)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
\ No newline at end of file
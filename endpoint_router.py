@@ -0,0 +1,193 @@
+# endpoint_router.py
+import asyncio
+import random
+import threading
+import time
+from collections import deque, namedtuple
+import config
+
+Endpoint = namedtuple("Endpoint", "name base_url api_key weight")
+
+FAILURE_PENALTY = 2.0 # 失败的请求按当前预期延迟的这个倍数计入，使路由暂时避开出错的端点
+DEFAULT_LATENCY = 1.0 # 还没有任何观测时假定的延迟秒数
+
+
+class EndpointRouter:
+    """
+    在同一模型的多个 OpenAI 兼容端点之间分配请求：按 配置权重 / 观测延迟 加权随机选择端点，
+    失败时转移到尚未尝试的端点；开启 HEDGE_REQUESTS 时，异步调用超过近期延迟的分位数仍未返回就向另一个端点补发请求
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency = {} # (model, 端点名) -> [延迟滑动平均, 完成次数]
+        self._recent = {} # model -> 最近成功请求的延迟，用于计算补发阈值
+        self._stats = {} # model -> 补发、补发胜出和故障转移次数
+
+    def endpoints(self, model_name, resolved):
+        """该模型可用的端点列表；MODEL_ENDPOINTS 中没有列出时只有 resolve_provider 给出的一个端点"""
+        configured = config.MODEL_ENDPOINTS.get(model_name)
+        if not configured:
+            return [Endpoint("default", resolved["base_url"], resolved["api_key"], 1.0)]
+        return [
+            Endpoint(item.get("name") or f"endpoint{index}", item.get("base_url"), item.get("api_key"), float(item.get("weight", 1.0)))
+            for index, item in enumerate(configured, start=1)
+        ]
+
+    # --- 延迟统计 ---
+    def _expected_latency(self, model_name, endpoint_name):
+        entry = self._latency.get((model_name, endpoint_name))
+        if entry is not None:
+            return entry[0]
+        # 新端点按同一模型其他端点的平均延迟估计，使它能分到请求
+        known = [entry[0] for (model, _), entry in self._latency.items() if model == model_name]
+        return sum(known) / len(known) if known else DEFAULT_LATENCY
+
+    def _update(self, model_name, endpoint_name, seconds):
+        entry = self._latency.get((model_name, endpoint_name))
+        if entry is None:
+            self._latency[(model_name, endpoint_name)] = [seconds, 1]
+        else:
+            entry[0] += config.ROUTER_LATENCY_EWMA_ALPHA * (seconds - entry[0])
+            entry[1] += 1
+
+    def record(self, model_name, endpoint, seconds, ok=True):
+        with self._lock:
+            if ok:
+                self._update(model_name, endpoint.name, seconds)
+                self._recent.setdefault(model_name, deque(maxlen=config.HEDGE_WINDOW)).append(seconds)
+            else:
+                expected = self._expected_latency(model_name, endpoint.name)
+                self._update(model_name, endpoint.name, max(seconds, expected * FAILURE_PENALTY))
+
+    def record_cancelled(self, model_name, endpoint, seconds):
+        """被取消的请求只知道延迟不低于 seconds，只有超过当前估计时才计入"""
+        with self._lock:
+            if seconds > self._expected_latency(model_name, endpoint.name):
+                self._update(model_name, endpoint.name, seconds)
+
+    def _count(self, model_name, name):
+        with self._lock:
+            stats = self._stats.setdefault(model_name, {"hedges": 0, "hedge_wins": 0, "failovers": 0})
+            stats[name] += 1
+
+    # --- 选择端点 ---
+    def choose(self, model_name, endpoints, exclude=()):
+        """按 权重 / 预期延迟 加权随机选择端点；exclude 中的端点全部排除后没有剩余时从全部端点中选"""
+        candidates = [endpoint for endpoint in endpoints if endpoint.name not in exclude] or endpoints
+        if len(candidates) == 1:
+            return candidates[0]
+        with self._lock:
+            weights = [endpoint.weight / max(self._expected_latency(model_name, endpoint.name), 1e-3) for endpoint in candidates]
+        return random.choices(candidates, weights)[0]
+
+    def hedge_delay(self, model_name):
+        """补发阈值：该模型近期延迟的 HEDGE_LATENCY_PERCENTILE 分位数；样本不足时返回None（不补发）"""
+        with self._lock:
+            recent = sorted(self._recent.get(model_name, ()))
+        if len(recent) < config.HEDGE_MIN_SAMPLES:
+            return None
+        position = min(int(len(recent) * config.HEDGE_LATENCY_PERCENTILE / 100), len(recent) - 1)
+        return max(recent[position], config.HEDGE_MIN_DELAY)
+
+    # --- 调用 ---
+    def call(self, model_name, endpoints, call):
+        """同步调用：call(endpoint) 返回结果，None 表示失败（已在内部重试），失败时依次转移到其他端点"""
+        tried = []
+        while len(tried) < len(endpoints):
+            endpoint = self.choose(model_name, endpoints, tried)
+            if tried:
+                self._count(model_name, "failovers")
+            tried.append(endpoint.name)
+            start = time.perf_counter()
+            result = call(endpoint)
+            self.record(model_name, endpoint, time.perf_counter() - start, result is not None)
+            if result is not None:
+                return result
+        return None
+
+    async def _timed_call(self, model_name, endpoint, call):
+        start = time.perf_counter()
+        try:
+            result = await call(endpoint)
+        except asyncio.CancelledError:
+            self.record_cancelled(model_name, endpoint, time.perf_counter() - start)
+            raise
+        self.record(model_name, endpoint, time.perf_counter() - start, result is not None)
+        return result
+
+    async def call_async(self, model_name, endpoints, call):
+        """
+        异步调用：call(endpoint) 返回协程。开启 HEDGE_REQUESTS 时，超过补发阈值仍未返回就向另一个端点补发请求
+        （只有一个端点时补发到同一端点），取最先返回的有效结果并取消其余请求；请求失败时转移到尚未尝试的端点
+        """
+        delay = self.hedge_delay(model_name) if config.HEDGE_REQUESTS else None
+        first = self.choose(model_name, endpoints)
+        tried = [first.name]
+        tasks = {asyncio.create_task(self._timed_call(model_name, first, call)): False} # 任务 -> 是否为补发
+        pending = set(tasks)
+        hedges = 0
+        try:
+            while pending:
+                can_hedge = delay is not None and hedges < config.HEDGE_MAX_EXTRA
+                done, pending = await asyncio.wait(
+                    pending, timeout=delay if can_hedge else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    result = task.result()
+                    if result is not None:
+                        if tasks[task]:
+                            self._count(model_name, "hedge_wins")
+                        return result
+                if not done:
+                    endpoint = self.choose(model_name, endpoints, tried)
+                    hedges += 1
+                    self._count(model_name, "hedges")
+                else:
+                    untried = [endpoint for endpoint in endpoints if endpoint.name not in tried]
+                    if not untried:
+                        continue
+                    endpoint = self.choose(model_name, untried)
+                    self._count(model_name, "failovers")
+                tried.append(endpoint.name)
+                task = asyncio.create_task(self._timed_call(model_name, endpoint, call))
+                tasks[task] = not done
+                pending.add(task)
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    # --- 汇总 ---
+    def report_lines(self):
+        """每个经过路由的模型一行：各端点的平均延迟和完成次数，以及补发和故障转移次数"""
+        with self._lock:
+            latency = {key: list(entry) for key, entry in self._latency.items()}
+            stats = {model_name: dict(counts) for model_name, counts in self._stats.items()}
+        lines = []
+        for model_name in sorted({model for model, _ in latency} | set(stats)):
+            endpoints = "，".join(
+                f"{name} {entry[0]:.2f}s / {entry[1]} 次"
+                for (model, name), entry in sorted(latency.items()) if model == model_name
+            )
+            counts = stats.get(model_name, {"hedges": 0, "hedge_wins": 0, "failovers": 0})
+            lines.append(
+                f"  {model_name}: {endpoints or '无'}；补发 {counts['hedges']} 次（胜出 {counts['hedge_wins']} 次），"
+                f"故障转移 {counts['failovers']} 次"
+            )
+        return lines
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """获取进程内共享的端点路由器"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = EndpointRouter()
+        return _router
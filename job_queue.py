@@ -0,0 +1,371 @@
+# job_queue.py
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+import config
+import result_sink
+
+JOB_PENDING = "pending"
+JOB_LEASED = "leased"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# 一个待运行的模拟单元（某个人设在某个模型上的第 sample_index 个样本）
+Job = namedtuple("Job", "id persona_type persona_id provider model sample_index attempts description")
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS personas ("
+    " persona_type TEXT NOT NULL,"
+    " persona_id TEXT NOT NULL,"
+    " description TEXT NOT NULL,"
+    " PRIMARY KEY (persona_type, persona_id))",
+    "CREATE TABLE IF NOT EXISTS jobs ("
+    " id INTEGER PRIMARY KEY,"
+    " persona_type TEXT NOT NULL,"
+    " persona_id TEXT NOT NULL,"
+    " provider TEXT NOT NULL,"
+    " model TEXT NOT NULL,"
+    " sample_index INTEGER NOT NULL,"
+    " status TEXT NOT NULL,"
+    " attempts INTEGER NOT NULL DEFAULT 0,"
+    " lease_owner TEXT,"
+    " lease_expires REAL,"
+    " last_error TEXT,"
+    " not_before REAL," # 推迟的任务在此时刻（time.time()）之前不会被领取
+    " updated_at REAL NOT NULL,"
+    " UNIQUE (persona_type, persona_id, model, sample_index))",
+    "CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)",
+    # 以 job_id 为主键，同一单元的结果只会保存一次（先写入者为准）
+    "CREATE TABLE IF NOT EXISTS results ("
+    " job_id INTEGER PRIMARY KEY,"
+    " answers TEXT NOT NULL,"
+    " distributions TEXT,"
+    " worker TEXT,"
+    " finished_at REAL NOT NULL)",
+]
+
+_CLAIM_QUERY = (
+    "SELECT j.id, j.persona_type, j.persona_id, j.provider, j.model, j.sample_index, j.attempts, p.description"
+    " FROM jobs j JOIN personas p ON p.persona_type = j.persona_type AND p.persona_id = j.persona_id"
+)
+
+
+def make_worker_id():
+    """worker 标识：主机名、进程号和随机后缀，用作租约持有者"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class JobQueue:
+    """
+    基于SQLite的持久任务队列。每个单元一行，worker 领取时获得有时限的租约并定期续约；
+    worker 崩溃后租约过期，任务会被其他 worker 重新领取，领取次数超过上限则记为失败。
+    结果与任务状态在同一事务中写入，同一单元重复完成时只保留第一份结果。
+    多个进程（或挂载同一文件的多台机器）可以共用一个数据库文件。
+    """
+
+    def __init__(self, path=None, lease_seconds=None, max_attempts=None):
+        path = path or config.JOB_QUEUE_PATH
+        self.path = path
+        self.lease_seconds = config.JOB_LEASE_SECONDS if lease_seconds is None else lease_seconds
+        self.max_attempts = config.JOB_MAX_ATTEMPTS if max_attempts is None else max_attempts
+        self._lock = threading.Lock()
+        # isolation_level=None：事务由下面的 BEGIN IMMEDIATE 显式控制
+        self._conn = sqlite3.connect(path, timeout=config.JOB_QUEUE_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self._conn.execute(statement)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "not_before" not in columns: # 旧版本创建的队列文件
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN not_before REAL")
+
+    def _transaction(self):
+        return _Transaction(self)
+
+    # --- 运行参数 ---
+    def prepare_run(self, survey_questions, survey_formatted, templates, models_to_run):
+        """
+        保存 worker 需要的问卷、提示词模板和模型列表，所有 worker 都从队列读取，保证输入一致。
+        队列中已有不同的问卷或模型列表时抛出 ValueError，避免把两次不同的实验混在一起
+        """
+        run = {"survey_questions": survey_questions, "survey_formatted": survey_formatted, "models_to_run": models_to_run}
+        with self._transaction() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'run'").fetchone()
+            if row is None:
+                conn.execute("INSERT INTO meta (key, value) VALUES ('run', ?)", (json.dumps(run, ensure_ascii=False),))
+            elif json.loads(row[0]) != json.loads(json.dumps(run, ensure_ascii=False)):
+                raise ValueError(
+                    f"任务队列 {self.path} 中的问卷或模型列表与当前配置不一致，请等待原有任务完成或删除该文件后重新开始"
+                )
+            for persona_type, template in templates.items():
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (f"template:{persona_type}", template)
+                )
+
+    def load_run(self):
+        """返回 (问卷, 格式化后的问卷, {persona_type: 模板}, 模型列表)；队列尚未创建运行时返回None"""
+        with self._lock:
+            rows = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+        if "run" not in rows:
+            return None
+        run = json.loads(rows["run"])
+        templates = {key.split(":", 1)[1]: value for key, value in rows.items() if key.startswith("template:")}
+        return run["survey_questions"], run["survey_formatted"], templates, run["models_to_run"]
+
+    # --- 入队 ---
+    def enqueue(self, simulation_tasks, models_to_run, samples_for, manifest=None, batch_size=None):
+        """
+        为每个 (人设, 模型, 样本) 插入一个任务，已存在的任务保持不变，重复入队是安全的。
+        samples_for(model_name) 为每个单元的样本数；manifest 中已完成的单元不再入队。返回新增任务数
+        """
+        batch_size = batch_size or config.JOB_ENQUEUE_BATCH
+        added = 0
+        for persona_type, personas, _ in simulation_tasks:
+            persona_rows = []
+            job_rows = []
+            for persona in personas:
+                persona_id = str(persona['id'])
+                persona_rows.append((persona_type, persona_id, persona['description']))
+                for provider, model_list in models_to_run.items():
+                    for model_name in model_list:
+                        for sample_index in range(samples_for(model_name)):
+                            if manifest is not None and manifest.is_done(persona_id, persona_type, model_name, sample_index):
+                                continue
+                            job_rows.append((persona_type, persona_id, provider, model_name, sample_index))
+                if len(persona_rows) >= batch_size:
+                    added += self._insert(persona_rows, job_rows)
+                    persona_rows, job_rows = [], []
+            added += self._insert(persona_rows, job_rows)
+        return added
+
+    def _insert(self, persona_rows, job_rows):
+        if not persona_rows:
+            return 0
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO personas (persona_type, persona_id, description) VALUES (?, ?, ?)", persona_rows
+            )
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO jobs (persona_type, persona_id, provider, model, sample_index, status, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [row + (JOB_PENDING, now) for row in job_rows],
+            )
+            return conn.total_changes - before
+
+    # --- 领取、续约与完成 ---
+    def claim(self, owner, limit):
+        """
+        领取最多 limit 个租约已过期或待运行的任务，按入队顺序返回（同一人设同一模型的样本相邻）。
+        领取次数已达上限的过期任务记为失败，不再领取；推迟的任务到期后才会被领取
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            # 先接手过期的租约，再按 (status, id) 索引取最早入队的待运行任务，任务表很大时也不需要排序
+            rows = conn.execute(
+                _CLAIM_QUERY + " WHERE j.status = ? AND j.lease_expires < ? ORDER BY j.id LIMIT ?",
+                (JOB_LEASED, now, limit),
+            ).fetchall()
+            if len(rows) < limit:
+                rows += conn.execute(
+                    _CLAIM_QUERY + " WHERE j.status = ? AND (j.not_before IS NULL OR j.not_before <= ?) ORDER BY j.id LIMIT ?",
+                    (JOB_PENDING, now, limit - len(rows)),
+                ).fetchall()
+            jobs = []
+            for row in rows:
+                job = Job(*row)
+                if job.attempts >= self.max_attempts:
+                    # 每次领取都会计数，反复导致 worker 崩溃的任务最终会停在这里
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, lease_owner = NULL, last_error = ?, updated_at = ? WHERE id = ?",
+                        (JOB_FAILED, "租约多次过期（worker 可能已崩溃）", now, job.id),
+                    )
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET status = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ?"
+                    " WHERE id = ?",
+                    (JOB_LEASED, owner, now + self.lease_seconds, now, job.id),
+                )
+                jobs.append(job._replace(attempts=job.attempts + 1))
+            return jobs
+
+    def heartbeat(self, owner):
+        """延长 owner 持有的全部租约，返回续约的任务数"""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE status = ? AND lease_owner = ?",
+                (now + self.lease_seconds, now, JOB_LEASED, owner),
+            )
+            return cursor.rowcount
+
+    def complete(self, owner, job_id, answers, distributions=None):
+        """
+        保存结果并把任务标记为完成。即使租约已被他人接手也接受这份结果（先完成者为准），
+        返回结果是否为新写入的
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO results (job_id, answers, distributions, worker, finished_at) VALUES (?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    json.dumps(answers, ensure_ascii=False),
+                    json.dumps(distributions) if distributions is not None else None,
+                    owner,
+                    now,
+                ),
+            )
+            conn.execute(
+                "UPDATE jobs SET status = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ? WHERE id = ?",
+                (JOB_DONE, now, job_id),
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, owner, job_id, error):
+        """记录一次失败：领取次数未达上限时放回队列等待重试，否则记为失败；租约已不属于 owner 时不做改动"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END,"
+                " lease_owner = NULL, lease_expires = NULL, last_error = ?, updated_at = ?"
+                " WHERE id = ? AND status = ? AND lease_owner = ?",
+                (self.max_attempts, JOB_FAILED, JOB_PENDING, str(error)[:500], now, job_id, JOB_LEASED, owner),
+            )
+
+    def defer(self, owner, job_ids, until, error):
+        """供应商暂时不可用：把任务放回队列，在 until（time.time()）之前不再领取，不计入领取次数"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE jobs SET status = ?, lease_owner = NULL, lease_expires = NULL, attempts = MAX(attempts - 1, 0),"
+                " not_before = ?, last_error = ?, updated_at = ? WHERE id = ? AND status = ? AND lease_owner = ?",
+                [(JOB_PENDING, until, str(error)[:500], now, job_id, JOB_LEASED, owner) for job_id in job_ids],
+            )
+
+    def release(self, owner):
+        """worker 正常退出（如 Ctrl+C）时归还未完成的任务，不计入领取次数"""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, lease_owner = NULL, lease_expires = NULL, attempts = MAX(attempts - 1, 0),"
+                " updated_at = ? WHERE status = ? AND lease_owner = ?",
+                (JOB_PENDING, now, JOB_LEASED, owner),
+            )
+            return cursor.rowcount
+
+    def retry_failed(self):
+        """把失败的任务重新放回队列并清零领取次数，返回任务数"""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, attempts = 0, updated_at = ? WHERE status = ?",
+                (JOB_PENDING, now, JOB_FAILED),
+            )
+            return cursor.rowcount
+
+    # --- 查询 ---
+    def counts(self):
+        """各状态的任务数"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {JOB_PENDING: 0, JOB_LEASED: 0, JOB_DONE: 0, JOB_FAILED: 0}
+        counts.update(rows)
+        return counts
+
+    def has_open_jobs(self):
+        """是否还有待运行或运行中（含租约已过期）的任务"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM jobs WHERE status IN (?, ?) LIMIT 1", (JOB_PENDING, JOB_LEASED)
+            ).fetchone()
+        return row is not None
+
+    def next_claim_time(self):
+        """最早可能领取到任务的时刻：推迟的任务到期或他人的租约过期；没有待运行和运行中的任务时返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(CASE WHEN status = ? THEN COALESCE(not_before, 0) ELSE lease_expires END)"
+                " FROM jobs WHERE status IN (?, ?)",
+                (JOB_PENDING, JOB_PENDING, JOB_LEASED),
+            ).fetchone()
+        return row[0]
+
+    def iter_results(self, persona_type, page_size=5000):
+        """按入队顺序逐行返回某个画像类型的结果 (persona_id, model, sample_index, 答案列表, 分布列表或None)"""
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT j.id, j.persona_id, j.model, j.sample_index, r.answers, r.distributions"
+                    " FROM results r JOIN jobs j ON j.id = r.job_id"
+                    " WHERE j.persona_type = ? AND j.id > ? ORDER BY j.id LIMIT ?",
+                    (persona_type, last_id, page_size),
+                ).fetchall()
+            if not rows:
+                return
+            for job_id, persona_id, model_name, sample_index, answers, distributions in rows:
+                yield persona_id, model_name, sample_index, json.loads(answers), json.loads(distributions) if distributions else None
+            last_id = rows[-1][0]
+
+    def describe(self):
+        counts = self.counts()
+        return (
+            f"待运行 {counts[JOB_PENDING]}，运行中 {counts[JOB_LEASED]}，"
+            f"已完成 {counts[JOB_DONE]}，失败 {counts[JOB_FAILED]}"
+        )
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE 事务：一开始就取得写锁，多个进程同时领取任务时不会领到同一行"""
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def __enter__(self):
+        self.queue._lock.acquire()
+        try:
+            self.queue._conn.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self.queue._lock.release()
+            raise
+        return self.queue._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.queue._conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        finally:
+            self.queue._lock.release()
+        return False
+
+
+def export_results(queue, persona_type, writer, distribution_writer, manifest):
+    """
+    把队列中某个画像类型的结果追加到本地结果文件，运行清单中已有的单元跳过，重复导出是安全的。
+    返回新写入的行数
+    """
+    written = 0
+    for persona_id, model_name, sample_index, answers, distributions in queue.iter_results(persona_type):
+        if manifest.is_done(persona_id, persona_type, model_name, sample_index):
+            continue
+        row_key = [persona_id, persona_type, model_name, sample_index]
+        if distribution_writer is not None and distributions is not None:
+            distribution_writer.write_row(row_key + result_sink.format_distributions(distributions))
+        writer.write_row(row_key + answers)
+        manifest.mark_done(persona_id, persona_type, model_name, sample_index)
+        written += 1
+    return written
+
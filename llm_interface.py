@@ -1,45 +1,488 @@
 # llm_interface.py
+import asyncio
+import contextvars
+import json
+import threading
 import time
 import config
-from openai import OpenAI, RateLimitError, APIError
+import endpoint_router
+import provider_health
+import rate_limiter
+import response_cache
+import telemetry
+# 各供应商的SDK都在首次调用时才导入（openai 导入约需0.5秒），制定计划、查看进度等不发请求的命令无需等待
+# 其他供应商的SDK同样在各自的调用函数中导入，例如:
 # from anthropic import Anthropic, APIError as AnthropicAPIError
 # import google.generativeai as genai
 # import zhipuai # 示例：需要 pip install zhipuai
 # import qianfan # 示例：需要 pip install qianfan
 
-# --- OpenAI API Call ---
-def call_openai_api(prompt, model_name, api_key, base_url, temperature, max_tokens):
-    """调用OpenAI API (支持自定义 base_url)"""
-    client_args = {"api_key": api_key}
+
+def _openai():
+    import openai
+    return openai
+
+
+def _httpx():
+    try:
+        import httpx
+    except ImportError: # 新版 openai SDK 基于 httpx2
+        import httpx2 as httpx
+    return httpx
+
+# --- 客户端连接池 ---
+# 按 (provider, base_url, api_key) 缓存客户端，复用长连接，避免每次调用都重新握手
+_client_registry = {}
+_client_registry_lock = threading.Lock()
+
+
+def _http_limits():
+    return _httpx().Limits(
+        max_connections=config.HTTP_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=config.HTTP_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def _http_timeout():
+    return _httpx().Timeout(config.HTTP_READ_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT)
+
+
+def _describe_base_url(provider, base_url):
     if base_url:
-        client_args["base_url"] = base_url
-        print(f"  使用自定义OpenAI Base URL: {base_url}")
+        print(f"  创建 {provider} 客户端，使用自定义Base URL: {base_url}")
     else:
-         print(f"  使用官方OpenAI API地址。")
+        print(f"  创建 {provider} 客户端，使用官方API地址。")
 
 
-    client = OpenAI(**client_args)
-    try:
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=[
-                {"role": "system", "content": "你是一个正在参与社会调查的受访者。"},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=temperature,
-            max_tokens=max_tokens
+def get_openai_client(provider, base_url, api_key):
+    """获取（或创建）共享的同步OpenAI客户端"""
+    key = (provider, base_url, api_key)
+    with _client_registry_lock:
+        entry = _client_registry.setdefault(key, {})
+        if entry.get("sync") is None:
+            _describe_base_url(provider, base_url)
+            entry["sync"] = _openai().OpenAI(
+                api_key=api_key,
+                base_url=base_url or None,
+                timeout=_http_timeout(),
+                max_retries=0, # 重试由 call_openai_api 统一处理
+                http_client=_openai().DefaultHttpxClient(limits=_http_limits(), timeout=_http_timeout()),
+            )
+        return entry["sync"]
+
+
+def get_async_openai_client(provider, base_url, api_key):
+    """获取（或创建）共享的异步OpenAI客户端，异步客户端与事件循环绑定"""
+    key = (provider, base_url, api_key)
+    loop = asyncio.get_running_loop()
+    with _client_registry_lock:
+        entry = _client_registry.setdefault(key, {})
+        # 每次 asyncio.run 都是新的事件循环，旧循环上的连接不能复用
+        if entry.get("async") is None or entry.get("loop") is not loop:
+            if entry.get("async") is None:
+                _describe_base_url(provider, base_url)
+            entry["async"] = _openai().AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url or None,
+                timeout=_http_timeout(),
+                max_retries=0,
+                http_client=_openai().DefaultAsyncHttpxClient(limits=_http_limits(), timeout=_http_timeout()),
+            )
+            entry["loop"] = loop
+        return entry["async"]
+
+
+def close_clients():
+    """关闭所有缓存的同步客户端（异步客户端随事件循环结束而释放）"""
+    with _client_registry_lock:
+        for entry in _client_registry.values():
+            if entry.get("sync") is not None:
+                entry["sync"].close()
+        _client_registry.clear()
+
+
+# --- Token 用量统计 ---
+# 按模型累计提示词token（其中命中供应商前缀缓存的部分单独统计）和生成token
+_usage_totals = {}
+_usage_lock = threading.Lock()
+
+
+def _usage_field(usage, name):
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        return usage.get(name)
+    return getattr(usage, name, None)
+
+
+def record_token_usage(model_name, usage):
+    """记录一次调用的用量；usage 可以是SDK对象或批处理输出中的字典"""
+    if usage is None:
+        return
+    prompt_tokens = _usage_field(usage, "prompt_tokens") or 0
+    details = _usage_field(usage, "prompt_tokens_details")
+    cached_tokens = _usage_field(details, "cached_tokens") or 0
+    completion_tokens = _usage_field(usage, "completion_tokens") or 0
+    with _usage_lock:
+        totals = _usage_totals.setdefault(model_name, {
+            "requests": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0, "completion_tokens": 0, "early_stops": 0,
+        })
+        totals["requests"] += 1
+        totals["prompt_tokens"] += prompt_tokens
+        totals["cached_prompt_tokens"] += cached_tokens
+        totals["completion_tokens"] += completion_tokens
+    telemetry.record_usage(prompt_tokens, cached_tokens, completion_tokens)
+
+
+def _record_early_stop(model_name):
+    with _usage_lock:
+        _usage_totals[model_name]["early_stops"] += 1
+
+
+def get_token_usage():
+    """返回按模型汇总的用量副本"""
+    with _usage_lock:
+        return {model_name: dict(totals) for model_name, totals in _usage_totals.items()}
+
+
+def print_token_usage():
+    for model_name, totals in get_token_usage().items():
+        prompt_tokens = totals["prompt_tokens"]
+        cached = totals["cached_prompt_tokens"]
+        ratio = cached / prompt_tokens if prompt_tokens else 0
+        early_stops = f"，流式提前结束 {totals['early_stops']} 次（用量为估算值）" if totals["early_stops"] else ""
+        print(
+            f"  {model_name}: {totals['requests']} 次请求，提示词 {prompt_tokens} token"
+            f"（缓存命中 {cached}，未缓存 {prompt_tokens - cached}，命中率 {ratio:.1%}），"
+            f"生成 {totals['completion_tokens']} token{early_stops}"
         )
-        return response.choices[0].message.content.strip()
-    except RateLimitError:
-        print(f"速率限制错误，等待{config.REQUEST_DELAY * 5}秒后重试...")
-        time.sleep(config.REQUEST_DELAY * 5)
-        return call_openai_api(prompt, model_name, api_key, base_url, temperature, max_tokens) # 重试
-    except APIError as e:
-        print(f"OpenAI API 错误 ({model_name} @ {base_url or 'official'}): {e}")
+
+
+# --- OpenAI API Call ---
+SYSTEM_MESSAGE = "你是一个正在参与社会调查的受访者。"
+
+
+# call_openai_api 放弃请求时报告的失败类型；只有前三类说明供应商本身出了问题，计入熔断器
+FAILURE_TRANSIENT = "transient" # 连接错误、超时或 5xx，重试耗尽
+FAILURE_AUTH = "auth" # 401/403
+FAILURE_RATE_LIMIT = "rate_limit" # 429，重试耗尽
+FAILURE_REQUEST = "request" # 400 等请求本身的错误，例如超出上下文长度
+FAILURE_ERROR = "error" # 本地错误，例如 logprobs 回复无法解析
+HEALTH_FAILURES = frozenset((FAILURE_TRANSIENT, FAILURE_AUTH, FAILURE_RATE_LIMIT))
+
+# 一次逻辑调用（含故障转移和对冲子任务）中各请求报告的失败类型；子任务复制上下文时共享同一个列表
+_call_failures = contextvars.ContextVar("call_failures", default=None)
+
+
+def _report_failure(kind):
+    failures = _call_failures.get()
+    if failures is not None:
+        failures.append(kind)
+
+
+def _api_error_kind(error):
+    """不重试的 API 错误 -> 失败类型"""
+    openai = _openai()
+    if isinstance(error, (openai.AuthenticationError, openai.PermissionDeniedError)):
+        return FAILURE_AUTH
+    if (getattr(error, "status_code", None) or 0) >= 500:
+        return FAILURE_TRANSIENT
+    return FAILURE_REQUEST
+
+
+def _retryable_errors():
+    """这些错误通常是暂时性的，值得退避后重试；流式读取过程中断开时SDK不会包装底层的 httpx 异常"""
+    openai = _openai()
+    return (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+            openai.InternalServerError, _httpx().TransportError)
+
+
+def build_chat_request(prompt, model_name, temperature, max_tokens, extra_params=None):
+    """构造 chat.completions 请求参数（在线调用和批处理文件共用），extra_params 中的参数原样附加"""
+    request = {
+        "model": model_name,
+        "messages": [
+            {"role": "system", "content": SYSTEM_MESSAGE},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+    if extra_params:
+        request.update(extra_params)
+    return request
+
+
+def text_request_params(extra_params=None):
+    """文本采样请求的附加参数：在 extra_params 基础上加入停止序列"""
+    params = dict(extra_params or {})
+    if config.STOP_SEQUENCES:
+        params["stop"] = list(config.STOP_SEQUENCES)
+    return params or None
+
+
+def _text_cache_key(prompt, model_name, temperature, max_tokens, sample_index, unit_id=None):
+    # 停止序列会改变回复内容，因此计入缓存键；流式提前断开只省去答案之后的文字，不影响缓存键
+    variant = f"stop:{json.dumps(config.STOP_SEQUENCES, ensure_ascii=False)}" if config.STOP_SEQUENCES else None
+    # 不同人设的描述可能完全相同（如由少数几列类别拼成的硅基人设），按 unit_id 区分才是各自独立的采样
+    sample = sample_index if unit_id is None else [str(unit_id), sample_index]
+    return response_cache.make_cache_key(prompt, SYSTEM_MESSAGE, model_name, temperature, max_tokens, sample, variant)
+
+
+def _message_text(response):
+    return response.choices[0].message.content.strip()
+
+
+def _choice_texts(response):
+    """n>1 时按 index 顺序返回全部回复文本"""
+    return [
+        choice.message.content.strip() if choice.message.content else None
+        for choice in sorted(response.choices, key=lambda choice: choice.index)
+    ]
+
+
+def _token_logprobs(response):
+    """
+    提取回复文本及每个生成token的候选概率：
+    {"text": 原始回复, "tokens": [[token, 字节数, [[候选token, logprob], ...]], ...]}
+    中文字符可能被拆成多个字节级token，因此记录字节数以便把文本位置映射回token
+    """
+    choice = response.choices[0]
+    content = getattr(choice.logprobs, "content", None) if choice.logprobs else None
+    if not content:
+        raise ValueError("接口未返回 logprobs，请确认该模型支持 logprobs/top_logprobs")
+    tokens = []
+    for item in content:
+        byte_length = len(item.bytes) if item.bytes is not None else len(item.token.encode("utf-8"))
+        alternatives = [[alt.token, alt.logprob] for alt in item.top_logprobs or []]
+        tokens.append([item.token, byte_length, alternatives])
+    return {"text": choice.message.content or "", "tokens": tokens}
+
+
+def _error_headers(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "headers", None)
+
+
+def _finish_openai_call(raw_response, limiter, estimated_tokens, model_name, extract=_message_text):
+    """根据原始响应更新限流器并记录用量，返回 extract(response)（默认为回复文本）"""
+    limiter.update_from_headers(raw_response.headers)
+    response = raw_response.parse()
+    usage = getattr(response, "usage", None)
+    limiter.record_usage(estimated_tokens, getattr(usage, "total_tokens", None))
+    record_token_usage(model_name, usage)
+    return extract(response)
+
+
+# --- 流式请求 ---
+def _stream_params(extra_params):
+    params = dict(extra_params or {})
+    params["stream"] = True
+    params["stream_options"] = {"include_usage": True}
+    return params
+
+
+def _sse_event(line, http_response):
+    """解析一行 SSE，返回事件字典；非数据行和结束标记返回None"""
+    if not line.startswith("data:"):
         return None
-    except Exception as e:
-        print(f"调用OpenAI ({model_name}) 时发生未知错误: {e}")
+    data = line[5:].strip()
+    if not data or data == "[DONE]":
         return None
+    event = json.loads(data)
+    if event.get("error"):
+        raise _openai().APIError(str(event["error"]), http_response.request, body=event)
+    return event
+
+
+def _stream_step(trackers, finished, event):
+    """处理一个流式分片，返回是否可以提前断开：每个回复都已结束或答案已齐全，且仍有回复在生成"""
+    for choice in event.get("choices") or []:
+        index = choice.get("index", 0)
+        if index >= len(trackers):
+            continue
+        content = (choice.get("delta") or {}).get("content")
+        if content:
+            trackers[index].feed(content)
+        if choice.get("finish_reason") is not None:
+            finished[index] = True
+    return not all(finished) and all(done or tracker.complete for done, tracker in zip(finished, trackers))
+
+
+# 直接按行解析 SSE，不经 SDK 的流对象：SDK 为每个分片构造模型对象，CPU 开销约为直接解析JSON的10倍，
+# 高并发流式请求时会成为瓶颈
+def _read_stream(raw_response, limiter, answer_stream, num_choices):
+    """逐段读取流式回复并增量解析，答案齐全后关闭连接；返回 (各回复的解析器, usage, 是否提前断开)"""
+    limiter.update_from_headers(raw_response.headers)
+    http_response = raw_response.http_response
+    trackers = [answer_stream() for _ in range(num_choices)]
+    finished = [False] * num_choices
+    usage = None
+    stopped_early = False
+    try:
+        for line in http_response.iter_lines():
+            event = _sse_event(line, http_response)
+            if event is None:
+                continue
+            usage = event.get("usage") or usage
+            if _stream_step(trackers, finished, event):
+                stopped_early = True
+                break
+    finally:
+        http_response.close()
+    return trackers, usage, stopped_early
+
+
+async def _read_stream_async(raw_response, limiter, answer_stream, num_choices):
+    """_read_stream 的异步版本"""
+    limiter.update_from_headers(raw_response.headers)
+    http_response = raw_response.http_response
+    trackers = [answer_stream() for _ in range(num_choices)]
+    finished = [False] * num_choices
+    usage = None
+    stopped_early = False
+    try:
+        async for line in http_response.aiter_lines():
+            event = _sse_event(line, http_response)
+            if event is None:
+                continue
+            usage = event.get("usage") or usage
+            if _stream_step(trackers, finished, event):
+                stopped_early = True
+                break
+    finally:
+        await http_response.aclose()
+    return trackers, usage, stopped_early
+
+
+def _finish_stream(prompt, model_name, limiter, estimated_tokens, trackers, usage, stopped_early):
+    """记录流式请求的用量并返回各回复的文本；提前断开时服务器不会发送 usage，按文本估算"""
+    if usage is None:
+        prompt_tokens = rate_limiter.estimate_tokens(SYSTEM_MESSAGE) + rate_limiter.estimate_tokens(prompt)
+        completion_tokens = sum(rate_limiter.estimate_tokens(tracker.text) for tracker in trackers)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+    limiter.record_usage(estimated_tokens, _usage_field(usage, "total_tokens"))
+    record_token_usage(model_name, usage)
+    if stopped_early:
+        _record_early_stop(model_name)
+    return [tracker.text.strip() or None for tracker in trackers]
+
+
+def _streaming(answer_stream):
+    """只有开启 STREAM_RESPONSES 时才按流式请求"""
+    return answer_stream if config.STREAM_RESPONSES else None
+
+
+def _retry_delay_after(error, limiter, attempt, model_name):
+    """处理可重试错误：429时暂停整个限流桶，返回本次应等待的秒数；超过重试上限返回None"""
+    if attempt >= config.MAX_RETRIES:
+        print(f"OpenAI ({model_name}) 重试 {config.MAX_RETRIES} 次后仍失败: {error}")
+        return None
+    retry_after = rate_limiter.retry_after_seconds(_error_headers(error))
+    delay = rate_limiter.backoff_delay(attempt, retry_after)
+    if isinstance(error, _openai().RateLimitError):
+        limiter.pause(delay)
+        print(f"速率限制错误，等待{delay:.1f}秒后重试 ({attempt + 1}/{config.MAX_RETRIES})...")
+    else:
+        print(f"OpenAI ({model_name}) 暂时性错误，等待{delay:.1f}秒后重试 ({attempt + 1}/{config.MAX_RETRIES}): {error}")
+    return delay
+
+
+def call_openai_api(prompt, model_name, api_key, base_url, temperature, max_tokens, extra_params=None, extract=_message_text, answer_stream=None):
+    """
+    调用OpenAI API (支持自定义 base_url)；extra_params 附加到请求中，extract 从响应中取出返回值。
+    answer_stream 为创建 answer_parser.AnswerStream 的函数时改为流式请求，答案齐全即断开，返回每个回复的文本列表
+    """
+    client = get_openai_client("openai", base_url, api_key)
+    limiter = rate_limiter.get_limiter("openai", model_name)
+    # n>1 时每个样本都会生成回复
+    num_choices = (extra_params or {}).get("n", 1)
+    estimated_tokens = rate_limiter.estimate_tokens(prompt) + max_tokens * num_choices
+    if answer_stream is not None:
+        extra_params = _stream_params(extra_params)
+    for attempt in range(config.MAX_RETRIES + 1):
+        wait_start = time.perf_counter()
+        limiter.acquire(estimated_tokens)
+        telemetry.add_queue_time(time.perf_counter() - wait_start)
+        request_start = time.perf_counter()
+        try:
+            raw_response = client.chat.completions.with_raw_response.create(
+                **build_chat_request(prompt, model_name, temperature, max_tokens, extra_params)
+            )
+            if answer_stream is not None:
+                trackers, usage, stopped_early = _read_stream(raw_response, limiter, answer_stream, num_choices)
+                result = _finish_stream(prompt, model_name, limiter, estimated_tokens, trackers, usage, stopped_early)
+            else:
+                result = _finish_openai_call(raw_response, limiter, estimated_tokens, model_name, extract)
+            telemetry.record_attempt(time.perf_counter() - request_start, attempt=attempt)
+            return result
+        except _retryable_errors() as e:
+            telemetry.record_attempt(time.perf_counter() - request_start, type(e).__name__, attempt)
+            delay = _retry_delay_after(e, limiter, attempt, model_name)
+            if delay is None:
+                _report_failure(FAILURE_RATE_LIMIT if isinstance(e, _openai().RateLimitError) else FAILURE_TRANSIENT)
+                return None
+            time.sleep(delay)
+        except _openai().APIError as e:
+            telemetry.record_attempt(time.perf_counter() - request_start, type(e).__name__, attempt)
+            print(f"OpenAI API 错误 ({model_name} @ {base_url or 'official'}): {e}")
+            _report_failure(_api_error_kind(e))
+            return None
+        except Exception as e:
+            telemetry.record_attempt(time.perf_counter() - request_start, type(e).__name__, attempt)
+            print(f"调用OpenAI ({model_name}) 时发生未知错误: {e}")
+            _report_failure(FAILURE_ERROR)
+            return None
+    return None
+
+async def call_openai_api_async(prompt, model_name, api_key, base_url, temperature, max_tokens, extra_params=None, extract=_message_text, answer_stream=None):
+    """异步调用OpenAI API (支持自定义 base_url)，参数与 call_openai_api 相同"""
+    client = get_async_openai_client("openai", base_url, api_key)
+    limiter = rate_limiter.get_limiter("openai", model_name)
+    # n>1 时每个样本都会生成回复
+    num_choices = (extra_params or {}).get("n", 1)
+    estimated_tokens = rate_limiter.estimate_tokens(prompt) + max_tokens * num_choices
+    if answer_stream is not None:
+        extra_params = _stream_params(extra_params)
+    for attempt in range(config.MAX_RETRIES + 1):
+        wait_start = time.perf_counter()
+        await limiter.acquire_async(estimated_tokens)
+        telemetry.add_queue_time(time.perf_counter() - wait_start)
+        request_start = time.perf_counter()
+        try:
+            raw_response = await client.chat.completions.with_raw_response.create(
+                **build_chat_request(prompt, model_name, temperature, max_tokens, extra_params)
+            )
+            if answer_stream is not None:
+                trackers, usage, stopped_early = await _read_stream_async(raw_response, limiter, answer_stream, num_choices)
+                result = _finish_stream(prompt, model_name, limiter, estimated_tokens, trackers, usage, stopped_early)
+            else:
+                result = _finish_openai_call(raw_response, limiter, estimated_tokens, model_name, extract)
+            telemetry.record_attempt(time.perf_counter() - request_start, attempt=attempt)
+            return result
+        except _retryable_errors() as e:
+            telemetry.record_attempt(time.perf_counter() - request_start, type(e).__name__, attempt)
+            delay = _retry_delay_after(e, limiter, attempt, model_name)
+            if delay is None:
+                _report_failure(FAILURE_RATE_LIMIT if isinstance(e, _openai().RateLimitError) else FAILURE_TRANSIENT)
+                return None
+            await asyncio.sleep(delay)
+        except _openai().APIError as e:
+            telemetry.record_attempt(time.perf_counter() - request_start, type(e).__name__, attempt)
+            print(f"OpenAI API 错误 ({model_name} @ {base_url or 'official'}): {e}")
+            _report_failure(_api_error_kind(e))
+            return None
+        except Exception as e:
+            telemetry.record_attempt(time.perf_counter() - request_start, type(e).__name__, attempt)
+            print(f"调用OpenAI ({model_name}) 时发生未知错误: {e}")
+            _report_failure(FAILURE_ERROR)
+            return None
+    return None
 
 # --- Anthropic API Call (示例，需根据实际库调整base_url用法) ---
 def call_anthropic_api(prompt, model_name, api_key, base_url, temperature, max_tokens):
@@ -140,14 +583,18 @@ def call_baidu_api(prompt, model_name, api_key, secret_key, base_url, temperatur
      return None
 
 
-# --- 主接口函数 ---
-def get_llm_response(prompt, model_name, temperature=config.TEMPERATURE, max_tokens=config.MAX_TOKENS_PER_RESPONSE):
-    """根据模型名称调用相应的API，并传递 Base URL"""
+# --- 供应商解析 ---
+def resolve_provider(model_name):
+    """根据模型名称确定API供应商及其配置，无法调用时返回None"""
     api_provider = None
     api_key = None
     secret_key = None # 用于百度等
     base_url = None
 
+    # 在 MODEL_ENDPOINTS 中列出端点的模型一律通过 OpenAI 兼容接口调用，地址和 Key 由各端点给出
+    if config.MODEL_ENDPOINTS.get(model_name):
+        return {"provider": "openai", "api_key": None, "secret_key": None, "base_url": None}
+
     # 判断API供应商并获取配置
     # (简化版，你需要为每个供应商添加逻辑)
     if model_name.startswith("gpt"):
@@ -210,23 +657,343 @@ def get_llm_response(prompt, model_name, temperature=config.TEMPERATURE, max_tok
              print(f"错误: {api_provider.upper()} API Key 未配置或无效。请检查 config.py 或 .env 文件。")
              return None
 
+    return {
+        "provider": api_provider,
+        "api_key": api_key,
+        "secret_key": secret_key,
+        "base_url": base_url,
+    }
+
+
+def _resolve_available(model_name):
+    """resolve_provider 加上健康检查：无法调用的模型只解析和提示一次，此后直接抛出 ProviderUnavailable（熔断器关闭时返回None）"""
+    health = provider_health.get_health()
+    health.check_model(model_name)
+    resolved = resolve_provider(model_name)
+    if resolved is None:
+        health.mark_unavailable(model_name)
+    return resolved
+
+
+def _health_key(model_name, resolved):
+    """熔断按供应商统计；经 MODEL_ENDPOINTS 路由的模型有自己的一组端点，单独统计"""
+    if config.MODEL_ENDPOINTS.get(model_name):
+        return f"{resolved['provider']}:{model_name}"
+    return resolved["provider"]
+
+
+def _call_outcome(result, failures, count_unreported):
+    """一次逻辑调用对熔断器的影响：True 成功，False 失败，None 不计（请求本身的错误不说明供应商不可用）"""
+    if result is not None:
+        return True
+    if HEALTH_FAILURES.intersection(failures):
+        return False
+    if count_unreported and not failures:
+        return False
+    return None
+
+
+def _guarded(provider, call, count_unreported=False):
+    """
+    经熔断器调用 call()。只有连接/超时/5xx、鉴权失败和重试耗尽的 429 计为失败；
+    count_unreported 为True时，没有报告失败类型的None结果也计为失败（用于不报告失败类型的供应商）
+    """
+    health = provider_health.get_health()
+    health.before_call(provider)
+    failures = []
+    token = _call_failures.set(failures)
+    outcome = None
+    try:
+        result = call()
+        outcome = _call_outcome(result, failures, count_unreported)
+        return result
+    finally:
+        _call_failures.reset(token)
+        health.record(provider, outcome)
+
+
+async def _guarded_async(provider, call):
+    """_guarded 的异步版本，call() 返回协程"""
+    health = provider_health.get_health()
+    health.before_call(provider)
+    failures = []
+    token = _call_failures.set(failures)
+    outcome = None
+    try:
+        result = await call()
+        outcome = _call_outcome(result, failures, False)
+        return result
+    finally:
+        _call_failures.reset(token)
+        health.record(provider, outcome)
+
+
+# --- 端点路由 ---
+def _call_openai(prompt, model_name, resolved, temperature, max_tokens, extra_params=None, extract=_message_text, answer_stream=None):
+    """经熔断器和 endpoint_router 调用 OpenAI 兼容接口，参数与 call_openai_api 相同，失败时转移到其他端点"""
+    router = endpoint_router.get_router()
+    return _guarded(_health_key(model_name, resolved), lambda: router.call(
+        model_name, router.endpoints(model_name, resolved), lambda endpoint: call_openai_api(
+            prompt, model_name, endpoint.api_key, endpoint.base_url, temperature, max_tokens, extra_params, extract, answer_stream
+        )
+    ))
+
+
+async def _call_openai_async(prompt, model_name, resolved, temperature, max_tokens, extra_params=None, extract=_message_text, answer_stream=None):
+    """_call_openai 的异步版本，开启 HEDGE_REQUESTS 时对慢请求补发对冲请求"""
+    router = endpoint_router.get_router()
+    return await _guarded_async(_health_key(model_name, resolved), lambda: router.call_async(
+        model_name, router.endpoints(model_name, resolved), lambda endpoint: call_openai_api_async(
+            prompt, model_name, endpoint.api_key, endpoint.base_url, temperature, max_tokens, extra_params, extract, answer_stream
+        )
+    ))
+
+
+# --- 主接口函数 ---
+def _call_provider(prompt, model_name, temperature, max_tokens, answer_stream=None):
+    """不经缓存，直接调用模型所属供应商的API；answer_stream 只对 OpenAI 兼容接口生效"""
+    resolved = _resolve_available(model_name)
+    if resolved is None:
+        return None
+    api_provider = resolved["provider"]
+    api_key = resolved["api_key"]
+    secret_key = resolved["secret_key"]
+    base_url = resolved["base_url"]
 
     # 调用具体API
     response_text = None
     if api_provider == "openai" or api_provider == "openai_compatible_opensource":
-        response_text = call_openai_api(prompt, model_name, api_key, base_url, temperature, max_tokens)
+        result = _call_openai(
+            prompt, model_name, resolved, temperature, max_tokens,
+            extra_params=text_request_params(), answer_stream=answer_stream,
+        )
+        response_text = result[0] if answer_stream is not None and result else result
     elif api_provider == "anthropic":
-        response_text = call_anthropic_api(prompt, model_name, api_key, base_url, temperature, max_tokens)
+        response_text = _guarded(api_provider, lambda: call_anthropic_api(prompt, model_name, api_key, base_url, temperature, max_tokens), count_unreported=True)
     elif api_provider == "google":
-        response_text = call_google_api(prompt, model_name, api_key, base_url, temperature, max_tokens)
+        response_text = _guarded(api_provider, lambda: call_google_api(prompt, model_name, api_key, base_url, temperature, max_tokens), count_unreported=True)
     elif api_provider == "zhipuai":
-         response_text = call_zhipuai_api(prompt, model_name, api_key, base_url, temperature, max_tokens)
+         response_text = _guarded(api_provider, lambda: call_zhipuai_api(prompt, model_name, api_key, base_url, temperature, max_tokens), count_unreported=True)
     elif api_provider == "baidu":
-         response_text = call_baidu_api(prompt, model_name, api_key, secret_key, base_url, temperature, max_tokens)
+         response_text = _guarded(api_provider, lambda: call_baidu_api(prompt, model_name, api_key, secret_key, base_url, temperature, max_tokens), count_unreported=True)
+
+    # 请求节奏由 rate_limiter 中的限流器控制，不再固定延迟
+    return response_text
+
 
+def _request_defaults(temperature, max_tokens):
+    """未指定的温度和回复长度在调用时读取配置，使 config.apply() 和命令行覆盖生效"""
+    temperature = config.TEMPERATURE if temperature is None else temperature
+    max_tokens = config.MAX_TOKENS_PER_RESPONSE if max_tokens is None else max_tokens
+    return temperature, max_tokens
 
-    # 简单的延迟
-    if response_text is not None: # 只有成功调用后才延迟
-      time.sleep(config.REQUEST_DELAY)
 
-    return response_text
\ No newline at end of file
+def get_llm_response(prompt, model_name, temperature=None, max_tokens=None, sample_index=0, answer_stream=None, unit_id=None):
+    """
+    根据模型名称调用相应的API，并传递 Base URL；结果按请求参数缓存在本地。
+    开启 STREAM_RESPONSES 时，answer_stream（创建 AnswerStream 的函数）用于在答案齐全后提前结束生成
+    """
+    temperature, max_tokens = _request_defaults(temperature, max_tokens)
+    cache = response_cache.get_cache()
+    cache_key = _text_cache_key(prompt, model_name, temperature, max_tokens, sample_index, unit_id)
+    cached = cache.get(cache_key)
+    if cached is not None or cache.mode == "replay":
+        telemetry.record_cache_hits(1 if cached is not None else 0)
+        return cached
+
+    response_text = _call_provider(prompt, model_name, temperature, max_tokens, _streaming(answer_stream))
+    cache.put(cache_key, model_name, response_text)
+    return response_text
+
+
+async def get_llm_response_async(prompt, model_name, temperature=None, max_tokens=None, sample_index=0, answer_stream=None, unit_id=None):
+    """get_llm_response 的异步版本，供并发调度使用"""
+    temperature, max_tokens = _request_defaults(temperature, max_tokens)
+    cache = response_cache.get_cache()
+    cache_key = _text_cache_key(prompt, model_name, temperature, max_tokens, sample_index, unit_id)
+    cached = cache.get(cache_key)
+    if cached is not None or cache.mode == "replay":
+        telemetry.record_cache_hits(1 if cached is not None else 0)
+        return cached
+
+    resolved = _resolve_available(model_name)
+    if resolved is None:
+        return None
+    if resolved["provider"] == "openai":
+        answer_stream = _streaming(answer_stream)
+        result = await _call_openai_async(
+            prompt, model_name, resolved, temperature, max_tokens,
+            extra_params=text_request_params(), answer_stream=answer_stream,
+        )
+        response_text = result[0] if answer_stream is not None and result else result
+    else:
+        # 其他供应商暂无异步实现，放到线程中执行同步版本，避免阻塞事件循环
+        response_text = await asyncio.to_thread(_call_provider, prompt, model_name, temperature, max_tokens)
+    cache.put(cache_key, model_name, response_text)
+    return response_text
+
+
+# --- 多次采样 ---
+def supports_multi_choice(model_name):
+    return model_name in config.MULTI_CHOICE_MODELS
+
+
+def _cached_samples(prompt, model_name, temperature, max_tokens, sample_indices, unit_id=None):
+    """逐个样本查缓存，返回 (缓存, 缓存键列表, 回复列表, 未命中的位置列表)"""
+    cache = response_cache.get_cache()
+    keys = [_text_cache_key(prompt, model_name, temperature, max_tokens, sample_index, unit_id) for sample_index in sample_indices]
+    responses = [cache.get(key) for key in keys]
+    missing = [pos for pos, response_text in enumerate(responses) if response_text is None]
+    telemetry.record_cache_hits(len(responses) - len(missing))
+    return cache, keys, responses, missing
+
+
+def _choice_chunks(positions):
+    size = max(config.MAX_CHOICES_PER_REQUEST, 1)
+    return [positions[start:start + size] for start in range(0, len(positions), size)]
+
+
+def get_llm_responses(prompt, model_name, sample_indices, temperature=None, max_tokens=None, answer_stream=None, unit_id=None):
+    """
+    返回 sample_indices 中每个样本的回复，顺序一致，失败的样本为None。
+    模型支持 n>1 时未缓存的样本在一次请求中生成；不支持或接口返回的回复数不足时，剩余样本逐个调用 get_llm_response。
+    每个样本按 (unit_id, sample_index) 缓存，与逐个请求时的缓存键相同；unit_id 通常为 persona_id
+    """
+    temperature, max_tokens = _request_defaults(temperature, max_tokens)
+    sample_indices = list(sample_indices)
+    if len(sample_indices) == 1 or not supports_multi_choice(model_name):
+        return [get_llm_response(prompt, model_name, temperature, max_tokens, index, answer_stream, unit_id) for index in sample_indices]
+
+    cache, keys, responses, missing = _cached_samples(prompt, model_name, temperature, max_tokens, sample_indices, unit_id)
+    if not missing or cache.mode == "replay":
+        return responses
+    resolved = _resolve_available(model_name)
+    if resolved is None:
+        return responses
+    if resolved["provider"] == "openai":
+        for chunk in _choice_chunks(missing):
+            texts = _call_openai(
+                prompt, model_name, resolved, temperature, max_tokens,
+                extra_params=text_request_params({"n": len(chunk)}), extract=_choice_texts,
+                answer_stream=_streaming(answer_stream),
+            )
+            if texts is None:
+                return responses # 请求本身失败（已重试），不再逐个重复请求
+            for pos, response_text in zip(chunk, texts):
+                responses[pos] = response_text
+                cache.put(keys[pos], model_name, response_text)
+    # 部分兼容接口会忽略 n，只返回一个回复
+    for pos in missing:
+        if responses[pos] is None:
+            responses[pos] = get_llm_response(prompt, model_name, temperature, max_tokens, sample_indices[pos], answer_stream, unit_id)
+    return responses
+
+
+async def get_llm_responses_async(prompt, model_name, sample_indices, temperature=None, max_tokens=None, answer_stream=None, unit_id=None):
+    """get_llm_responses 的异步版本"""
+    temperature, max_tokens = _request_defaults(temperature, max_tokens)
+    sample_indices = list(sample_indices)
+    if len(sample_indices) == 1 or not supports_multi_choice(model_name):
+        return [
+            await get_llm_response_async(prompt, model_name, temperature, max_tokens, index, answer_stream, unit_id)
+            for index in sample_indices
+        ]
+
+    cache, keys, responses, missing = _cached_samples(prompt, model_name, temperature, max_tokens, sample_indices, unit_id)
+    if not missing or cache.mode == "replay":
+        return responses
+    resolved = _resolve_available(model_name)
+    if resolved is None:
+        return responses
+    if resolved["provider"] == "openai":
+        for chunk in _choice_chunks(missing):
+            texts = await _call_openai_async(
+                prompt, model_name, resolved, temperature, max_tokens,
+                extra_params=text_request_params({"n": len(chunk)}), extract=_choice_texts,
+                answer_stream=_streaming(answer_stream),
+            )
+            if texts is None:
+                return responses
+            for pos, response_text in zip(chunk, texts):
+                responses[pos] = response_text
+                cache.put(keys[pos], model_name, response_text)
+    for pos in missing:
+        if responses[pos] is None:
+            responses[pos] = await get_llm_response_async(
+                prompt, model_name, temperature, max_tokens, sample_indices[pos], answer_stream, unit_id
+            )
+    return responses
+
+
+# --- 按 logprobs 评分 ---
+def supports_logprobs(model_name):
+    return model_name in config.LOGPROB_MODELS
+
+
+def _logprob_params(top_logprobs):
+    return {"logprobs": True, "top_logprobs": top_logprobs}
+
+
+def _logprob_cache_key(prompt, model_name, max_tokens, top_logprobs, sample_index=0):
+    # 修复环节的每一轮使用不同的 sample_index，否则第二轮会直接读到第一轮缓存的结果
+    return response_cache.make_cache_key(
+        prompt, SYSTEM_MESSAGE, model_name, config.LOGPROB_TEMPERATURE, max_tokens,
+        sample_index=sample_index, variant=f"logprobs:{top_logprobs}",
+    )
+
+
+def _resolve_logprob_provider(model_name):
+    resolved = _resolve_available(model_name)
+    if resolved is not None and resolved["provider"] != "openai":
+        print(f"模型 {model_name} 的供应商 ({resolved['provider']}) 不支持 logprobs 评分。")
+        return None
+    return resolved
+
+
+def get_llm_logprobs(prompt, model_name, max_tokens=None, top_logprobs=None, sample_index=0):
+    """
+    以贪心解码调用一次模型，返回回复文本及每个token的候选概率（见 _token_logprobs），失败时返回None。
+    结果同样缓存在本地；供 answer_parser.SurveyParser.parse_logprobs 计算每题的答案分布
+    """
+    _, max_tokens = _request_defaults(None, max_tokens)
+    top_logprobs = config.LOGPROB_TOP_K if top_logprobs is None else top_logprobs
+    cache = response_cache.get_cache()
+    cache_key = _logprob_cache_key(prompt, model_name, max_tokens, top_logprobs, sample_index)
+    cached = cache.get(cache_key)
+    if cached is not None or cache.mode == "replay":
+        telemetry.record_cache_hits(1 if cached is not None else 0)
+        return json.loads(cached) if cached is not None else None
+
+    resolved = _resolve_logprob_provider(model_name)
+    if resolved is None:
+        return None
+    result = _call_openai(
+        prompt, model_name, resolved, config.LOGPROB_TEMPERATURE, max_tokens,
+        extra_params=_logprob_params(top_logprobs), extract=_token_logprobs,
+    )
+    if result is not None:
+        cache.put(cache_key, model_name, json.dumps(result, ensure_ascii=False))
+    return result
+
+
+async def get_llm_logprobs_async(prompt, model_name, max_tokens=None, top_logprobs=None, sample_index=0):
+    """get_llm_logprobs 的异步版本"""
+    _, max_tokens = _request_defaults(None, max_tokens)
+    top_logprobs = config.LOGPROB_TOP_K if top_logprobs is None else top_logprobs
+    cache = response_cache.get_cache()
+    cache_key = _logprob_cache_key(prompt, model_name, max_tokens, top_logprobs, sample_index)
+    cached = cache.get(cache_key)
+    if cached is not None or cache.mode == "replay":
+        telemetry.record_cache_hits(1 if cached is not None else 0)
+        return json.loads(cached) if cached is not None else None
+
+    resolved = _resolve_logprob_provider(model_name)
+    if resolved is None:
+        return None
+    result = await _call_openai_async(
+        prompt, model_name, resolved, config.LOGPROB_TEMPERATURE, max_tokens,
+        extra_params=_logprob_params(top_logprobs), extract=_token_logprobs,
+    )
+    if result is not None:
+        cache.put(cache_key, model_name, json.dumps(result, ensure_ascii=False))
+    return result
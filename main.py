@@ -1,180 +1,1030 @@
 # simulation_runner.py
-import csv
+import argparse
+import asyncio
 import json
+import math
+import multiprocessing
+import os
+import sys
+import time
 import config
+import answer_aggregator
+import answer_parser
+import batch_runner
+import endpoint_router
+import job_queue
 import persona_loader
 import llm_interface
-from tqdm import tqdm # 用于显示进度条，需要 pip install tqdm
+import provider_health
+import rate_limiter
+import repair_pass
+import response_cache
+import result_sink
+import run_manifest
+import survey_planner
+import telemetry
 
 def parse_llm_response(response_text, num_questions_local):
     """
     解析LLM返回的问卷答案。
     预期格式: '题号：[选项编号]' 每行一个
-    返回一个字典 {题号: 答案}
-    """
-    answers = {}
-    if not response_text:
-        return {i: "ERROR_NO_RESPONSE" for i in range(1, num_questions_local + 1)}
-
-    lines = response_text.strip().split('\n')
-    expected_ids = set(range(1, num_questions_local + 1))
-    found_ids = set()
-
-    for line in lines:
-        line = line.strip()
-        if not line: continue
-        parts = line.split('：') # 使用中文冒号
-        if len(parts) != 2:
-            parts = line.split(':') # 尝试英文冒号
-        if len(parts) == 2:
-            try:
-                q_id_str = parts[0].strip().replace('题号', '').replace('问题', '') # 移除"题号"或"问题"
-                q_id = int(q_id_str)
-                answer = parts[1].strip()
-                # 简单验证答案格式 (例如，是否只是一个数字或字母)
-                # 你可能需要根据问卷选项类型调整这里的验证逻辑
-                if q_id in expected_ids:
-                    answers[q_id] = answer
-                    found_ids.add(q_id)
-                else:
-                    print(f"警告：解析到无效题号 {q_id} 在行: '{line}'")
+    返回答案列表，索引对应题号-1；不校验选项，需要校验时请使用 answer_parser.SurveyParser
+    """
+    parser = _generic_parsers.get(num_questions_local)
+    if parser is None:
+        parser = answer_parser.SurveyParser([{"id": i} for i in range(1, num_questions_local + 1)])
+        _generic_parsers[num_questions_local] = parser
+    return parser.parse_answers(response_text)
 
-            except ValueError:
-                print(f"警告：无法解析题号或答案格式不符，行: '{line}'")
-            except Exception as e:
-                print(f"解析行 '{line}' 时发生未知错误: {e}")
-        else:
-             print(f"警告：无法解析行，格式不符: '{line}'")
+
+_generic_parsers = {}
+
+
+def _progress_bar(*args, **kwargs):
+    from tqdm import tqdm # 用于显示进度条，需要 pip install tqdm；只在真正运行时导入
+    return tqdm(*args, **kwargs)
+
+
+def _use_logprobs(model_name):
+    return config.SCORING_MODE == "logprobs" and llm_interface.supports_logprobs(model_name)
+
+
+def _samples_per_unit(model_name):
+    """每个 (人设, 模型) 的样本数；logprobs 评分一次调用即得到答案分布，无需重复采样"""
+    return 1 if _use_logprobs(model_name) else config.SAMPLES_PER_UNIT
+
+
+def _stop_early(persona_type, model_name):
+    """开启 AGGREGATE_STOP_WHEN_CONVERGED 且该组合的答案分布已收敛时不再调度新单元"""
+    return config.AGGREGATE_STOP_WHEN_CONVERGED and answer_aggregator.get_aggregator().converged(persona_type, model_name)
+
+
+def _write_unit_rows(writer, distribution_writer, manifest, persona_id, persona_type, model_name, rows):
+    """
+    rows: [(sample_index, 答案列表, 分布列表), ...]，每个样本一行。
+    每个样本先写结果再记清单，崩溃时最多重做一个样本
+    """
+    for sample_index, answers_list, distributions in rows:
+        row_key = [persona_id, persona_type, model_name, sample_index]
+        if distribution_writer is not None:
+            distribution_writer.write_row(row_key + result_sink.format_distributions(distributions))
+        writer.write_row(row_key + answers_list)
+        manifest.mark_done(persona_id, persona_type, model_name, sample_index)
+
+
+def _parse_samples(parser, plan, sample_indices, responses_by_chunk):
+    """responses_by_chunk[块][样本] -> 每个样本一行，各块的回复按题号合并"""
+    no_distributions = [None] * len(parser.question_ids)
+    return [
+        (sample_index, plan.parse(parser, [responses[pos] for responses in responses_by_chunk]), no_distributions)
+        for pos, sample_index in enumerate(sample_indices)
+    ]
 
 
-    # 处理缺失的答案
-    missing_ids = expected_ids - found_ids
-    for missing_id in missing_ids:
-        answers[missing_id] = "ERROR_MISSING"
+def _trace_rows(trace, rows):
+    """把本单元各样本的解析结果计入遥测记录"""
+    for _, answers_list, _ in rows:
+        statuses = [answer_parser.status_of(answer) for answer in answers_list]
+        trace.responses += 1
+        if statuses and all(status == answer_parser.STATUS_NO_RESPONSE for status in statuses):
+            trace.failed_responses += 1
+        trace.add_parse_statuses(statuses)
 
-    # 按题号排序返回 (虽然字典本身无序，但方便后续处理)
-    # return dict(sorted(answers.items()))
-     # 返回排序后的答案列表，索引对应题号-1
-    sorted_answers = [answers.get(i, "ERROR_NOT_FOUND") for i in range(1, num_questions_local + 1)]
-    return sorted_answers
 
+def _plan_survey(persona_type, prompt_template, survey_formatted_local, survey_questions, models_to_run):
+    plan = survey_planner.plan_survey(survey_questions, prompt_template, models_to_run, survey_formatted_local)
+    if plan.num_chunks > 1:
+        print(f"  {persona_type}: {survey_planner.describe_plan(plan)}")
+    return plan
 
-def run_simulation(persona_type, personas: dict, prompt_template, survey_formatted_local, survey_questions, models_to_run, output_file):
-    """运行模拟并保存结果"""
+
+def _render_prompts(prompt_builders, persona_type, persona):
+    """填充一个人设的提示词（问卷分块时每块一个）；渲染失败时打印错误并返回None，该人设的单元记为失败"""
+    try:
+        return [build_prompt(persona['description']) for build_prompt in prompt_builders]
+    except Exception as e:
+        print(f"渲染提示词时发生错误 ({persona_type}, {persona['id']}): {e!r}")
+        return None
+
+
+def run_simulation(persona_type, personas, prompt_template, survey_formatted_local, survey_questions, models_to_run, output_file, manifest=None):
+    """运行模拟并保存结果（追加写入，运行清单中已完成的单元会被跳过）"""
     print(f"\n--- 开始模拟: {persona_type} 人设 ---")
-    num_questions_local = len(survey_questions)
-    # 构建CSV表头
-    headers = ['persona_id', 'persona_type', 'model'] + [f'q{q["id"]}' for q in survey_questions]
+    parser = answer_parser.SurveyParser(survey_questions)
+    plan = _plan_survey(persona_type, prompt_template, survey_formatted_local, survey_questions, models_to_run)
+    prompt_builders = plan.prompt_builders(prompt_template)
 
+    own_manifest = manifest is None
+    if own_manifest:
+        manifest = run_manifest.RunManifest(config.RUN_MANIFEST_FILE)
+    writer = None
+    distribution_writer = None
+    converged_units = 0
+    deferred_units = 0
+    failed_units = 0
     try:
-        with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(headers)
-
-            # 使用tqdm显示进度
-            for persona in tqdm(personas, desc=f"模拟 {persona_type} 人设"):
-                persona_id = persona['id']
-                persona_description = persona['description']
-
-                # 填充提示词模板
-                final_prompt = prompt_template.format(
-                    persona_description=persona_description,
-                    survey_questions_formatted=survey_formatted_local
-                )
+        writer = result_sink.open_result_writer(persona_type, output_file, survey_questions)
+        manifest.reconcile(writer.existing_keys())
+        if config.SCORING_MODE == "logprobs":
+            distribution_writer = result_sink.open_distribution_writer(output_file, survey_questions)
 
-                for provider, model_list in models_to_run.items():
-                    for model_name in model_list:
+        # 使用tqdm显示进度
+        for persona in _progress_bar(personas, desc=f"模拟 {persona_type} 人设"):
+            persona_id = persona['id']
+            final_prompts = _render_prompts(prompt_builders, persona_type, persona)
+
+            for provider, model_list in models_to_run.items():
+                for model_name in model_list:
+                    sample_indices = manifest.pending_samples(
+                        persona_id, persona_type, model_name, _samples_per_unit(model_name)
+                    )
+                    if not sample_indices:
+                        continue
+                    if _stop_early(persona_type, model_name):
+                        converged_units += len(sample_indices)
+                        continue
+                    if final_prompts is None:
+                        failed_units += len(sample_indices)
+                        continue
+                    try:
                         # 调用LLM API
                         print(f"  正在调用 {model_name} 为 {persona_id}...")
-                        response_text = llm_interface.get_llm_response(
-                            prompt=final_prompt,
-                            model_name=model_name,
-                            temperature=config.TEMPERATURE
-                        )
-
-                        # 解析回复
-                        # parsed_answers = parse_llm_response(response_text, num_questions)
-                         # 解析回复并获取答案列表
-                        answers_list = parse_llm_response(response_text, num_questions_local)
+                        with telemetry.trace_unit(
+                            provider, model_name, persona_type=persona_type, persona_id=str(persona_id),
+                            samples=sample_indices, chunks=plan.num_chunks
+                        ) as trace:
+                            if _use_logprobs(model_name):
+                                # 一次调用得到每题的答案分布
+                                results = [
+                                    llm_interface.get_llm_logprobs(prompt, model_name, max_tokens=plan.max_tokens(chunk_index))
+                                    for chunk_index, prompt in enumerate(final_prompts)
+                                ]
+                                answers_list, distributions = plan.parse_logprobs(parser, results)
+                                rows = [(0, answers_list, distributions)]
+                            else:
+                                # 多个样本在支持 n>1 的模型上合并为一次请求
+                                responses_by_chunk = [
+                                    llm_interface.get_llm_responses(
+                                        prompt=prompt,
+                                        model_name=model_name,
+                                        sample_indices=sample_indices,
+                                        temperature=config.TEMPERATURE,
+                                        max_tokens=plan.max_tokens(chunk_index),
+                                        answer_stream=plan.answer_stream_factory(parser, chunk_index),
+                                        unit_id=persona_id,
+                                    )
+                                    for chunk_index, prompt in enumerate(final_prompts)
+                                ]
 
+                                # 解析回复并获取答案列表
+                                rows = _parse_samples(parser, plan, sample_indices, responses_by_chunk)
+                            _trace_rows(trace, rows)
 
-                        # 准备写入CSV的数据行
-                        # row_data = [persona_id, persona_type, model_name] + [parsed_answers.get(q['id'], 'ERROR_PARSE') for q in survey_questions]
-                        row_data = [persona_id, persona_type, model_name] + answers_list
-                        writer.writerow(row_data)
+                        _write_unit_rows(writer, distribution_writer, manifest, persona_id, persona_type, model_name, rows)
+                    except IOError:
+                        raise
+                    except provider_health.ProviderUnavailable:
+                        # 供应商熔断或模型无法调用：不写入结果，续跑时重试
+                        deferred_units += len(sample_indices)
+                    except Exception as e:
+                        # 单个单元失败只跳过该单元，下次续跑时会重试
+                        failed_units += len(sample_indices)
+                        print(f"运行模拟时发生未知错误 ({persona_type}, {persona_id}, {model_name}): {e}")
 
     except IOError as e:
         print(f"错误: 无法写入结果文件 {output_file}: {e}")
-    except Exception as e:
-        print(f"运行模拟时发生未知错误 ({persona_type}, {persona_id}): {e}")
+    finally:
+        if writer is not None:
+            writer.close()
+        if distribution_writer is not None:
+            distribution_writer.close()
+        if own_manifest:
+            manifest.close()
 
+    if converged_units:
+        print(f"答案分布已收敛，跳过 {converged_units} 个模拟任务。")
+    if deferred_units:
+        print(f"警告：{deferred_units} 个模拟任务因供应商不可用被跳过，重新运行即可续跑。")
+    if failed_units:
+        print(f"警告：{failed_units} 个模拟任务失败，重新运行即可续跑。")
+    print(f"  {answer_parser.format_stats(parser.stats)}")
     print(f"--- 模拟完成: {persona_type} 人设，结果保存在 {output_file} ---")
 
 
-if __name__ == "__main__":
-    print("开始加载数据和配置...")
-    # 加载问卷
-    survey = persona_loader.load_survey()
-    if not survey:
-        print("错误：无法加载问卷，退出。")
-        exit()
-    survey_formatted = persona_loader.format_survey_questions(survey)
-    num_questions = len(survey)
+def _make_limits(models_to_run):
+    """全局在途请求数，以及按供应商和按模型的并发限制"""
+    in_flight = asyncio.Semaphore(config.MAX_CONCURRENT_REQUESTS)
+    provider_limits = {
+        provider: asyncio.Semaphore(config.PROVIDER_CONCURRENCY.get(provider, config.DEFAULT_PROVIDER_CONCURRENCY))
+        for provider in models_to_run
+    }
+    model_limits = {
+        model_name: asyncio.Semaphore(config.MODEL_CONCURRENCY.get(model_name, config.DEFAULT_MODEL_CONCURRENCY))
+        for model_list in models_to_run.values() for model_name in model_list
+    }
+    return in_flight, provider_limits, model_limits
 
-    # 加载画像数据
-    general_personas = persona_loader.load_general_personas()
-    silicon_personas = persona_loader.load_silicon_personas()
-    cognitive_personas = persona_loader.load_cognitive_personas()
 
-    # 加载提示词模板
-    prompt_templates = {}
-    for p_type in config.PROMPT_FILES.keys():
-        template = persona_loader.load_prompt_template(p_type)
-        if template:
-            prompt_templates[p_type] = template
+async def _fetch_chunk(limits, parser, plan, chunk_index, prompt, provider, model_name, persona_id, sample_indices):
+    _, provider_limits, model_limits = limits
+    wait_start = time.perf_counter()
+    async with provider_limits[provider], model_limits[model_name]:
+        telemetry.add_queue_time(time.perf_counter() - wait_start)
+        if _use_logprobs(model_name):
+            return await llm_interface.get_llm_logprobs_async(
+                prompt, model_name, max_tokens=plan.max_tokens(chunk_index), sample_index=sample_indices[0]
+            )
+        return await llm_interface.get_llm_responses_async(
+            prompt=prompt,
+            model_name=model_name,
+            sample_indices=sample_indices,
+            temperature=config.TEMPERATURE,
+            max_tokens=plan.max_tokens(chunk_index),
+            answer_stream=plan.answer_stream_factory(parser, chunk_index),
+            unit_id=persona_id,
+        )
+
+
+async def _simulate_unit_async(parser, plan, limits, persona_type, persona_id, final_prompts, provider, model_name, sample_indices, **labels):
+    """运行一个单元的一组样本，返回 [(sample_index, 答案列表, 分布列表), ...]；labels 附加到遥测记录"""
+    with telemetry.trace_unit(
+        provider, model_name, persona_type=persona_type, persona_id=str(persona_id),
+        samples=sample_indices, chunks=plan.num_chunks, **labels
+    ) as trace:
+        # 问卷分块时各块并行请求，每块各自占用供应商/模型并发名额；子任务共享同一条遥测记录
+        chunk_results = await asyncio.gather(*(
+            _fetch_chunk(limits, parser, plan, chunk_index, prompt, provider, model_name, persona_id, sample_indices)
+            for chunk_index, prompt in enumerate(final_prompts)
+        ))
+        if _use_logprobs(model_name):
+            answers_list, distributions = plan.parse_logprobs(parser, chunk_results)
+            rows = [(0, answers_list, distributions)]
         else:
-            print(f"警告：无法加载 {p_type} 的提示词模板，将跳过此类型模拟。")
+            rows = _parse_samples(parser, plan, sample_indices, chunk_results)
+        _trace_rows(trace, rows)
+    return rows
 
-    print("数据和配置加载完毕。")
 
-    # 按类型运行模拟
-    if "general" in prompt_templates and general_personas:
-        run_simulation(
-            "general",
-            general_personas,
-            prompt_templates["general"],
-            survey_formatted,
-            survey,
-            config.MODELS_TO_RUN,
-            config.OUTPUT_FILES["general"]
-        )
+def _request_groups(model_name, sample_indices):
+    """支持 n>1 的模型一次请求生成全部样本，其余模型每个样本一个请求，各自占用并发名额"""
+    if llm_interface.supports_multi_choice(model_name):
+        return [sample_indices]
+    return [[sample_index] for sample_index in sample_indices]
+
+
+async def run_simulation_async(simulation_tasks, survey_formatted_local, survey_questions, models_to_run, output_files, manifest):
+    """
+    并发运行多个画像类型的模拟。
+    simulation_tasks: [(persona_type, personas, prompt_template), ...]
+    按供应商和模型分别限制并发，结果按完成顺序追加写入各自的CSV文件，已完成的单元会被跳过。
+    """
+    print(f"\n--- 开始并发模拟: {', '.join(t[0] for t in simulation_tasks)} 人设 ---")
+    parser = answer_parser.SurveyParser(survey_questions)
+
+    limits = _make_limits(models_to_run)
+    in_flight = limits[0]
+    samples_per_persona = sum(
+        _samples_per_unit(model_name) for model_list in models_to_run.values() for model_name in model_list
+    )
+    # 人设可能是惰性生成器，此时总数未知
+    if all(hasattr(t[1], '__len__') for t in simulation_tasks):
+        total_units = sum(len(t[1]) for t in simulation_tasks) * samples_per_persona
     else:
-        print("\n跳过通用人设模拟（数据或模板加载失败）。")
-
-    if "silicon" in prompt_templates and silicon_personas:
-        run_simulation(
-            "silicon",
-            silicon_personas,
-            prompt_templates["silicon"],
-            survey_formatted,
-            survey,
-            config.MODELS_TO_RUN,
-            config.OUTPUT_FILES["silicon"]
+        total_units = None
+    progress = _progress_bar(total=total_units, desc="并发模拟")
+
+    writers = {}
+    distribution_writers = {}
+    plans = {}
+    pending = set()
+    failed_units = 0
+    skipped_units = 0
+    converged_units = 0
+    deferred_units = 0
+
+    async def run_unit(persona_type, persona_id, final_prompts, provider, model_name, sample_indices):
+        nonlocal failed_units, deferred_units
+        try:
+            rows = await _simulate_unit_async(
+                parser, plans[persona_type], limits, persona_type, persona_id, final_prompts, provider, model_name, sample_indices
+            )
+            # 事件循环是单线程的，这里直接写入不会交错
+            _write_unit_rows(
+                writers[persona_type], distribution_writers.get(persona_type), manifest,
+                persona_id, persona_type, model_name, rows
+            )
+        except provider_health.ProviderUnavailable:
+            # 供应商熔断或模型无法调用：不写入结果，续跑时重试
+            deferred_units += len(sample_indices)
+        except Exception as e:
+            # 单个任务失败不影响其他任务，下次续跑时会重试
+            failed_units += len(sample_indices)
+            print(f"运行模拟时发生未知错误 ({persona_type}, {persona_id}, {model_name}): {e}")
+        finally:
+            in_flight.release()
+            progress.update(len(sample_indices))
+
+    try:
+        for persona_type, _, _ in simulation_tasks:
+            writers[persona_type] = result_sink.open_result_writer(persona_type, output_files[persona_type], survey_questions)
+            manifest.reconcile(writers[persona_type].existing_keys())
+            if config.SCORING_MODE == "logprobs":
+                distribution_writers[persona_type] = result_sink.open_distribution_writer(
+                    output_files[persona_type], survey_questions
+                )
+
+        for persona_type, personas, prompt_template in simulation_tasks:
+            plans[persona_type] = _plan_survey(
+                persona_type, prompt_template, survey_formatted_local, survey_questions, models_to_run
+            )
+            prompt_builders = plans[persona_type].prompt_builders(prompt_template)
+            for persona in personas:
+                final_prompts = None
+                rendered = False
+                for provider, model_list in models_to_run.items():
+                    for model_name in model_list:
+                        num_samples = _samples_per_unit(model_name)
+                        sample_indices = manifest.pending_samples(persona['id'], persona_type, model_name, num_samples)
+                        if len(sample_indices) < num_samples:
+                            skipped_units += num_samples - len(sample_indices)
+                            progress.update(num_samples - len(sample_indices))
+                        if not sample_indices:
+                            continue
+                        if _stop_early(persona_type, model_name):
+                            converged_units += len(sample_indices)
+                            progress.update(len(sample_indices))
+                            continue
+                        if not rendered:
+                            final_prompts = _render_prompts(prompt_builders, persona_type, persona)
+                            rendered = True
+                        if final_prompts is None:
+                            failed_units += len(sample_indices)
+                            progress.update(len(sample_indices))
+                            continue
+                        for group in _request_groups(model_name, sample_indices):
+                            # 在途请求达到上限时在此等待，避免一次性创建全部任务
+                            await in_flight.acquire()
+                            task = asyncio.create_task(
+                                run_unit(persona_type, persona['id'], final_prompts, provider, model_name, group)
+                            )
+                            pending.add(task)
+                            task.add_done_callback(pending.discard)
+
+        if pending:
+            await asyncio.gather(*pending)
+    except IOError as e:
+        print(f"错误: 无法写入结果文件: {e}")
+    finally:
+        progress.close()
+        for writer in list(writers.values()) + list(distribution_writers.values()):
+            writer.close()
+
+    if skipped_units:
+        print(f"已跳过 {skipped_units} 个此前完成的模拟任务。")
+    if converged_units:
+        print(f"答案分布已收敛，跳过 {converged_units} 个模拟任务。")
+    if deferred_units:
+        print(f"警告：{deferred_units} 个模拟任务因供应商不可用被跳过，重新运行即可续跑。")
+    if failed_units:
+        print(f"警告：{failed_units} 个模拟任务失败，重新运行即可续跑。")
+    print(f"  {answer_parser.format_stats(parser.stats)}")
+    for persona_type in writers:
+        print(f"--- 模拟完成: {persona_type} 人设，结果保存在 {output_files[persona_type]} ---")
+
+
+def _group_jobs(jobs):
+    """把领取到的任务按 (人设, 模型) 分组，再按是否支持 n>1 拆成请求组"""
+    groups = {}
+    for job in jobs:
+        groups.setdefault((job.persona_type, job.persona_id, job.provider, job.model), []).append(job)
+    for (_, _, _, model_name), unit_jobs in groups.items():
+        by_sample = {job.sample_index: job for job in unit_jobs}
+        for sample_indices in _request_groups(model_name, sorted(by_sample)):
+            yield [by_sample[sample_index] for sample_index in sample_indices]
+
+
+async def run_queue_worker_async(queue, worker_id):
+    """
+    任务队列 worker：持续领取任务并运行，结果写回队列，直到队列中没有待运行或运行中的任务。
+    其他 worker 仍持有租约时等待，租约过期（worker 崩溃）后接手这些任务
+    """
+    run = queue.load_run()
+    if run is None:
+        print(f"错误：任务队列 {queue.path} 中还没有任务，请先以协调者身份运行（python main.py run --mode queue）。")
+        return
+    survey_questions, survey_formatted_local, templates, models_to_run = run
+    parser = answer_parser.SurveyParser(survey_questions)
+    plans = {}
+    prompt_builders = {}
+    for persona_type, template in templates.items():
+        plans[persona_type] = _plan_survey(persona_type, template, survey_formatted_local, survey_questions, models_to_run)
+        prompt_builders[persona_type] = plans[persona_type].prompt_builders(template)
+
+    limits = _make_limits(models_to_run)
+    in_flight = limits[0]
+    pending = set()
+    counts = {"done": 0, "retry": 0, "failed": 0, "deferred": 0}
+    progress = _progress_bar(desc=f"队列 worker {worker_id}")
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(config.JOB_HEARTBEAT_INTERVAL)
+            try:
+                queue.heartbeat(worker_id)
+            except Exception as e:
+                # 偶尔续约失败不要紧，租约时长应为续约间隔的数倍
+                print(f"警告：任务租约续约失败: {e}")
+
+    async def run_jobs(jobs):
+        first = jobs[0]
+        sample_indices = [job.sample_index for job in jobs]
+        try:
+            final_prompts = [build_prompt(first.description) for build_prompt in prompt_builders[first.persona_type]]
+            rows = await _simulate_unit_async(
+                parser, plans[first.persona_type], limits, first.persona_type, first.persona_id,
+                final_prompts, first.provider, first.model, sample_indices
+            )
+            for job, (_, answers_list, distributions) in zip(jobs, rows):
+                no_response = all(answer == answer_parser.ERROR_NO_RESPONSE for answer in answers_list)
+                if no_response and job.attempts < queue.max_attempts:
+                    # 请求全部失败时放回队列稍后重试，最后一次仍失败才按无回复记录
+                    queue.fail(worker_id, job.id, "无回复")
+                    counts["retry"] += 1
+                else:
+                    queue.complete(worker_id, job.id, answers_list, distributions)
+                    counts["done"] += 1
+        except provider_health.ProviderUnavailable as e:
+            if e.retry_after is None:
+                # 模型在本次运行中无法调用：按失败放回（计入领取次数），其他 worker 也许可以调用
+                for job in jobs:
+                    queue.fail(worker_id, job.id, e)
+            else:
+                # 供应商熔断：推迟到熔断器可以再试的时刻，不计入领取次数，不逐个打印
+                queue.defer(worker_id, [job.id for job in jobs], time.time() + e.retry_after, e)
+            counts["deferred"] += len(jobs)
+        except Exception as e:
+            for job in jobs:
+                queue.fail(worker_id, job.id, e)
+            counts["failed"] += len(jobs)
+            print(f"运行模拟时发生未知错误 ({first.persona_type}, {first.persona_id}, {first.model}): {e}")
+        finally:
+            in_flight.release()
+            progress.update(len(jobs))
+
+    heartbeat_task = asyncio.create_task(heartbeat())
+    try:
+        while True:
+            # 只按空闲的并发名额领取，避免一个 worker 囤积任务而其他 worker 无事可做
+            free_slots = config.MAX_CONCURRENT_REQUESTS - len(pending)
+            jobs = queue.claim(worker_id, min(free_slots, config.JOB_CLAIM_BATCH)) if free_slots > 0 else []
+            if jobs:
+                for group in _group_jobs(jobs):
+                    # 在途请求达到上限时在此等待，已领取的任务由心跳保持租约
+                    await in_flight.acquire()
+                    task = asyncio.create_task(run_jobs(group))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+            elif pending:
+                await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            else:
+                # 只剩推迟的任务或他人持有的任务时，睡到最早可能领取的时刻，不反复空领
+                next_claim = queue.next_claim_time()
+                if next_claim is None:
+                    break
+                await asyncio.sleep(max(next_claim - time.time(), config.JOB_POLL_INTERVAL))
+    finally:
+        heartbeat_task.cancel()
+        released = queue.release(worker_id)
+        progress.close()
+        if released:
+            print(f"已归还 {released} 个未完成的任务。")
+
+    print(
+        f"worker {worker_id}: 完成 {counts['done']} 个任务，放回重试 {counts['retry']} 个，出错 {counts['failed']} 个，"
+        f"因供应商不可用放回 {counts['deferred']} 个；"
+        f"{answer_parser.format_stats(parser.stats)}"
+    )
+
+
+def _share_limits(num_workers):
+    """同一台机器上的 worker 进程平分并发和限流额度"""
+    if num_workers <= 1:
+        return
+    config.MAX_CONCURRENT_REQUESTS = max(1, config.MAX_CONCURRENT_REQUESTS // num_workers)
+    config.PROVIDER_CONCURRENCY = {k: max(1, v // num_workers) for k, v in config.PROVIDER_CONCURRENCY.items()}
+    config.MODEL_CONCURRENCY = {k: max(1, v // num_workers) for k, v in config.MODEL_CONCURRENCY.items()}
+    config.DEFAULT_PROVIDER_CONCURRENCY = max(1, config.DEFAULT_PROVIDER_CONCURRENCY // num_workers)
+    config.DEFAULT_MODEL_CONCURRENCY = max(1, config.DEFAULT_MODEL_CONCURRENCY // num_workers)
+    config.RATE_LIMITS = {
+        model_name: {k: v / num_workers for k, v in limits.items()} for model_name, limits in config.RATE_LIMITS.items()
+    }
+    config.DEFAULT_RATE_LIMIT = {k: v / num_workers for k, v in config.DEFAULT_RATE_LIMIT.items()}
+
+
+def run_queue_worker(num_workers=1, settings=None):
+    """
+    独立 worker 进程的入口（本机附加进程或其他机器），只领取和运行任务，不入队也不导出结果。
+    settings 为协调进程的配置快照，spawn 出的子进程据此复现命令行覆盖的配置
+    """
+    if settings is not None:
+        config.apply(settings)
+    config.prepare_runtime()
+    _share_limits(num_workers)
+    queue = job_queue.JobQueue(config.JOB_QUEUE_PATH)
+    telemetry.get_collector().start_run()
+    try:
+        asyncio.run(run_queue_worker_async(queue, job_queue.make_worker_id()))
+    finally:
+        queue.close()
+        llm_interface.close_clients()
+        # 指标文件只由协调进程写出，避免多个进程互相覆盖
+        telemetry.get_collector().finish_run(write_metrics=False)
+
+
+def run_job_queue(simulation_tasks, survey_formatted_local, survey_questions, models_to_run, output_files, manifest):
+    """
+    协调进程：把全部单元写入任务队列，启动本机的附加 worker 进程并自己也作为 worker 运行，
+    队列完成后把结果导出到本地结果文件。其他机器上以 `python main.py worker` 启动的进程可随时加入
+    """
+    print(f"\n--- 开始任务队列模拟: {', '.join(t[0] for t in simulation_tasks)} 人设 ---")
+    queue = job_queue.JobQueue(config.JOB_QUEUE_PATH)
+    writers = {}
+    distribution_writers = {}
+    try:
+        for persona_type, _, _ in simulation_tasks:
+            writers[persona_type] = result_sink.open_result_writer(persona_type, output_files[persona_type], survey_questions)
+            manifest.reconcile(writers[persona_type].existing_keys())
+            if config.SCORING_MODE == "logprobs":
+                distribution_writers[persona_type] = result_sink.open_distribution_writer(
+                    output_files[persona_type], survey_questions
+                )
+
+        queue.prepare_run(survey_questions, survey_formatted_local, {t[0]: t[2] for t in simulation_tasks}, models_to_run)
+        retried = queue.retry_failed()
+        added = queue.enqueue(simulation_tasks, models_to_run, _samples_per_unit, manifest)
+        print(f"任务队列 {queue.path}: 新增 {added} 个任务，重新放回 {retried} 个失败任务；{queue.describe()}")
+
+        num_workers = max(1, config.JOB_QUEUE_LOCAL_WORKERS)
+        # spawn 启动的子进程不继承本进程的连接和事件循环
+        context = multiprocessing.get_context("spawn")
+        settings = config.resolve()
+        processes = [context.Process(target=run_queue_worker, args=(num_workers, settings)) for _ in range(num_workers - 1)]
+        for process in processes:
+            process.start()
+        _share_limits(num_workers)
+        try:
+            asyncio.run(run_queue_worker_async(queue, job_queue.make_worker_id()))
+        finally:
+            for process in processes:
+                process.join()
+
+        for persona_type in writers:
+            written = job_queue.export_results(
+                queue, persona_type, writers[persona_type], distribution_writers.get(persona_type), manifest
+            )
+            print(f"--- 模拟完成: {persona_type} 人设，从任务队列导出 {written} 行，结果保存在 {output_files[persona_type]} ---")
+        counts = queue.counts()
+        if counts[job_queue.JOB_FAILED]:
+            print(f"警告：{counts[job_queue.JOB_FAILED]} 个任务多次重试后仍失败，重新运行即可重试。")
+    finally:
+        for writer in list(writers.values()) + list(distribution_writers.values()):
+            writer.close()
+        queue.close()
+
+
+def run_all_simulations(simulation_tasks, survey_formatted_local, survey_questions, models_to_run, output_files, mode=None, resume=None):
+    """按配置的执行模式运行全部画像类型的模拟；resume 为 False 时清空旧结果重新开始"""
+    mode = mode or config.EXECUTION_MODE
+    resume = config.RESUME_RUNS if resume is None else resume
+    config.prepare_runtime()
+    if not resume:
+        result_files = [output_files[t[0]] for t in simulation_tasks]
+        run_manifest.reset_run(
+            result_files
+            + [result_sink.distribution_path(path) for path in result_files]
+            + [repair_pass.provenance_path(path) for path in result_files]
         )
-    else:
-        print("\n跳过硅基人设模拟（数据或模板加载失败）。")
-
-    if "cognitive" in prompt_templates and cognitive_personas:
-        run_simulation(
-            "cognitive",
-            cognitive_personas,
-            prompt_templates["cognitive"],
-            survey_formatted,
-            survey,
-            config.MODELS_TO_RUN,
-            config.OUTPUT_FILES["cognitive"]
+        result_sink.reset_parquet_results([t[0] for t in simulation_tasks])
+    manifest = run_manifest.RunManifest(config.RUN_MANIFEST_FILE)
+    telemetry.get_collector().start_run()
+    answer_aggregator.get_aggregator().start_run(survey_questions)
+    provider_health.get_health().reset()
+    try:
+        _run_in_mode(mode, simulation_tasks, survey_formatted_local, survey_questions, models_to_run, output_files, manifest)
+    except run_manifest.ResultHeaderMismatch as e:
+        print(f"错误: {e}")
+    finally:
+        manifest.close()
+        llm_interface.close_clients()
+        if llm_interface.get_token_usage():
+            print("Token 用量:")
+            llm_interface.print_token_usage()
+        response_cache.get_cache().flush()
+        cache_stats = response_cache.get_cache().stats()
+        if cache_stats["mode"] != "off":
+            print(f"回复缓存 ({cache_stats['mode']}): 命中 {cache_stats['hits']}，未命中 {cache_stats['misses']}，写入 {cache_stats['writes']}")
+        if config.HEDGE_REQUESTS or config.MODEL_ENDPOINTS:
+            print("端点路由:")
+            for line in endpoint_router.get_router().report_lines():
+                print(line)
+        _print_health_report()
+        answer_aggregator.get_aggregator().finish_run()
+        telemetry.get_collector().finish_run()
+
+
+def _print_health_report():
+    lines = provider_health.get_health().report_lines()
+    if lines:
+        print("供应商健康状况:")
+        for line in lines:
+            print(line)
+
+
+def _run_in_mode(mode, simulation_tasks, survey_formatted_local, survey_questions, models_to_run, output_files, manifest):
+    if mode == "async":
+        asyncio.run(run_simulation_async(
+            simulation_tasks, survey_formatted_local, survey_questions, models_to_run, output_files, manifest
+        ))
+    elif mode == "sequential":
+        for persona_type, personas, prompt_template in simulation_tasks:
+            run_simulation(
+                persona_type,
+                personas,
+                prompt_template,
+                survey_formatted_local,
+                survey_questions,
+                models_to_run,
+                output_files[persona_type],
+                manifest
+            )
+    elif mode == "batch":
+        if config.SCORING_MODE == "logprobs":
+            print("警告：批处理模式暂不支持 logprobs 评分，将按文本采样运行。")
+        batch_runner.run_batch(
+            simulation_tasks, survey_formatted_local, survey_questions, models_to_run, output_files, manifest
         )
+    elif mode == "queue":
+        run_job_queue(simulation_tasks, survey_formatted_local, survey_questions, models_to_run, output_files, manifest)
     else:
-        print("\n跳过认知人设模拟（数据或模板加载失败）。")
+        print(f"错误：未知的执行模式 '{mode}'，可选值为 'async'、'sequential'、'batch' 或 'queue'。")
+
+
+# --- 修复环节 ---
+async def _repair_round_async(survey_questions, persona_type, prompt_template, descriptions, targets, provider_of):
+    """对一个画像类型的失败单元各发一次只含失败题目的请求，返回 {单元: (失败题目的位置列表, 修复轮次, 答案列表)}"""
+    parser = answer_parser.SurveyParser(survey_questions)
+    limits = _make_limits(_models_by_provider(provider_of))
+    in_flight = limits[0]
+    progress = _progress_bar(total=len(targets), desc=f"修复 {persona_type} 人设")
 
-    print("\n所有模拟任务完成。")
\ No newline at end of file
+    async def repair_unit(key, positions, repair_round):
+        persona_id, _, model_name, sample_index = key
+        # 只把失败的题目放进提示词，题号保持不变，答案按原题号合并
+        plan = survey_planner.SurveyPlan(survey_questions, [[survey_questions[position] for position in positions]])
+        answers = None
+        try:
+            prompt = plan.prompt_builders(prompt_template)[0](descriptions[persona_id])
+            async with in_flight:
+                rows = await _simulate_unit_async(
+                    parser, plan, limits, persona_type, persona_id, [prompt], provider_of[model_name], model_name,
+                    [repair_pass.repair_sample_index(sample_index, repair_round)], phase="repair", repair_round=repair_round,
+                )
+            answers = rows[0][1]
+        except provider_health.ProviderUnavailable:
+            # 供应商不可用：本轮不修复该单元，也不消耗修复轮次
+            return key, None
+        except Exception as e:
+            # 记为本轮仍失败，下一轮（若还有）会再试
+            print(f"修复时发生未知错误 ({persona_type}, {persona_id}, {model_name}): {e}")
+        finally:
+            progress.update(1)
+        return key, (positions, repair_round, answers)
+
+    try:
+        results = await asyncio.gather(*(
+            repair_unit(key, positions, rounds + 1) for key, (positions, rounds) in targets.items()
+        ))
+    finally:
+        progress.close()
+    return {key: repair for key, repair in results if repair is not None}
+
+
+def _models_by_provider(provider_of):
+    models_to_run = {}
+    for model_name, provider in provider_of.items():
+        models_to_run.setdefault(provider, []).append(model_name)
+    return models_to_run
+
+
+def run_repair(simulation_tasks, survey_questions, models_to_run, output_files):
+    """
+    修复环节：找出结果中答案缺失或无效的单元，只把这些题目连同原人设重新提问，
+    有效答案合并回结果CSV的原有行并记入来源文件；每个单元最多修复 REPAIR_MAX_ROUNDS 轮。
+    会改写结果文件，不要与写入同一文件的运行同时进行
+    """
+    config.prepare_runtime()
+    provider_of = {model_name: provider for provider, model_list in models_to_run.items() for model_name in model_list}
+    telemetry.get_collector().start_run()
+    provider_health.get_health().reset()
+    try:
+        for persona_type, personas, prompt_template in simulation_tasks:
+            output_file = output_files[persona_type]
+            provenance = repair_pass.load_provenance(output_file)
+            targets = repair_pass.find_repair_targets(output_file, provider_of, provenance)
+            if not targets:
+                print(f"\n{persona_type} 人设没有需要修复的答案。")
+                continue
+            wanted = {key[0] for key in targets}
+            descriptions = {
+                str(persona['id']): persona['description'] for persona in personas if str(persona['id']) in wanted
+            }
+            unknown = [key for key in targets if key[0] not in descriptions]
+            for key in unknown:
+                del targets[key]
+            num_questions = sum(len(positions) for positions, _ in targets.values())
+            print(f"\n--- 修复 {persona_type} 人设: {len(targets)} 个单元，共 {num_questions} 道题 ---")
+            if unknown:
+                print(f"警告：{len(unknown)} 个单元的人设不在当前数据中，跳过修复。")
+            while targets:
+                repairs = asyncio.run(_repair_round_async(
+                    survey_questions, persona_type, prompt_template, descriptions, targets, provider_of
+                ))
+                if not repairs:
+                    print(f"警告：{len(targets)} 个单元因供应商不可用未能修复，稍后重新运行 repair 即可。")
+                    break
+                fixed, still_failed = repair_pass.merge_repairs(output_file, survey_questions, repairs, provenance)
+                print(f"修复 {fixed} 道题，仍失败 {still_failed} 道；来源记录在 {repair_pass.provenance_path(output_file)}")
+                targets = {
+                    key: target for key, target in repair_pass.find_repair_targets(output_file, provider_of, provenance).items()
+                    if key[0] in descriptions
+                }
+            repair_pass.rebuild_parquet(persona_type, output_file, survey_questions)
+        answer_aggregator.rebuild_from_results(survey_questions, list(output_files.values()))
+    finally:
+        _print_health_report()
+        llm_interface.close_clients()
+        if llm_interface.get_token_usage():
+            print("Token 用量:")
+            llm_interface.print_token_usage()
+        telemetry.get_collector().finish_run()
+
+
+# --- 命令行 ---
+PERSONA_TYPE_LABELS = {"general": "通用", "silicon": "硅基", "cognitive": "认知"}
+EXECUTION_MODES = ("async", "sequential", "batch", "queue")
+
+
+def _silicon_personas():
+    """SILICON_SAMPLE_SIZE 非0时分层抽样硅基人设，否则逐块读取全部行"""
+    if config.SILICON_SAMPLE_SIZE <= 0:
+        return persona_loader.iter_silicon_personas()
+    print(f"按 {', '.join(config.SILICON_SAMPLE_STRATA)} 分层抽取 {config.SILICON_SAMPLE_SIZE} 个硅基人设...")
+    try:
+        return persona_loader.sample_silicon_personas(
+            sample_size=config.SILICON_SAMPLE_SIZE, strata=config.SILICON_SAMPLE_STRATA, seed=config.SILICON_SAMPLE_SEED
+        )
+    except FileNotFoundError:
+        print(f"错误: 硅基人设CSV文件未找到: {config.DATA_FILES['cgss']}")
+    except Exception as e:
+        print(f"分层抽样硅基人设时发生错误: {e}")
+    return []
+
+
+def load_simulation_tasks(persona_types=None):
+    """
+    加载问卷、提示词模板和人设，返回 (问卷, 格式化后的问卷, simulation_tasks)；问卷无法加载时返回None。
+    persona_types 为None时加载全部画像类型
+    """
+    print("开始加载数据和配置...")
+    survey = persona_loader.load_survey()
+    if not survey:
+        print("错误：无法加载问卷。")
+        return None
+    survey_formatted = persona_loader.format_survey_questions(survey)
+
+    # 画像数据按需惰性读取，第一批请求无需等待全部人设加载完毕
+    loaders = {
+        "general": persona_loader.iter_general_personas,
+        "silicon": _silicon_personas,
+        "cognitive": persona_loader.iter_cognitive_personas,
+    }
+    simulation_tasks = []
+    for p_type in persona_types or loaders:
+        template = persona_loader.load_prompt_template(p_type)
+        if not template:
+            print(f"警告：无法加载 {p_type} 的提示词模板，将跳过此类型模拟。")
+        has_personas, personas = persona_loader.peek_personas(loaders[p_type]())
+        if template and has_personas:
+            simulation_tasks.append((p_type, personas, template))
+        else:
+            print(f"\n跳过{PERSONA_TYPE_LABELS[p_type]}人设模拟（数据或模板加载失败）。")
+    print("数据和配置加载完毕。")
+    return survey, survey_formatted, simulation_tasks
+
+
+def plan_run(simulation_tasks, survey_formatted_local, survey_questions, models_to_run):
+    """
+    不发任何请求，按当前配置和运行清单估算每个 (画像类型, 模型) 的待运行样本数、请求数、token 数和费用。
+    提示词token为每个人设实际渲染后的估算值，回复token按题目类型估算
+    """
+    completed = run_manifest.load_completed(config.RUN_MANIFEST_FILE) if config.RESUME_RUNS else set()
+    total_cost = 0.0
+    for persona_type, personas, prompt_template in simulation_tasks:
+        plan = survey_planner.plan_survey(survey_questions, prompt_template, models_to_run, survey_formatted_local)
+        prompt_builders = plan.prompt_builders(prompt_template)
+        answer_tokens = [sum(survey_planner.question_answer_tokens(q) for q in chunk) for chunk in plan.chunks]
+        totals = {
+            model_name: {"units": 0, "pending": 0, "requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+            for model_list in models_to_run.values() for model_name in model_list
+        }
+        num_personas = 0
+        for persona in personas:
+            num_personas += 1
+            prompt_tokens = [
+                rate_limiter.estimate_tokens(build(persona['description'])) for build in prompt_builders
+            ]
+            for model_name, total in totals.items():
+                num_samples = _samples_per_unit(model_name)
+                pending = [
+                    index for index in range(num_samples)
+                    if run_manifest.unit_key(persona['id'], persona_type, model_name, index) not in completed
+                ]
+                total["units"] += num_samples
+                total["pending"] += len(pending)
+                if not pending:
+                    continue
+                # 单次请求的样本数有上限 MAX_CHOICES_PER_REQUEST，超过时拆成多次请求
+                per_request = max(config.MAX_CHOICES_PER_REQUEST, 1)
+                requests = sum(math.ceil(len(group) / per_request) for group in _request_groups(model_name, pending))
+                total["requests"] += requests * plan.num_chunks
+                total["prompt_tokens"] += requests * sum(prompt_tokens)
+                total["completion_tokens"] += len(pending) * sum(answer_tokens)
+
+        print(f"\n{PERSONA_TYPE_LABELS.get(persona_type, persona_type)}人设 ({persona_type}): {num_personas} 个人设；{survey_planner.describe_plan(plan)}")
+        for model_name, total in totals.items():
+            cost = telemetry.estimate_cost(model_name, total["prompt_tokens"], 0, total["completion_tokens"])
+            total_cost += cost or 0
+            print(
+                f"  {model_name}: 样本 {total['units']}，待运行 {total['pending']}，请求 {total['requests']}，"
+                f"提示词约 {total['prompt_tokens']} token，回复约 {total['completion_tokens']} token，"
+                f"费用{'约 $%.2f' % cost if cost is not None else '未知（价格表中没有该模型）'}"
+            )
+    print(f"\n预计总费用约 ${total_cost:.2f}（未计入提示词缓存折扣和重试）")
+
+
+def inspect_run(output_files):
+    """只读地汇总当前输出目录中的运行进度：运行清单、结果文件、答案分布汇总、任务队列和回复缓存"""
+    completed = run_manifest.load_completed(config.RUN_MANIFEST_FILE)
+    print(f"运行清单 {config.RUN_MANIFEST_FILE}: 已完成 {len(completed)} 个样本")
+    by_unit = {}
+    for _, persona_type, model_name, _ in completed:
+        by_unit[(persona_type, model_name)] = by_unit.get((persona_type, model_name), 0) + 1
+    for (persona_type, model_name), count in sorted(by_unit.items()):
+        print(f"  {persona_type} / {model_name}: {count}")
+
+    for persona_type, output_file in output_files.items():
+        if os.path.exists(output_file):
+            with open(output_file, 'r', encoding='utf-8') as f:
+                rows = max(sum(1 for _ in f) - 1, 0)
+            print(f"结果文件 {output_file}: {rows} 行")
+
+    summary = answer_aggregator.load_summary()
+    if summary is not None:
+        print(f"答案分布汇总 {config.AGGREGATE_SUMMARY_FILE}（更新于 {summary['updated_at']}）:")
+        for line in answer_aggregator.summary_lines(summary["persona_types"]):
+            print(line)
+
+    if os.path.exists(config.JOB_QUEUE_PATH):
+        queue = job_queue.JobQueue(config.JOB_QUEUE_PATH)
+        try:
+            print(f"任务队列 {config.JOB_QUEUE_PATH}: {queue.describe()}")
+        finally:
+            queue.close()
+
+    if os.path.exists(config.RESPONSE_CACHE_PATH):
+        cache = response_cache.ResponseCache(config.RESPONSE_CACHE_PATH, mode="replay")
+        try:
+            print(f"回复缓存 {config.RESPONSE_CACHE_PATH}: {cache.size()} 条")
+        finally:
+            cache.close()
+
+
+def _csv_list(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def _persona_types_arg(value):
+    persona_types = _csv_list(value)
+    unknown = [p_type for p_type in persona_types if p_type not in PERSONA_TYPE_LABELS]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"未知的画像类型 {unknown}，可选值为 {list(PERSONA_TYPE_LABELS)}")
+    return persona_types
+
+
+def _models_arg(value):
+    """"openai:gpt-4o,openai:gpt-3.5-turbo" -> {"openai": ["gpt-4o", "gpt-3.5-turbo"]}"""
+    models_to_run = {}
+    for item in _csv_list(value):
+        provider, sep, model_name = item.partition(":")
+        if not sep or not provider or not model_name:
+            raise argparse.ArgumentTypeError(f"模型应写成 供应商:模型名，例如 openai:gpt-4o，而不是 '{item}'")
+        models_to_run.setdefault(provider, []).append(model_name)
+    return models_to_run
+
+
+def build_arg_parser():
+    arg_parser = argparse.ArgumentParser(description="让大语言模型以不同人设回答问卷。不带子命令时等同于 run。")
+    subcommands = arg_parser.add_subparsers(dest="command", metavar="命令")
+    run_parsers = {
+        "run": subcommands.add_parser("run", help="运行模拟（默认按 RESUME_RUNS 续跑）"),
+        "resume": subcommands.add_parser("resume", help="从运行清单或任务队列续跑上一次运行"),
+        "plan": subcommands.add_parser("plan", help="不发请求，估算待运行的样本数、请求数、token 和费用"),
+    }
+    for name, sub in run_parsers.items():
+        if name != "plan":
+            sub.add_argument("--mode", choices=EXECUTION_MODES, help="执行模式，覆盖 EXECUTION_MODE")
+        sub.add_argument("--types", type=_persona_types_arg, help="只运行这些画像类型，逗号分隔，例如 general,silicon")
+        sub.add_argument("--models", type=_models_arg, help="覆盖 MODELS_TO_RUN，例如 openai:gpt-4o,openai:gpt-3.5-turbo")
+        sub.add_argument("--samples", type=int, help="每个 (人设, 模型) 的样本数，覆盖 SAMPLES_PER_UNIT")
+        sub.add_argument("--silicon-sample", type=int, help="分层抽取的硅基人设数，覆盖 SILICON_SAMPLE_SIZE（0 为全部）")
+    run_parsers["run"].add_argument("--fresh", action="store_true", help="清空旧结果重新开始")
+    repair_parser = subcommands.add_parser("repair", help="只针对缺失或无效的答案重新提问，并合并回已有结果")
+    repair_parser.add_argument("--types", type=_persona_types_arg, help="只修复这些画像类型，逗号分隔")
+    repair_parser.add_argument("--models", type=_models_arg, help="只修复这些模型的结果，格式同 run --models")
+    subcommands.add_parser("inspect", help="查看当前输出目录中的运行进度")
+    subcommands.add_parser("worker", help="以 worker 身份从任务队列领取并运行任务")
+    return arg_parser
+
+
+def resolve_settings(args):
+    """把命令行参数并入配置，返回只读快照"""
+    overrides = {}
+    if getattr(args, "mode", None):
+        overrides["EXECUTION_MODE"] = args.mode
+    if getattr(args, "models", None):
+        overrides["MODELS_TO_RUN"] = args.models
+    if getattr(args, "samples", None) is not None:
+        overrides["SAMPLES_PER_UNIT"] = args.samples
+    if getattr(args, "silicon_sample", None) is not None:
+        overrides["SILICON_SAMPLE_SIZE"] = args.silicon_sample
+    if args.command == "resume":
+        overrides["RESUME_RUNS"] = True
+    elif getattr(args, "fresh", False):
+        overrides["RESUME_RUNS"] = False
+    return config.resolve(**overrides)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = build_arg_parser().parse_args(argv or ["run"])
+    settings = resolve_settings(args)
+    config.apply(settings)
+
+    if args.command == "inspect":
+        inspect_run(settings.OUTPUT_FILES)
+        return 0
+    if args.command == "worker" or (
+        args.command == "run" and settings.EXECUTION_MODE == "queue" and settings.JOB_QUEUE_ROLE == "worker"
+    ):
+        # 问卷、模板和人设都从任务队列读取
+        print(f"以 worker 身份运行，从任务队列 {settings.JOB_QUEUE_PATH} 领取任务...")
+        run_queue_worker()
+        return 0
+    if args.command == "resume":
+        checkpoint = settings.JOB_QUEUE_PATH if settings.EXECUTION_MODE == "queue" else settings.RUN_MANIFEST_FILE
+        if not os.path.exists(checkpoint):
+            print(f"错误：没有找到可续跑的运行（{checkpoint} 不存在），请使用 run 开始新的运行。")
+            return 1
+
+    loaded = load_simulation_tasks(args.types)
+    if loaded is None:
+        return 1
+    survey, survey_formatted, simulation_tasks = loaded
+    if not simulation_tasks:
+        print("没有可运行的画像类型。")
+        return 1
+    if args.command == "plan":
+        plan_run(simulation_tasks, survey_formatted, survey, settings.MODELS_TO_RUN)
+        return 0
+    if args.command == "repair":
+        run_repair(simulation_tasks, survey, settings.MODELS_TO_RUN, settings.OUTPUT_FILES)
+        return 0
+
+    run_all_simulations(
+        simulation_tasks,
+        survey_formatted,
+        survey,
+        settings.MODELS_TO_RUN,
+        settings.OUTPUT_FILES
+    )
+    if settings.REPAIR_AFTER_RUN:
+        # 人设可能是一次性的生成器，修复前重新加载
+        loaded = load_simulation_tasks(args.types)
+        if loaded is not None:
+            run_repair(loaded[2], survey, settings.MODELS_TO_RUN, settings.OUTPUT_FILES)
+    print("\n所有模拟任务完成。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
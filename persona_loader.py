@@ -1,8 +1,15 @@
 # persona_loader.py
+import itertools
 import json
-import pandas as pd
-import random
+import math
+import re
 import config
+# numpy/pandas 导入约需0.5秒，只有生成硅基和通用人设时用到，因此在各函数内按需导入
+
+# 提示词模板中带编号的二级标题，例如 "## **2. 第一人称简单描述**"
+_NUMBERED_SECTION = re.compile(r"^(?=## \*\*\d+\.)", re.MULTILINE)
+# 选项开头的编号，例如 "1. 非常同意"、"A、同意"、"(3) 不同意"
+_OPTION_LABEL = re.compile(r"^\s*[\(（\[【]?\s*([0-9A-Za-z]+)\s*[\)）\]】.．、:：]")
 
 def format_survey_questions(survey_data):
     """将问卷数据格式化为字符串，用于插入提示词"""
@@ -12,28 +19,233 @@ def format_survey_questions(survey_data):
         formatted.append(f"{q['id']}. {q['text']}\n   {options_str}")
     return "\n\n".join(formatted)
 
-def load_general_personas(file_path=config.DATA_FILES["personachat"], num_sentences=config.NUM_PERSONACHAT_SENTENCES):
-    """加载通用人设描述"""
-    personas = []
+def option_label(option):
+    """选项开头的编号（如 "1"、"A"），没有编号时返回None"""
+    match = _OPTION_LABEL.match(option)
+    return match.group(1).upper() if match else None
+
+def option_codes(question):
+    """
+    返回 {选项标识: 选项序号(从1开始)}。
+    选项标识包括选项的编号（选项开头的 "1"、"A" 等，没有编号时为序号）、完整的选项文本和去掉编号后的选项文本；
+    编号优先登记，因此编号总能映射回它所属的选项，与 answer_parser.canonical_labels 一致。
+    """
+    options = question.get('options', [])
+    codes = {}
+    for index, option in enumerate(options, start=1):
+        label = option_label(option)
+        codes.setdefault(label if label is not None else str(index), index)
+    for index, option in enumerate(options, start=1):
+        codes.setdefault(option.strip(), index)
+        match = _OPTION_LABEL.match(option)
+        if match:
+            codes.setdefault(option[match.end():].strip(), index)
+    return codes
+
+def split_persona_section(prompt_template):
+    """
+    将模板拆分为 (画像之前的部分, 画像段落, 画像之后的部分)。
+    画像段落是包含 {persona_description} 的带编号章节；找不到时返回None。
+    """
+    sections = _NUMBERED_SECTION.split(prompt_template)
+    for index, section in enumerate(sections):
+        if "{persona_description}" in section:
+            return "".join(sections[:index]), section, "".join(sections[index + 1:])
+    return None
+
+
+def make_prompt_builder(prompt_template, survey_formatted_local, layout=None):
+    """
+    返回一个函数 build(persona_description) -> 完整提示词。
+    layout="original" 保持模板原有顺序；
+    layout="prefix_cache" 将画像段落移到末尾，使指令和问卷成为所有画像共享的、逐字节相同的前缀，
+    便于供应商侧的提示词前缀缓存命中。
+    """
+    layout = layout or config.PROMPT_LAYOUT
+    if layout == "prefix_cache":
+        parts = split_persona_section(prompt_template)
+        if parts is None:
+            print("警告：提示词模板中找不到包含 {persona_description} 的编号章节，使用原始布局。")
+        else:
+            before, persona_section, after = parts
+            # 前缀只需渲染一次
+            prefix = (before + after.rstrip("\n") + "\n\n").format(survey_questions_formatted=survey_formatted_local)
+            return lambda persona_description: prefix + persona_section.format(
+                persona_description=persona_description,
+                survey_questions_formatted=survey_formatted_local
+            )
+    elif layout != "original":
+        print(f"警告：未知的提示词布局 '{layout}'，使用原始布局。")
+    return lambda persona_description: prompt_template.format(
+        persona_description=persona_description,
+        survey_questions_formatted=survey_formatted_local
+    )
+
+
+_FEISTEL_ROUNDS = 4
+_INT64_MAX = (1 << 63) - 1
+
+
+def _parse_shard(shard):
+    """"k/n" 或 (k, n) -> (k, n)"""
+    if isinstance(shard, str):
+        index, _, count = shard.partition("/")
+        shard = (int(index), int(count or 1))
+    index, count = shard
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"无效的分片 {index}/{count}，应满足 0 <= k < n")
+    return index, count
+
+
+def _mix64(values):
+    """splitmix64 的混合函数，逐元素打散 uint64 数组（按位溢出即取模 2^64）"""
+    import numpy as np
+    with np.errstate(over="ignore"):
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return values ^ (values >> np.uint64(31))
+
+
+def _permute_indices(indices, domain, seed):
+    """
+    以 seed 为密钥的 Feistel 置换，把人设序号一一映射到 [0, domain) 内的组合序号。
+    置换在 2^(2h) >= domain 的空间上进行，落在 domain 之外的结果继续置换直到回到 domain 内（cycle walking），
+    因此不同的序号必然得到不同的组合，无需记录已见组合
+    """
+    import numpy as np
+    half_bits = max(((domain - 1).bit_length() + 1) // 2, 1)
+    shift = np.uint64(half_bits)
+    mask = np.uint64((1 << half_bits) - 1)
+    keys = np.random.SeedSequence(seed).generate_state(_FEISTEL_ROUNDS, dtype=np.uint64)
+    values = np.asarray(indices, dtype=np.uint64)
+    pending = np.arange(len(values))
+    while len(pending):
+        left, right = values[pending] >> shift, values[pending] & mask
+        for key in keys:
+            left, right = right, left ^ (_mix64(right ^ key) & mask)
+        permuted = (left << shift) | right
+        values[pending] = permuted
+        pending = pending[permuted >= np.uint64(domain)]
+    return values.astype(np.int64)
+
+
+def _unrank_compositions(ranks, num_snippets, num_sentences):
+    """组合序号 -> 每行 num_sentences 个互不相同的句子序号（组合数系统，逐列向量化）"""
+    import numpy as np
+    rows = np.empty((len(ranks), num_sentences), dtype=np.int64)
+    remaining = ranks.copy()
+    for column, size in enumerate(range(num_sentences, 0, -1)):
+        # comb(c, size) 随 c 单调不减；超过 int64 的部分不会被选中，截断即可
+        table = np.full(num_snippets, _INT64_MAX, dtype=np.int64)
+        for c in range(num_snippets):
+            value = math.comb(c, size)
+            if value >= _INT64_MAX:
+                break
+            table[c] = value
+        chosen = np.searchsorted(table, remaining, side="right") - 1
+        rows[:, column] = chosen
+        remaining -= table[chosen]
+    return rows
+
+
+def _composition_groups(num_snippets, num_sentences):
+    """
+    把句子库均分成尽量少的组，使各组内组合数之和不超过 int64，返回各组的句子数。
+    组合总数本身不超过 int64 时只有一组，即整个句子库
+    """
+    for count in itertools.count(1):
+        small, extra = divmod(num_snippets, count)
+        total = extra * math.comb(small + 1, num_sentences) + (count - extra) * math.comb(small, num_sentences)
+        if total <= _INT64_MAX:
+            return [small + 1] * extra + [small] * (count - extra)
+
+
+def general_composition_count(num_snippets, num_sentences):
+    """general_compositions 能给出的不重复组合数"""
+    return sum(math.comb(size, num_sentences) for size in _composition_groups(num_snippets, num_sentences))
+
+
+def general_compositions(indices, num_snippets, num_sentences, seed):
+    """
+    第 i 个通用人设的句子组合只由 (seed, i) 决定，与人设总数、分片和分块方式无关，且不同的人设组合必然不同。
+    组合总数不超过 int64 时按置换后的组合序号在整个句子库中取组合；
+    否则先按种子打乱句子库并均分成若干组，组合序号依次编号各组内的组合，每个人设的句子来自同一组
+    """
+    import numpy as np
+    indices = np.asarray(indices, dtype=np.int64)
+    sizes = _composition_groups(num_snippets, num_sentences)
+    domains = [math.comb(size, num_sentences) for size in sizes]
+    ranks = _permute_indices(indices, sum(domains), seed)
+    if len(sizes) == 1:
+        rows = _unrank_compositions(ranks, num_snippets, num_sentences)
+    else:
+        offsets = np.cumsum([0] + domains, dtype=np.int64)
+        starts = np.cumsum([0] + sizes[:-1], dtype=np.int64)
+        groups = np.searchsorted(offsets, ranks, side="right") - 1
+        group_sizes = np.asarray(sizes, dtype=np.int64)[groups]
+        rows = np.empty((len(indices), num_sentences), dtype=np.int64)
+        for size in set(sizes): # 各组只有两种大小
+            selected = group_sizes == size
+            inner = ranks[selected] - offsets[groups[selected]]
+            rows[selected] = _unrank_compositions(inner, size, num_sentences) + starts[groups[selected], None]
+        # 组是打乱后句子库中的连续区间，分组与人设序号无关
+        shuffled = _permute_indices(np.arange(num_snippets), num_snippets, [seed, 1])
+        rows = shuffled[rows]
+    # 组合数系统给出的句子按序号降序，按 (seed, i, 位置) 的哈希打乱组内顺序
+    positions = indices[:, None] * num_sentences + np.arange(num_sentences)
+    order = np.argsort(_mix64(positions.astype(np.uint64) ^ np.uint64(seed & 0xFFFFFFFFFFFFFFFF)), axis=1)
+    return np.take_along_axis(rows, order, axis=1)
+
+
+def iter_general_composition_blocks(num_snippets, num_sentences, num_personas, seed, shard=(0, 1), block_size=None):
+    """
+    按块生成某个分片的通用人设组合，逐块返回 (人设序号数组, 组合数组)。
+    分片 (k, n) 只计算序号 i % n == k 的人设；每块最多 block_size 个，计算量与请求的人设数成正比
+    """
+    import numpy as np
+    block_size = block_size or config.GENERAL_PERSONA_BLOCK_SIZE
+    shard_index, num_shards = shard
+    available = general_composition_count(num_snippets, num_sentences)
+    if num_personas > available:
+        print(f"警告：句子库只有 {available} 种不同的组合，少于所需的 {num_personas} 个通用人设。")
+        num_personas = available
+    indices = range(shard_index, num_personas, num_shards)
+    for start in range(0, len(indices), block_size):
+        block = np.arange(indices[start], min(indices[-1] + 1, indices[start] + block_size * num_shards), num_shards)
+        yield block, general_compositions(block, num_snippets, num_sentences, seed)
+
+
+def iter_general_personas(file_path=None, num_sentences=None, num_personas=None, seed=None, shard=None):
+    """
+    逐个生成通用人设：按种子从句子库中抽取 num_sentences 句组合成描述，组合不重复，id 为 gen_<序号>。
+    shard="k/n" 时只生成序号 i % n == k 的人设；每个人设的组合只由种子和序号决定，
+    因此 n 个 worker 各自生成的分片恰好拼成完整序列
+    """
+    import numpy as np
+    file_path = file_path or config.DATA_FILES["personachat"]
+    num_sentences = config.NUM_PERSONACHAT_SENTENCES if num_sentences is None else num_sentences
+    num_personas = config.NUM_GENERAL_PERSONAS if num_personas is None else num_personas
+    seed = config.GENERAL_PERSONA_SEED if seed is None else seed
+    shard_index, num_shards = _parse_shard(config.GENERAL_PERSONA_SHARD if shard is None else shard)
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
             snippets = json.load(f)
         if not snippets:
-            return personas # 返回空列表如果文件为空
-
-        # 假设我们需要生成N个通用人设
-        # 这里只是一个简单示例，实际可能需要更复杂的生成逻辑确保多样性
-        num_personas_to_generate = 10 # 示例：生成10个通用人设
-        for i in range(num_personas_to_generate):
-            if len(snippets) >= num_sentences:
-                 sampled_snippets = random.sample(snippets, num_sentences)
-                 description = " ".join(sampled_snippets)
-                 personas.append({"id": f"gen_{i+1}", "description": description})
-            else:
-                 print(f"警告：可用描述句数量 ({len(snippets)}) 少于所需的 ({num_sentences})。")
-                 description = " ".join(random.sample(snippets, len(snippets))) # 使用所有可用的
-                 personas.append({"id": f"gen_{i+1}", "description": description})
+            return # 文件为空时不生成任何人设
+        if len(snippets) < num_sentences:
+            print(f"警告：可用描述句数量 ({len(snippets)}) 少于所需的 ({num_sentences})。")
+            num_sentences = len(snippets) # 使用所有可用的
 
+        pool = np.array(snippets, dtype=object)
+        blocks = iter_general_composition_blocks(
+            len(snippets), num_sentences, num_personas, seed, (shard_index, num_shards)
+        )
+        for block, rows in blocks:
+            description = pool[rows[:, 0]]
+            for column in rows[:, 1:].T:
+                description = description + " " + pool[column]
+            for index, text in zip(block.tolist(), description.tolist()):
+                yield {"id": f"gen_{index + 1}", "description": text}
 
     except FileNotFoundError:
         print(f"错误: 通用人设文件未找到: {file_path}")
@@ -41,62 +253,247 @@ def load_general_personas(file_path=config.DATA_FILES["personachat"], num_senten
         print(f"错误: 解析通用人设JSON文件失败: {file_path}")
     except Exception as e:
         print(f"加载通用人设时发生错误: {e}")
-    return personas
 
 
-def load_silicon_personas(file_path=config.DATA_FILES["cgss"]):
-    """加载硅基人设（基于人口统计数据）"""
-    personas = []
+def load_general_personas(file_path=None, num_sentences=None, num_personas=None, seed=None, shard=None):
+    """加载通用人设描述"""
+    return list(iter_general_personas(file_path, num_sentences, num_personas, seed, shard))
+
+
+def _silicon_columns(file_path, phrases, strata=()):
+    """读取CSV表头，返回实际存在的描述列、是否有id列"""
+    import pandas as pd
+    header = pd.read_csv(file_path, nrows=0).columns
+    phrase_columns = [column for column, _, _ in phrases if column in header]
+    missing_strata = [column for column in strata if column not in header]
+    if missing_strata:
+        raise ValueError(f"分层列不存在于CSV中: {missing_strata}")
+    return phrase_columns, "id" in header
+
+
+def _render_column(values, template, default):
+    """按类别渲染一列短语：每个类别只格式化一次，再按类别编码取值，而不是每行格式化一次"""
+    import numpy as np
+    values = values.astype("category")
+    rendered = np.array([template.format(v) for v in values.cat.categories] + [template.format(default)], dtype=object)
+    codes = values.cat.codes.to_numpy()
+    # 缺失值的编码为 -1，正好取到末尾的默认短语
+    return rendered[codes]
+
+
+def build_silicon_descriptions(chunk, phrases=None):
+    """将一批人口统计数据按列向量化拼接为第一人称描述，返回 DataFrame[id, description]"""
+    import numpy as np
+    import pandas as pd
+    phrases = phrases or config.SILICON_PHRASES
+    description = np.full(len(chunk), "", dtype=object)
+    for column, template, default in phrases:
+        if column in chunk.columns:
+            description = description + _render_column(chunk[column], template, default)
+        else:
+            description = description + template.format(default)
+
+    fallback_ids = "sil_" + (chunk.index.to_series() + 1).astype(str)
+    if "id" in chunk.columns:
+        ids = chunk["id"].astype("string").fillna(fallback_ids)
+    else:
+        ids = fallback_ids
+    return pd.DataFrame({"id": ids.astype(str).to_numpy(), "description": description}, index=chunk.index)
+
+
+def _persona_records(frame):
+    """DataFrame[id, description] -> [{"id", "description"}, ...]，比 to_dict("records") 快"""
+    return [{"id": persona_id, "description": description}
+            for persona_id, description in zip(frame["id"].tolist(), frame["description"].tolist())]
+
+
+def iter_silicon_chunks(file_path=None, chunksize=None, phrases=None, extra_columns=()):
+    """分块读取人口统计CSV，描述列均按类别类型读取以节省内存"""
+    import pandas as pd
+    file_path = file_path or config.DATA_FILES["cgss"]
+    chunksize = chunksize or config.SILICON_CHUNK_SIZE
+    phrases = phrases or config.SILICON_PHRASES
+    phrase_columns, has_id = _silicon_columns(file_path, phrases, extra_columns)
+    usecols = list(dict.fromkeys(phrase_columns + list(extra_columns) + (["id"] if has_id else [])))
+    dtypes = {column: "category" for column in usecols if column != "id"}
+    if has_id:
+        dtypes["id"] = "string"
+    return pd.read_csv(file_path, usecols=usecols, dtype=dtypes, chunksize=chunksize)
+
+
+def _strata_keys(chunk, strata):
+    """分层列转为字符串（缺失值单独成层），便于跨块分组"""
+    return chunk[list(strata)].astype("string").fillna("<NA>")
+
+
+def _stratified_positions(file_path, strata, sample_size, chunksize, seed):
+    """第一遍扫描只读取分层列统计各层人数，按比例分配样本并随机抽取层内序号"""
+    import numpy as np
+    import pandas as pd
+    counts = None
+    for chunk in pd.read_csv(file_path, usecols=list(strata), dtype="category", chunksize=chunksize):
+        chunk_counts = _strata_keys(chunk, strata).value_counts()
+        counts = chunk_counts if counts is None else counts.add(chunk_counts, fill_value=0)
+    if counts is None or counts.sum() == 0:
+        return {}
+    counts = counts.astype(int)
+    total = int(counts.sum())
+    sample_size = min(sample_size, total)
+    # 最大余数法分配各层样本量，保证总数恰好为 sample_size
+    quotas = counts * sample_size / total
+    allocation = np.floor(quotas).astype(int)
+    remainder = sample_size - int(allocation.sum())
+    if remainder > 0:
+        allocation[(quotas - allocation).sort_values(ascending=False).index[:remainder]] += 1
+
+    rng = np.random.default_rng(seed)
+    return {
+        stratum: np.sort(rng.choice(int(counts[stratum]), size=int(n), replace=False))
+        for stratum, n in allocation.items() if n > 0
+    }
+
+
+def sample_silicon_personas(file_path=None, sample_size=1000, strata=("gender", "residence_type"),
+                            seed=None, chunksize=None, phrases=None):
+    """
+    按 strata 列分层、按比例抽样硅基人设。
+    两遍分块扫描：第一遍统计各层人数，第二遍只保留被抽中的行，内存占用与样本量成正比。
+    """
+    import numpy as np
+    import pandas as pd
+    file_path = file_path or config.DATA_FILES["cgss"]
+    chunksize = chunksize or config.SILICON_CHUNK_SIZE
+    strata = tuple(strata)
+    positions = _stratified_positions(file_path, strata, sample_size, chunksize, seed)
+    seen = {} # 各层在之前的块中已出现的行数
+    sampled = []
+    for chunk in iter_silicon_chunks(file_path, chunksize, phrases, extra_columns=strata):
+        mask = np.zeros(len(chunk), dtype=bool)
+        for stratum, row_positions in _strata_keys(chunk, strata).groupby(list(strata)).indices.items():
+            stratum = stratum if isinstance(stratum, tuple) else (stratum,)
+            offset = seen.get(stratum, 0)
+            seen[stratum] = offset + len(row_positions)
+            chosen = positions.get(stratum)
+            if chosen is not None:
+                mask[row_positions] = np.isin(np.arange(offset, offset + len(row_positions)), chosen)
+        if mask.any():
+            sampled.append(build_silicon_descriptions(chunk[mask], phrases))
+    if not sampled:
+        return []
+    return _persona_records(pd.concat(sampled))
+
+
+def iter_silicon_personas(file_path=None, chunksize=None, phrases=None):
+    """逐个生成硅基人设，一次只在内存中保留一个数据块"""
+    file_path = file_path or config.DATA_FILES["cgss"]
     try:
-        df = pd.read_csv(file_path)
-        for index, row in df.iterrows():
-            # 将每一行数据格式化为第一人称描述
-            # 你需要根据你的CSV文件的实际列名来调整这里的字段
-            desc = (
-                f"我今年{row.get('age', '未知年龄')}岁，性别{row.get('gender', '未知性别')}。"
-                f"我的最高学历是{row.get('education', '未知学历')}。"
-                f"我目前的职业是{row.get('occupation', '未知职业')}，"
-                f"个人年收入大致在{row.get('income_level', '未知收入')}范围。"
-                f"我住在{row.get('residence_type', '未知地区')}。"
-                # 可以根据需要添加更多CGSS变量
-            )
-            personas.append({"id": row.get('id', f"sil_{index+1}"), "description": desc})
+        for chunk in iter_silicon_chunks(file_path, chunksize, phrases):
+            yield from _persona_records(build_silicon_descriptions(chunk, phrases))
     except FileNotFoundError:
         print(f"错误: 硅基人设CSV文件未找到: {file_path}")
     except Exception as e:
         print(f"加载硅基人设时发生错误: {e}")
-    return personas
 
 
-def load_cognitive_personas(file_path=config.DATA_FILES["cognitive"]):
-    """加载认知人设（详细画像）"""
-    personas = []
+def load_silicon_personas(file_path=None, chunksize=None, phrases=None):
+    """加载硅基人设（基于人口统计数据），分块读取并按列向量化生成描述"""
+    return list(iter_silicon_personas(file_path, chunksize, phrases))
+
+
+_JSON_SEPARATORS = " \t\r\n,"
+
+
+def iter_json_records(file_path, chunk_size=1 << 16):
+    """
+    逐条解析JSON数组（[{...}, {...}]）或JSONL文件中的记录，不把整个文件读入内存。
+    解析失败说明记录跨越了缓冲区边界，此时继续读入更多内容后重试。
+    """
+    decoder = json.JSONDecoder()
+    with open(file_path, 'r', encoding='utf-8') as f:
+        buffer = f.read(chunk_size).lstrip("\ufeff")
+        pos = len(buffer) - len(buffer.lstrip())
+        if buffer[pos:pos + 1] == "[":
+            pos += 1
+        eof = not buffer
+        while True:
+            while pos < len(buffer) and buffer[pos] in _JSON_SEPARATORS:
+                pos += 1
+            if pos >= len(buffer):
+                if eof:
+                    return
+                buffer, pos = f.read(chunk_size), 0
+                eof = not buffer
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # 读入量随缓冲区增长，保证超大记录的重试总开销是线性的
+                more = f.read(max(chunk_size, len(buffer) - pos))
+                eof = not more
+                buffer, pos = buffer[pos:] + more, 0
+                continue
+            yield record
+            pos = end
+            if pos > chunk_size:
+                buffer, pos = buffer[pos:], 0
+
+
+def _cognitive_description(profile):
+    # 将JSON对象格式化为更详细的第一人称描述
+    demo = profile.get("demographics", {})
+    pers = profile.get("personality", {})
+    vals = profile.get("values", "")
+    mem = profile.get("narrative_memory", "")
+
+    return (
+        f"我今年{demo.get('age', '未知年龄')}岁，性别{demo.get('gender', '未知性别')}，"
+        f"学历是{demo.get('education', '未知学历')}，住在{demo.get('residence_type', '未知地区')}。"
+        f"我的职业是{demo.get('occupation', '未知职业')}，年收入大概是{demo.get('income_level', '未知收入')}。"
+        f"{pers.get('description', '我是一个普通人。')}" # 使用JSON中详细的人格描述
+        f"我认为{vals if vals else '生活是复杂的'}。" # 融入价值观
+        f"{mem if mem else ''}" # 融入背景故事/记忆
+    )
+
+
+def iter_cognitive_personas(file_path=None):
+    """逐条读取认知人设（详细画像），支持JSON数组和JSONL格式"""
+    file_path = file_path or config.DATA_FILES["cognitive"]
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            profiles = json.load(f)
-        for profile in profiles:
-            # 将JSON对象格式化为更详细的第一人称描述
-            demo = profile.get("demographics", {})
-            pers = profile.get("personality", {})
-            vals = profile.get("values", "")
-            mem = profile.get("narrative_memory", "")
-
-            desc = (
-                f"我今年{demo.get('age', '未知年龄')}岁，性别{demo.get('gender', '未知性别')}，"
-                f"学历是{demo.get('education', '未知学历')}，住在{demo.get('residence_type', '未知地区')}。"
-                f"我的职业是{demo.get('occupation', '未知职业')}，年收入大概是{demo.get('income_level', '未知收入')}。"
-                f"{pers.get('description', '我是一个普通人。')}" # 使用JSON中详细的人格描述
-                f"我认为{vals if vals else '生活是复杂的'}。" # 融入价值观
-                f"{mem if mem else ''}" # 融入背景故事/记忆
-            )
-            personas.append({"id": profile.get('id', f"cog_{len(personas)+1}"), "description": desc})
+        for index, profile in enumerate(iter_json_records(file_path)):
+            yield {"id": profile.get('id', f"cog_{index+1}"), "description": _cognitive_description(profile)}
     except FileNotFoundError:
         print(f"错误: 认知人设JSON文件未找到: {file_path}")
     except json.JSONDecodeError:
         print(f"错误: 解析认知人设JSON文件失败: {file_path}")
     except Exception as e:
         print(f"加载认知人设时发生错误: {e}")
-    return personas
+
+
+def load_cognitive_personas(file_path=None):
+    """加载认知人设（详细画像）"""
+    return list(iter_cognitive_personas(file_path))
+
+
+def check_prompt_template(prompt_template):
+    """用空画像和空问卷试渲染模板，返回错误描述；能正常渲染时返回None"""
+    try:
+        prompt_template.format(persona_description="", survey_questions_formatted="")
+    except (KeyError, IndexError, ValueError) as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+def peek_personas(personas):
+    """查看人设序列是否为空而不消耗它，返回 (是否非空, 可继续迭代的序列)"""
+    iterator = iter(personas)
+    first = next(iterator, None)
+    if first is None:
+        return False, iter(())
+    return True, itertools.chain([first], iterator)
 
 def load_prompt_template(persona_type):
     """根据画像类型加载提示词模板"""
@@ -106,16 +503,23 @@ def load_prompt_template(persona_type):
         return None
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read()
+            template = f.read()
     except FileNotFoundError:
         print(f"错误：提示词模板文件未找到: {file_path}")
         return None
     except Exception as e:
         print(f"加载提示词模板时发生错误: {e}")
         return None
+    # 模板只能使用 {persona_description} 和 {survey_questions_formatted}，其余花括号需写成 {{ }}
+    error = check_prompt_template(template)
+    if error:
+        print(f"错误：提示词模板 {file_path} 无法渲染（{error}）。")
+        return None
+    return template
 
-def load_survey(file_path=config.DATA_FILES["survey"]):
+def load_survey(file_path=None):
     """加载问卷题目"""
+    file_path = file_path or config.DATA_FILES["survey"]
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
             survey = json.load(f)
@@ -0,0 +1,150 @@
+# provider_health.py
+import threading
+import time
+import config
+
+CLOSED = "closed" # 正常放行
+OPEN = "open" # 熔断中，直接跳过
+HALF_OPEN = "half_open" # 冷却结束，只放行少量探测请求
+HALF_OPEN_RETRY_AFTER = 1.0 # 半开状态探测名额已满时，建议多久后再试（秒）
+
+
+class ProviderUnavailable(Exception):
+    """
+    供应商熔断或模型无法调用时抛出：调用方应跳过该单元（不写入结果），续跑时再试。
+    retry_after 为熔断器预计可以再试的秒数；模型在本次运行中无法调用时为None
+    """
+
+    def __init__(self, provider, reason, retry_after=None):
+        super().__init__(f"{provider} 暂不可用: {reason}")
+        self.provider = provider
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Breaker:
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0 # 连续失败次数
+        self.opened_at = 0.0
+        self.cooldown = config.CIRCUIT_COOLDOWN
+        self.probes = 0 # 半开状态下在途的探测请求数
+        self.trips = 0
+        self.skipped = 0
+
+
+class ProviderHealth:
+    """
+    按供应商（经 MODEL_ENDPOINTS 路由的模型按 "openai:<模型>"）跟踪调用健康状况的熔断器：
+    连续失败 CIRCUIT_FAILURE_THRESHOLD 次后熔断，冷却期内的调用直接抛出 ProviderUnavailable；
+    冷却结束后放行 CIRCUIT_HALF_OPEN_PROBES 个探测请求，成功则恢复，失败则冷却时间加倍。
+    无法调用的模型（未实现的供应商、未配置 Key）只提示一次，此后直接跳过
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breakers = {}
+        self._unavailable = {} # 模型 -> 跳过次数
+
+    def reset(self):
+        with self._lock:
+            self._breakers = {}
+            self._unavailable = {}
+
+    # --- 无法调用的模型 ---
+    def check_model(self, model_name):
+        """模型此前已判定无法调用时直接抛出 ProviderUnavailable"""
+        if not config.CIRCUIT_BREAKER_ENABLED:
+            return
+        with self._lock:
+            if model_name not in self._unavailable:
+                return
+            self._unavailable[model_name] += 1
+        raise ProviderUnavailable(model_name, "无法调用该模型")
+
+    def mark_unavailable(self, model_name):
+        """resolve_provider 无法解析该模型：记下后抛出 ProviderUnavailable，之后的调用不再重复解析和提示"""
+        if not config.CIRCUIT_BREAKER_ENABLED:
+            return
+        with self._lock:
+            self._unavailable[model_name] = self._unavailable.get(model_name, 0) + 1
+        print(f"模型 {model_name} 无法调用，本次运行中将跳过它的所有单元。")
+        raise ProviderUnavailable(model_name, "无法调用该模型")
+
+    # --- 熔断 ---
+    def before_call(self, provider):
+        """调用前检查：熔断中抛出 ProviderUnavailable；冷却结束后转为半开，只放行有限的探测请求"""
+        if not config.CIRCUIT_BREAKER_ENABLED:
+            return
+        with self._lock:
+            breaker = self._breakers.setdefault(provider, _Breaker())
+            if breaker.state == OPEN and time.monotonic() - breaker.opened_at >= breaker.cooldown:
+                breaker.state = HALF_OPEN
+                breaker.probes = 0
+                print(f"供应商 {provider} 冷却结束，发送探测请求...")
+            if breaker.state == OPEN:
+                breaker.skipped += 1
+                retry_after = breaker.cooldown - (time.monotonic() - breaker.opened_at)
+                raise ProviderUnavailable(provider, f"熔断中（连续失败 {breaker.failures} 次）", retry_after)
+            if breaker.state == HALF_OPEN and breaker.probes >= config.CIRCUIT_HALF_OPEN_PROBES:
+                breaker.skipped += 1
+                raise ProviderUnavailable(provider, "正在等待探测请求的结果", HALF_OPEN_RETRY_AFTER)
+            if breaker.state == HALF_OPEN:
+                breaker.probes += 1
+
+    def record(self, provider, ok):
+        """记录一次逻辑调用（含内部重试和故障转移）的结果；ok 为None表示不计入（只归还半开状态的探测名额）"""
+        if not config.CIRCUIT_BREAKER_ENABLED:
+            return
+        with self._lock:
+            breaker = self._breakers.setdefault(provider, _Breaker())
+            if breaker.state == HALF_OPEN:
+                breaker.probes = max(breaker.probes - 1, 0)
+            if ok is None:
+                return
+            if ok:
+                if breaker.state != CLOSED:
+                    print(f"供应商 {provider} 已恢复。")
+                breaker.state = CLOSED
+                breaker.failures = 0
+                breaker.cooldown = config.CIRCUIT_COOLDOWN
+                return
+            breaker.failures += 1
+            if breaker.state == HALF_OPEN:
+                breaker.cooldown = min(breaker.cooldown * 2, config.CIRCUIT_MAX_COOLDOWN)
+                self._open(provider, breaker)
+            elif breaker.state == CLOSED and breaker.failures >= config.CIRCUIT_FAILURE_THRESHOLD:
+                self._open(provider, breaker)
+
+    def _open(self, provider, breaker):
+        breaker.state = OPEN
+        breaker.opened_at = time.monotonic()
+        breaker.trips += 1
+        print(f"供应商 {provider} 连续失败 {breaker.failures} 次，熔断 {breaker.cooldown:.0f} 秒，期间的单元将跳过。")
+
+    def state(self, provider):
+        with self._lock:
+            breaker = self._breakers.get(provider)
+            return breaker.state if breaker is not None else CLOSED
+
+    # --- 汇总 ---
+    def report_lines(self):
+        """熔断过或跳过过调用的供应商，以及无法调用的模型，各一行"""
+        lines = []
+        with self._lock:
+            for provider, breaker in sorted(self._breakers.items()):
+                if breaker.trips or breaker.skipped:
+                    lines.append(
+                        f"  {provider}: 熔断 {breaker.trips} 次，跳过 {breaker.skipped} 次调用，当前状态 {breaker.state}"
+                    )
+            for model_name, skipped in sorted(self._unavailable.items()):
+                lines.append(f"  {model_name}: 无法调用，跳过 {skipped} 次调用")
+        return lines
+
+
+_health = ProviderHealth()
+
+
+def get_health():
+    """获取进程内共享的供应商健康状态"""
+    return _health
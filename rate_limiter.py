@@ -0,0 +1,163 @@
+# rate_limiter.py
+import asyncio
+import random
+import re
+import threading
+import time
+import config
+
+# 以下响应头由 OpenAI 及多数兼容接口返回
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def estimate_tokens(text):
+    """粗略估算文本的token数：中文约每字1个token，ASCII约每4个字符1个token"""
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ch.isascii())
+    return (len(text) - ascii_chars) + ascii_chars // 4 + 1
+
+
+def parse_duration(value):
+    """解析 '1s'、'6m0s'、'250ms' 或纯数字形式的时长，返回秒数；无法解析时返回None"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(num) * _DURATION_UNITS[unit] for num, unit in parts)
+
+
+def backoff_delay(attempt, retry_after=None):
+    """第 attempt 次重试前的等待秒数：带全抖动的指数退避，服务器给出 retry-after 时优先使用"""
+    if retry_after is not None:
+        return min(retry_after, config.RETRY_MAX_DELAY) + random.uniform(0, config.RETRY_BASE_DELAY)
+    cap = min(config.RETRY_MAX_DELAY, config.RETRY_BASE_DELAY * (2 ** attempt))
+    return random.uniform(0, cap)
+
+
+class RateLimiter:
+    """按每分钟请求数(RPM)和每分钟token数(TPM)限流的令牌桶，线程和协程均可使用"""
+
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.request_level = float(rpm)
+        self.token_level = float(tpm)
+        self.paused_until = 0.0
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        self.request_level = min(self.rpm, self.request_level + elapsed * self.rpm / 60)
+        self.token_level = min(self.tpm, self.token_level + elapsed * self.tpm / 60)
+
+    def _reserve(self, tokens):
+        """预留一次请求的额度，返回需要等待的秒数（允许额度暂时透支，由等待时间偿还）"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            tokens = min(tokens, self.tpm) # 单个超大请求不能永远等不到额度
+            self.request_level -= 1
+            self.token_level -= tokens
+            wait = max(
+                self.paused_until - now,
+                -self.request_level * 60 / self.rpm if self.request_level < 0 else 0,
+                -self.token_level * 60 / self.tpm if self.token_level < 0 else 0,
+            )
+            return max(wait, 0)
+
+    def acquire(self, tokens):
+        """同步等待直到可以发送请求"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens):
+        """异步等待直到可以发送请求"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """用实际消耗的token数修正预留时的估算值"""
+        if actual_tokens is None:
+            return
+        with self._lock:
+            self.token_level += estimated_tokens - actual_tokens
+
+    def pause(self, seconds):
+        """在收到429后暂停整个桶，让同一模型的其他请求一起避让"""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def update_from_headers(self, headers):
+        """根据服务器返回的 x-ratelimit-* 头同步剩余额度和上限"""
+        if not headers:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            limit_requests = _header_number(headers, "x-ratelimit-limit-requests")
+            limit_tokens = _header_number(headers, "x-ratelimit-limit-tokens")
+            if limit_requests:
+                self.rpm = limit_requests
+            if limit_tokens:
+                self.tpm = limit_tokens
+            remaining_requests = _header_number(headers, "x-ratelimit-remaining-requests")
+            remaining_tokens = _header_number(headers, "x-ratelimit-remaining-tokens")
+            # 服务器视角的剩余额度更准确，但只向下修正，避免并发中的旧响应把额度调高
+            if remaining_requests is not None:
+                self.request_level = min(self.request_level, remaining_requests)
+            if remaining_tokens is not None:
+                self.token_level = min(self.token_level, remaining_tokens)
+            if remaining_requests == 0:
+                reset = parse_duration(headers.get("x-ratelimit-reset-requests"))
+                if reset:
+                    self.paused_until = max(self.paused_until, now + reset)
+            if remaining_tokens == 0:
+                reset = parse_duration(headers.get("x-ratelimit-reset-tokens"))
+                if reset:
+                    self.paused_until = max(self.paused_until, now + reset)
+
+
+def _header_number(headers, name):
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def retry_after_seconds(headers):
+    """从 retry-after-ms / retry-after 响应头读取服务器建议的等待秒数"""
+    if not headers:
+        return None
+    retry_after_ms = _header_number(headers, "retry-after-ms")
+    if retry_after_ms is not None:
+        return retry_after_ms / 1000
+    return parse_duration(headers.get("retry-after"))
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(provider, model_name):
+    """获取某个供应商/模型共享的限流器"""
+    key = (provider, model_name)
+    with _limiters_lock:
+        if key not in _limiters:
+            limits = config.RATE_LIMITS.get(model_name, config.DEFAULT_RATE_LIMIT)
+            _limiters[key] = RateLimiter(limits["rpm"], limits["tpm"])
+        return _limiters[key]
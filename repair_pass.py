@@ -0,0 +1,143 @@
+# repair_pass.py
+import csv
+import os
+import config
+import answer_parser
+import result_sink
+import run_manifest
+
+# 第 n 轮修复按 sample_index + n * REPAIR_SAMPLE_STRIDE 采样：与原始样本及之前各轮的缓存键都不同，重新修复不会回放同一个失败的回复
+REPAIR_SAMPLE_STRIDE = 10000
+# 来源文件中的单元格：空表示原始回答；"repair:N" 表示答案来自第N轮修复；"failed:N" 表示第N轮修复后仍无有效答案
+REPAIRED = "repair"
+STILL_FAILED = "failed"
+
+
+def provenance_path(output_file):
+    """修复来源文件的路径，与结果CSV并列，表头与结果CSV相同"""
+    root, ext = os.path.splitext(output_file)
+    return f"{root}_provenance{ext or '.csv'}"
+
+
+def _repair_status_codes():
+    return {answer_parser.status_of(value) for value in config.REPAIR_STATUSES}
+
+
+def load_provenance(output_file):
+    """{单元: 每题的来源单元格}"""
+    path = provenance_path(output_file)
+    provenance = {}
+    if not os.path.exists(path):
+        return provenance
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if len(row) >= 4:
+                provenance[run_manifest.unit_key(*row[:4])] = row[4:]
+    return provenance
+
+
+def repair_rounds(cells):
+    """该单元已经做过的修复轮数"""
+    return max((int(cell.split(":", 1)[1]) for cell in cells if ":" in cell), default=0)
+
+
+def find_repair_targets(output_file, model_names, provenance):
+    """
+    扫描结果CSV，返回 {单元: (失败题目的位置列表, 已修复轮数)}。
+    只包含 model_names 中的模型、状态属于 REPAIR_STATUSES 且修复轮数未达 REPAIR_MAX_ROUNDS 的单元
+    """
+    targets = {}
+    if not os.path.exists(output_file):
+        return targets
+    repair_codes = _repair_status_codes()
+    with open(output_file, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if len(row) < 4 or row[2] not in model_names:
+                continue
+            key = run_manifest.unit_key(*row[:4])
+            positions = [
+                position for position, value in enumerate(row[4:])
+                if answer_parser.status_of(value) in repair_codes
+            ]
+            rounds = repair_rounds(provenance.get(key, ()))
+            if positions and rounds < config.REPAIR_MAX_ROUNDS:
+                targets[key] = (positions, rounds)
+            else:
+                targets.pop(key, None) # 同一单元重复出现时以最后一行为准
+    return targets
+
+
+def repair_sample_index(sample_index, repair_round):
+    return int(sample_index) + repair_round * REPAIR_SAMPLE_STRIDE
+
+
+def merge_repairs(output_file, survey_questions, repairs, provenance):
+    """
+    把修复结果合并回结果CSV的原有行（先写临时文件再替换），并更新来源文件。
+    repairs: {单元: (失败题目的位置列表, 修复轮次, 修复得到的整份答案列表)}。
+    返回 (修复成功的题数, 仍然失败的题数)
+    """
+    repair_codes = _repair_status_codes()
+    num_questions = len(survey_questions)
+    fixed = still_failed = 0
+    merged = {}
+    for key, (positions, repair_round, answers) in repairs.items():
+        row_answers = {}
+        cells = list(provenance.get(key) or [""] * num_questions)
+        for position in positions:
+            if answers is not None and answer_parser.status_of(answers[position]) not in repair_codes:
+                row_answers[position] = answers[position]
+                cells[position] = f"{REPAIRED}:{repair_round}"
+                fixed += 1
+            else:
+                cells[position] = f"{STILL_FAILED}:{repair_round}"
+                still_failed += 1
+        merged[key] = row_answers
+        provenance[key] = cells
+
+    temp_path = output_file + ".repair.tmp"
+    with open(output_file, 'r', newline='', encoding='utf-8') as source, \
+            open(temp_path, 'w', newline='', encoding='utf-8') as target:
+        reader = csv.reader(source)
+        writer = csv.writer(target)
+        writer.writerow(next(reader))
+        for row in reader:
+            row_answers = merged.get(run_manifest.unit_key(*row[:4])) if len(row) >= 4 else None
+            if row_answers:
+                for position, answer in row_answers.items():
+                    row[4 + position] = answer
+            writer.writerow(row)
+        target.flush()
+        os.fsync(target.fileno())
+    os.replace(temp_path, output_file)
+    _write_provenance(output_file, survey_questions, provenance)
+    return fixed, still_failed
+
+
+def _write_provenance(output_file, survey_questions, provenance):
+    path = provenance_path(output_file)
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(result_sink.build_result_headers(survey_questions))
+        for key, cells in provenance.items():
+            writer.writerow(list(key) + cells)
+    os.replace(temp_path, path)
+
+
+def rebuild_parquet(persona_type, output_file, survey_questions):
+    """结果CSV被改写后，按CSV重新生成该画像类型的Parquet分区（CSV是唯一的事实来源）"""
+    if "parquet" not in config.RESULT_FORMATS or not result_sink.parquet_available():
+        return
+    result_sink.reset_parquet_results([persona_type])
+    writer = result_sink.ParquetPartitionWriter(persona_type, survey_questions)
+    with open(output_file, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            writer.write_row(row)
+    writer.close()
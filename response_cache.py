@@ -0,0 +1,179 @@
+# response_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import config
+
+CACHE_MODES = ("off", "readwrite", "replay") # replay: 只读回放，未命中时不调用API
+EVICT_EVERY_WRITES = 1000 # 长时间运行时每写入这么多条检查一次淘汰
+TOUCH_BATCH_SIZE = 500 # 命中时的访问时间先记在内存中，攒够这么多条再一次写回
+
+
+def make_cache_key(prompt, system_message, model_name, temperature, max_tokens, sample_index=0, variant=None):
+    """
+    由完整请求参数计算缓存键；sample_index 区分同一提示词的多次独立采样，
+    variant 区分返回内容不同的请求（如带 logprobs 的请求），为None时与旧版缓存键一致
+    """
+    fields = [system_message, prompt, model_name, temperature, max_tokens, sample_index]
+    if variant is not None:
+        fields.append(variant)
+    payload = json.dumps(fields, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """基于SQLite的LLM回复缓存，支持按条数和存活时间淘汰"""
+
+    def __init__(self, path, mode="readwrite", max_entries=None, max_age_seconds=None):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"未知的缓存模式 '{mode}'，可选值为 {CACHE_MODES}")
+        self.path = path
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._touched = {} # 待写回的访问时间 key -> accessed_at
+        if mode != "off":
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # WAL 模式下 NORMAL 只在检查点时落盘，提交不再逐次 fsync；断电最多丢失最近几条缓存，不影响结果文件
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " model TEXT,"
+                " response TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)")
+            self._conn.commit()
+            if mode == "readwrite":
+                self.evict()
+
+    @property
+    def enabled(self):
+        return self._conn is not None
+
+    def get(self, key):
+        """读取缓存，未命中或已过期时返回None"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.max_age_seconds and now - row[1] > self.max_age_seconds):
+                self.misses += 1
+                return None
+            self.hits += 1
+            if self.mode == "readwrite":
+                # 访问时间只用于淘汰排序，不必每次命中都写库
+                self._touched[key] = now
+                if len(self._touched) >= TOUCH_BATCH_SIZE:
+                    self._flush_touched()
+            return row[0]
+
+    def _flush_touched(self):
+        """把攒下的访问时间一次写回（调用方持有锁）"""
+        if not self._touched:
+            return
+        self._conn.executemany(
+            "UPDATE responses SET accessed_at = ? WHERE key = ?",
+            [(accessed_at, key) for key, accessed_at in self._touched.items()],
+        )
+        self._conn.commit()
+        self._touched = {}
+
+    def flush(self):
+        """写回尚未保存的访问时间"""
+        if self.mode != "readwrite" or self._conn is None:
+            return
+        with self._lock:
+            self._flush_touched()
+
+    def put(self, key, model_name, response_text):
+        """写入缓存；回放模式和失败的回复(None)不写入"""
+        if self.mode != "readwrite" or response_text is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, model_name, response_text, now, now),
+            )
+            self._conn.commit()
+            self.writes += 1
+            should_evict = self.writes % EVICT_EVERY_WRITES == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """删除过期条目，并在超出条数上限时淘汰最久未访问的条目"""
+        if self.mode != "readwrite":
+            return 0
+        removed = 0
+        with self._lock:
+            self._flush_touched() # 按最新的访问时间淘汰
+            if self.max_age_seconds:
+                cursor = self._conn.execute(
+                    "DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age_seconds,)
+                )
+                removed += cursor.rowcount
+            if self.max_entries:
+                count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                if count > self.max_entries:
+                    cursor = self._conn.execute(
+                        "DELETE FROM responses WHERE key IN "
+                        "(SELECT key FROM responses ORDER BY accessed_at ASC LIMIT ?)",
+                        (count - self.max_entries,),
+                    )
+                    removed += cursor.rowcount
+            self._conn.commit()
+        return removed
+
+    def size(self):
+        """缓存中的条目数"""
+        if self._conn is None:
+            return 0
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self):
+        return {"mode": self.mode, "hits": self.hits, "misses": self.misses, "writes": self.writes}
+
+    def close(self):
+        if self._conn is not None:
+            self.flush()
+            with self._lock:
+                self._conn.close()
+                self._conn = None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """获取按 config 创建的全局缓存实例"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            if config.RESPONSE_CACHE_MODE != "off":
+                os.makedirs(os.path.dirname(config.RESPONSE_CACHE_PATH) or ".", exist_ok=True)
+            max_age_days = config.RESPONSE_CACHE_MAX_AGE_DAYS
+            _cache = ResponseCache(
+                config.RESPONSE_CACHE_PATH,
+                mode=config.RESPONSE_CACHE_MODE,
+                max_entries=config.RESPONSE_CACHE_MAX_ENTRIES,
+                max_age_seconds=max_age_days * 86400 if max_age_days else None,
+            )
+        return _cache
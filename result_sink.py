@@ -0,0 +1,219 @@
+# result_sink.py
+import os
+import re
+import shutil
+import time
+import config
+import answer_aggregator
+import answer_parser
+import persona_loader
+import run_manifest
+
+
+def _import_pyarrow():
+    """按需导入 pyarrow（导入较慢，只有输出Parquet时才需要），未安装时返回 (None, None)"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError: # 需要 pip install pyarrow
+        return None, None
+    return pa, pq
+
+
+# 整行的状态码
+ROW_OK = 0
+ROW_PARTIAL = 1
+ROW_NO_RESPONSE = 2
+
+
+def encode_answer(answer, codes):
+    """解析后的答案 -> (选项序号, 状态码)，无有效答案时序号为0；状态码见 answer_parser"""
+    status = answer_parser.status_of(answer)
+    if status != answer_parser.STATUS_OK:
+        return 0, status
+    code = codes.get(answer)
+    if code is None and codes:
+        return 0, answer_parser.STATUS_INVALID
+    return code or 0, answer_parser.STATUS_OK
+
+
+def code_type(pa, max_code):
+    """能容纳最大选项序号的最小整数类型：选项不超过127个时仍为 int8"""
+    if max_code <= 127:
+        return pa.int8()
+    if max_code <= 32767:
+        return pa.int16()
+    return pa.int32()
+
+
+def _safe_partition_value(value):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", value)
+
+
+def parquet_available():
+    return _import_pyarrow()[0] is not None
+
+
+class ParquetPartitionWriter:
+    """
+    按 persona_type/model 分区增量写入Parquet。
+    答案编码为选项序号（按问卷中最多的选项数选用 int8/int16/int32），另有每题状态列和整行状态列；persona_type/model 使用字典编码。
+    每攒够 row_group_size 行写出一个完整的分片文件，崩溃时最多丢失尚未写出的缓冲行（CSV中仍有）。
+    """
+
+    def __init__(self, persona_type, survey_questions, base_dir=None, row_group_size=None):
+        self.persona_type = persona_type
+        self.question_ids = [q["id"] for q in survey_questions]
+        self.codes = [persona_loader.option_codes(q) for q in survey_questions]
+        self.base_dir = base_dir or config.PARQUET_DIR
+        self.row_group_size = row_group_size or config.PARQUET_ROW_GROUP_SIZE
+        self.run_tag = f"{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+        self.schema = self._build_schema()
+        self._buffers = {} # model -> 列缓冲
+        self._parts = {} # model -> 已写出的分片数
+
+    def _build_schema(self):
+        pa, _ = _import_pyarrow()
+        category = pa.dictionary(pa.int8(), pa.string())
+        fields = [
+            pa.field("persona_id", pa.string()),
+            pa.field("persona_type", category),
+            pa.field("model", category),
+            pa.field("sample_index", pa.int16()),
+            pa.field("status", pa.int8()),
+        ]
+        # 同一份问卷的所有题目使用同一种类型，各分片的 schema 保持一致
+        answer_type = code_type(pa, max((max(codes.values(), default=0) for codes in self.codes), default=0))
+        fields += [pa.field(f"q{q_id}", answer_type) for q_id in self.question_ids]
+        fields += [pa.field(f"q{q_id}_status", pa.int8()) for q_id in self.question_ids]
+        return pa.schema(fields)
+
+    def _new_buffer(self):
+        return {field.name: [] for field in self.schema}
+
+    def write_row(self, row):
+        persona_id, persona_type, model_name, sample_index = row[:4]
+        answers = row[4:]
+        buffer = self._buffers.setdefault(model_name, self._new_buffer())
+        statuses = []
+        buffer["persona_id"].append(str(persona_id))
+        buffer["persona_type"].append(persona_type)
+        buffer["model"].append(model_name)
+        buffer["sample_index"].append(int(sample_index))
+        for q_id, raw_answer, codes in zip(self.question_ids, answers, self.codes):
+            code, status = encode_answer(raw_answer, codes)
+            buffer[f"q{q_id}"].append(code)
+            buffer[f"q{q_id}_status"].append(status)
+            statuses.append(status)
+        if statuses and all(status == answer_parser.STATUS_NO_RESPONSE for status in statuses):
+            buffer["status"].append(ROW_NO_RESPONSE)
+        elif any(status != answer_parser.STATUS_OK for status in statuses):
+            buffer["status"].append(ROW_PARTIAL)
+        else:
+            buffer["status"].append(ROW_OK)
+        if len(buffer["persona_id"]) >= self.row_group_size:
+            self._flush(model_name)
+
+    def _flush(self, model_name):
+        buffer = self._buffers.get(model_name)
+        if not buffer or not buffer["persona_id"]:
+            return
+        pa, pq = _import_pyarrow()
+        table = pa.Table.from_pydict(buffer, schema=self.schema)
+        directory = os.path.join(
+            self.base_dir,
+            f"persona_type={_safe_partition_value(self.persona_type)}",
+            f"model={_safe_partition_value(model_name)}",
+        )
+        os.makedirs(directory, exist_ok=True)
+        part = self._parts.get(model_name, 0) + 1
+        self._parts[model_name] = part
+        # 每次运行写新的分片文件，续跑时不会改写已有文件；先写临时文件再改名，读取方不会看到半个文件
+        path = os.path.join(directory, f"part-{self.run_tag}-{part:05d}.parquet")
+        pq.write_table(table, path + ".tmp", compression="zstd")
+        os.replace(path + ".tmp", path)
+        self._buffers[model_name] = self._new_buffer()
+
+    def close(self):
+        for model_name in list(self._buffers):
+            self._flush(model_name)
+
+
+class TeeResultWriter:
+    """同时写入CSV和Parquet，接口与 run_manifest.ResultWriter 相同"""
+
+    def __init__(self, csv_writer, parquet_writer):
+        self.csv_writer = csv_writer
+        self.parquet_writer = parquet_writer
+
+    def existing_keys(self):
+        return self.csv_writer.existing_keys()
+
+    def write_row(self, row):
+        self.csv_writer.write_row(row)
+        self.parquet_writer.write_row(row)
+
+    def close(self):
+        try:
+            self.parquet_writer.close()
+        finally:
+            self.csv_writer.close()
+
+
+def build_result_headers(survey_questions):
+    """结果CSV表头"""
+    return ['persona_id', 'persona_type', 'model', 'sample_index'] + [f'q{q["id"]}' for q in survey_questions]
+
+
+def open_result_writer(persona_type, output_file, survey_questions, formats=None):
+    """按 config.RESULT_FORMATS 打开某个画像类型的结果写入器；CSV总是写入，是续跑的依据；在线汇总开启时同时计入汇总"""
+    formats = formats or config.RESULT_FORMATS
+    writer = run_manifest.ResultWriter(output_file, build_result_headers(survey_questions))
+    if "parquet" in formats:
+        if parquet_available():
+            writer = TeeResultWriter(writer, ParquetPartitionWriter(persona_type, survey_questions))
+        else:
+            print("警告：未安装 pyarrow，跳过Parquet结果输出（pip install pyarrow）。")
+    aggregator = answer_aggregator.get_aggregator()
+    if aggregator.active:
+        # 运行中实时汇总答案分布；续跑时先计入文件中已有的行
+        writer = aggregator.wrap(writer, output_file)
+    return writer
+
+
+def distribution_path(output_file):
+    """logprobs 评分模式下答案分布文件的路径，与结果CSV并列"""
+    root, ext = os.path.splitext(output_file)
+    return f"{root}_distributions{ext or '.csv'}"
+
+
+def format_distributions(distributions):
+    """每题的分布写成一个单元格，例如 "0.6200|0.3000|0.0800"；没有分布的题目留空"""
+    return [
+        "|".join(f"{p:.4f}" for p in distribution) if distribution is not None else ""
+        for distribution in distributions
+    ]
+
+
+def open_distribution_writer(output_file, survey_questions):
+    """打开答案分布CSV，表头与结果CSV相同，每个单元格是该题各选项的概率；续跑时同一单元可能重复，以最后一行为准"""
+    return run_manifest.ResultWriter(distribution_path(output_file), build_result_headers(survey_questions))
+
+
+def reset_parquet_results(persona_types, base_dir=None):
+    """全新运行前删除这些画像类型的Parquet分区"""
+    base_dir = base_dir or config.PARQUET_DIR
+    for persona_type in persona_types:
+        directory = os.path.join(base_dir, f"persona_type={_safe_partition_value(persona_type)}")
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+
+
+def read_parquet_results(base_dir=None, columns=None, filters=None):
+    """以内存映射方式读取分区Parquet结果，例如 filters=[("model", "=", "gpt-4o")]"""
+    base_dir = base_dir or config.PARQUET_DIR
+    _, pq = _import_pyarrow()
+    if pq is None:
+        raise ImportError("读取Parquet结果需要安装 pyarrow")
+    # 分区值同时保存在文件列中，因此不再从目录名推断分区列
+    return pq.read_table(base_dir, columns=columns, filters=filters, partitioning=None, memory_map=True)
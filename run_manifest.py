@@ -0,0 +1,171 @@
+# run_manifest.py
+import csv
+import io
+import json
+import os
+import config
+
+
+def unit_key(persona_id, persona_type, model_name, sample_index=0):
+    """一个模拟单元（某个人设在某个模型上的第 sample_index 个样本）的唯一标识"""
+    return (str(persona_id), persona_type, model_name, int(sample_index))
+
+
+def _truncate_partial_line(path):
+    """崩溃可能留下写了一半的最后一行，截断到最后一个完整行"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b'\n':
+            return
+        # 向前查找最后一个换行符
+        pos = size - 1
+        chunk_size = 4096
+        while pos > 0:
+            start = max(0, pos - chunk_size)
+            f.seek(start)
+            chunk = f.read(pos - start)
+            idx = chunk.rfind(b'\n')
+            if idx != -1:
+                f.truncate(start + idx + 1)
+                return
+            pos = start
+        f.truncate(0)
+
+
+def load_completed(path):
+    """只读地加载运行清单中已完成的单元集合，文件不存在时返回空集合"""
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+                # 旧版清单没有 sample 字段，即第0个样本
+                completed.add(unit_key(
+                    entry["persona_id"], entry["persona_type"], entry["model"], entry.get("sample", 0)
+                ))
+            except (json.JSONDecodeError, KeyError):
+                print(f"警告：跳过无法解析的运行清单记录: '{line}'")
+    return completed
+
+
+class RunManifest:
+    """记录已完成的 (persona_id, persona_type, model, sample_index) 单元，追加写入JSONL以支持断点续跑"""
+
+    def __init__(self, path, fsync_every=None):
+        self.path = path
+        self.fsync_every = config.CHECKPOINT_FSYNC_EVERY if fsync_every is None else fsync_every
+        self._pending_sync = 0
+        _truncate_partial_line(path)
+        self.completed = load_completed(path)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def is_done(self, persona_id, persona_type, model_name, sample_index=0):
+        return unit_key(persona_id, persona_type, model_name, sample_index) in self.completed
+
+    def pending_samples(self, persona_id, persona_type, model_name, num_samples):
+        """尚未完成的样本序号列表"""
+        return [
+            index for index in range(num_samples)
+            if unit_key(persona_id, persona_type, model_name, index) not in self.completed
+        ]
+
+    def mark_done(self, persona_id, persona_type, model_name, sample_index=0):
+        key = unit_key(persona_id, persona_type, model_name, sample_index)
+        if key in self.completed:
+            return
+        self.completed.add(key)
+        self._file.write(json.dumps(
+            {"persona_id": key[0], "persona_type": persona_type, "model": model_name, "sample": key[3]},
+            ensure_ascii=False
+        ) + "\n")
+        self._file.flush()
+        self._pending_sync += 1
+        if self._pending_sync >= self.fsync_every:
+            os.fsync(self._file.fileno())
+            self._pending_sync = 0
+
+    def reconcile(self, result_keys):
+        """结果已写入但清单未来得及记录（两次写入之间崩溃）的单元也视为完成"""
+        for persona_id, persona_type, model_name, sample_index in result_keys:
+            self.mark_done(persona_id, persona_type, model_name, sample_index)
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+
+class ResultHeaderMismatch(ValueError):
+    """已有结果文件的表头与当前问卷/格式不一致（例如旧版本生成的、没有 sample_index 列的文件）"""
+
+
+class ResultWriter:
+    """追加写入结果CSV，每行一次性写入并立即刷新；前四列为 persona_id, persona_type, model, sample_index"""
+
+    def __init__(self, path, headers, fsync_every=None):
+        self.path = path
+        self.fsync_every = config.CHECKPOINT_FSYNC_EVERY if fsync_every is None else fsync_every
+        self._pending_sync = 0
+        _truncate_partial_line(path)
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not is_new:
+            with open(path, 'r', newline='', encoding='utf-8') as f:
+                existing_headers = next(csv.reader(f), None)
+            if existing_headers != list(headers):
+                # 追加到列不同的旧文件会使结果错位
+                raise ResultHeaderMismatch(
+                    f"结果文件 {path} 的表头与当前问卷/格式不一致，请设置 RESUME_RUNS=0 重新开始或更换输出文件"
+                )
+        self._file = open(path, 'a', newline='', encoding='utf-8')
+        if is_new:
+            self.write_row(headers)
+
+    def existing_keys(self):
+        """读取结果文件中已有的 (persona_id, persona_type, model, sample_index)"""
+        keys = set()
+        with open(self.path, 'r', newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                if len(row) >= 4:
+                    keys.add(unit_key(row[0], row[1], row[2], row[3]))
+        return keys
+
+    def write_row(self, row):
+        # 先在内存中格式化整行，再一次写入，避免半行数据
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(row)
+        self._file.write(buffer.getvalue())
+        self._file.flush()
+        self._pending_sync += 1
+        if self._pending_sync >= self.fsync_every:
+            os.fsync(self._file.fileno())
+            self._pending_sync = 0
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+
+def reset_run(output_files, manifest_path=None):
+    """开始全新运行：删除运行清单和旧的结果文件"""
+    manifest_path = manifest_path or config.RUN_MANIFEST_FILE
+    for path in list(output_files) + [manifest_path]:
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,182 @@
+# survey_planner.py
+import math
+import re
+import config
+import answer_parser
+import persona_loader
+import rate_limiter
+
+_TEMPLATE_FIELD = re.compile(r"\{(?:persona_description|survey_questions_formatted)\}")
+
+
+def question_prompt_tokens(question):
+    """题目在提示词中占用的token数（含题目之间的空行）"""
+    return rate_limiter.estimate_tokens(persona_loader.format_survey_questions([question])) + 2
+
+
+def question_answer_tokens(question):
+    """回答该题预计生成的token数"""
+    if question.get('options'):
+        return config.ANSWER_TOKENS_PER_QUESTION
+    return config.OPEN_ANSWER_TOKENS
+
+
+class SurveyPlan:
+    """
+    问卷分块计划：每块单独请求（可并行），各块的回复按题号合并回一行。
+    只有一块时与整份问卷一次请求完全相同。
+    """
+
+    def __init__(self, survey_questions, chunks, survey_formatted=None):
+        self.survey_questions = survey_questions
+        self.chunks = chunks
+        if len(chunks) == 1 and survey_formatted is not None:
+            self.formatted_chunks = [survey_formatted]
+        else:
+            self.formatted_chunks = [persona_loader.format_survey_questions(chunk) for chunk in chunks]
+        position_of = {str(q["id"]): index for index, q in enumerate(survey_questions)}
+        self._chunk_positions = [[position_of[str(q["id"])] for q in chunk] for chunk in chunks]
+
+    @property
+    def num_chunks(self):
+        return len(self.chunks)
+
+    def prompt_builders(self, prompt_template):
+        """每块一个提示词构造函数"""
+        return [
+            persona_loader.make_prompt_builder(prompt_template, formatted)
+            for formatted in self.formatted_chunks
+        ]
+
+    def max_tokens(self, chunk_index):
+        """该块请求的 max_tokens：按题目推算的回复长度加上余量，不超过 MAX_TOKENS_PER_RESPONSE"""
+        if not config.DERIVE_MAX_TOKENS:
+            return config.MAX_TOKENS_PER_RESPONSE
+        answer_tokens = sum(question_answer_tokens(q) for q in self.chunks[chunk_index])
+        derived = math.ceil(answer_tokens / config.RESPONSE_TOKEN_MARGIN) + config.DERIVED_MAX_TOKENS_SLACK
+        return min(derived, config.MAX_TOKENS_PER_RESPONSE)
+
+    def answer_stream_factory(self, parser, chunk_index):
+        """返回为该块创建增量解析器的函数，流式请求的每个回复各用一个"""
+        question_ids = [q["id"] for q in self.chunks[chunk_index]]
+        return lambda: parser.answer_stream(question_ids)
+
+    def _mark_failed_chunks(self, answers, failed):
+        for chunk_index, chunk_failed in enumerate(failed):
+            if chunk_failed:
+                for position in self._chunk_positions[chunk_index]:
+                    answers[position] = answer_parser.ERROR_NO_RESPONSE
+        return answers
+
+    def parse(self, parser, chunk_texts):
+        """各块的回复文本 -> 整份问卷的答案列表；请求失败的块中的题目记为无回复"""
+        if self.num_chunks == 1:
+            return parser.parse_answers(chunk_texts[0])
+        texts = [text for text in chunk_texts if text]
+        answers = parser.parse_answers("\n".join(texts) if texts else None)
+        if not texts:
+            return answers
+        return self._mark_failed_chunks(answers, [not text for text in chunk_texts])
+
+    def parse_logprobs(self, parser, chunk_results):
+        """各块的 logprobs 结果 -> (答案列表, 分布列表)，合并时补一个换行token使各块的行互不相连"""
+        if self.num_chunks == 1:
+            return parser.parse_logprobs(chunk_results[0])
+        results = [result for result in chunk_results if result]
+        if not results:
+            return parser.parse_logprobs(None)
+        merged = {"text": "", "tokens": []}
+        for result in results:
+            if merged["tokens"]:
+                merged["text"] += "\n"
+                merged["tokens"].append(["\n", 1, []])
+            merged["text"] += result["text"]
+            merged["tokens"].extend(result["tokens"])
+        answers, distributions = parser.parse_logprobs(merged)
+        return self._mark_failed_chunks(answers, [not result for result in chunk_results]), distributions
+
+
+def _chunk_cost(chunk):
+    return sum(question_prompt_tokens(q) for q in chunk), sum(question_answer_tokens(q) for q in chunk)
+
+
+def _greedy_chunks(survey_questions, prompt_budget, answer_budget):
+    """按题目顺序装箱，放不下就开新块"""
+    chunks = []
+    current = []
+    prompt_tokens = answer_tokens = 0
+    for question in survey_questions:
+        q_prompt = question_prompt_tokens(question)
+        q_answer = question_answer_tokens(question)
+        if current and (prompt_tokens + q_prompt > prompt_budget or answer_tokens + q_answer > answer_budget):
+            chunks.append(current)
+            current = []
+            prompt_tokens = answer_tokens = 0
+        if q_prompt > prompt_budget or q_answer > answer_budget:
+            print(f"警告：题目 {question['id']} 单独一题就超出预算，将单独请求，回复可能被截断。")
+        current.append(question)
+        prompt_tokens += q_prompt
+        answer_tokens += q_answer
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _balanced_chunks(survey_questions, num_chunks):
+    """按预计回复长度把题目切成 num_chunks 个连续且大致等长的块，使并行请求的耗时接近"""
+    costs = [question_answer_tokens(q) for q in survey_questions]
+    total = sum(costs)
+    chunks = []
+    current = []
+    cumulative = 0
+    for question, cost in zip(survey_questions, costs):
+        if current and cumulative + cost / 2 > total * (len(chunks) + 1) / num_chunks:
+            chunks.append(current)
+            current = []
+        current.append(question)
+        cumulative += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def plan_survey(survey_questions, prompt_template, models_to_run, survey_formatted=None, mode=None):
+    """
+    估算每题的提示词和回复token数，把问卷切成能放进回复上限和上下文窗口的块。
+    所有模型共用一个计划（按上下文最小的模型规划），这样各模型收到的提示词相同。
+    """
+    mode = mode or config.SURVEY_CHUNKING
+    if mode == "off" or len(survey_questions) <= 1:
+        return SurveyPlan(survey_questions, [survey_questions], survey_formatted)
+    if mode != "auto":
+        print(f"警告：未知的问卷分块模式 '{mode}'，按 'auto' 处理。")
+
+    model_names = [model_name for model_list in models_to_run.values() for model_name in model_list]
+    context_tokens = min(
+        (config.MODEL_CONTEXT_TOKENS.get(model_name, config.DEFAULT_CONTEXT_TOKENS) for model_name in model_names),
+        default=config.DEFAULT_CONTEXT_TOKENS,
+    )
+    overhead = rate_limiter.estimate_tokens(_TEMPLATE_FIELD.sub("", prompt_template)) + config.PERSONA_TOKEN_ALLOWANCE
+    prompt_budget = context_tokens - config.MAX_TOKENS_PER_RESPONSE - overhead
+    answer_budget = int(config.MAX_TOKENS_PER_RESPONSE * config.RESPONSE_TOKEN_MARGIN)
+    if prompt_budget <= 0:
+        print(f"警告：提示词模板本身已接近上下文上限 ({context_tokens} token)，无法按上下文规划分块。")
+        prompt_budget = float("inf")
+
+    chunks = _greedy_chunks(survey_questions, prompt_budget, answer_budget)
+    if len(chunks) > 1:
+        balanced = _balanced_chunks(survey_questions, len(chunks))
+        if len(balanced) == len(chunks) and all(
+            prompt <= prompt_budget and answer <= answer_budget for prompt, answer in map(_chunk_cost, balanced)
+        ):
+            chunks = balanced
+    if len(chunks) == 1:
+        return SurveyPlan(survey_questions, chunks, survey_formatted)
+    return SurveyPlan(survey_questions, chunks)
+
+
+def describe_plan(plan):
+    if plan.num_chunks == 1:
+        return "问卷整份一次请求"
+    sizes = "、".join(str(len(chunk)) for chunk in plan.chunks)
+    return f"问卷拆分为 {plan.num_chunks} 块并行请求（每块题数: {sizes}）"
@@ -0,0 +1,341 @@
+# telemetry.py
+import contextlib
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import config
+import answer_parser
+
+# Prometheus 直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RESERVOIR_SIZE = 10000 # 每个模型保留的延迟样本数，用于报告分位数
+
+_current_trace = contextvars.ContextVar("telemetry_trace", default=None)
+
+
+def estimate_cost(model_name, prompt_tokens, cached_tokens, completion_tokens):
+    """按 config.MODEL_PRICES（美元/百万token）估算费用，价格表中没有的模型返回None"""
+    prices = config.MODEL_PRICES.get(model_name)
+    if prices is None:
+        return None
+    uncached = prompt_tokens - cached_tokens
+    cached_price = prices.get("cached_input", prices["input"])
+    return (uncached * prices["input"] + cached_tokens * cached_price + completion_tokens * prices["output"]) / 1e6
+
+
+class UnitTrace:
+    """
+    一个模拟单元（某个人设在某个模型上的一次或一组样本，可能含多个问卷分块请求）的遥测记录。
+    通过 contextvars 传递，llm_interface 中的调用自动把排队、网络耗时和用量记到当前记录上
+    """
+
+    def __init__(self, provider, model_name, labels):
+        self.provider = provider
+        self.model = model_name
+        self.labels = labels
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.wall_s = None
+        self.queue_s = 0.0     # 等待并发名额和限流器的时间
+        self.network_s = 0.0   # 各次HTTP请求耗时之和（含失败的尝试）
+        self.attempts = []     # 每次HTTP请求的 (耗时, 错误类型或None, 第几次尝试)
+        self.cache_hits = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.responses = 0
+        self.failed_responses = 0
+        self.parse_status = {"ok": 0, "missing": 0, "invalid": 0, "no_response": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def requests(self):
+        """成功的请求数"""
+        return sum(1 for _, error, _ in self.attempts if error is None)
+
+    @property
+    def retries(self):
+        return sum(1 for _, _, attempt in self.attempts if attempt > 0)
+
+    @property
+    def cost_usd(self):
+        return estimate_cost(self.model, self.prompt_tokens, self.cached_tokens, self.completion_tokens)
+
+    def add_parse_statuses(self, statuses):
+        """累加 answer_parser 的状态码列表"""
+        names = {
+            answer_parser.STATUS_OK: "ok",
+            answer_parser.STATUS_MISSING: "missing",
+            answer_parser.STATUS_INVALID: "invalid",
+            answer_parser.STATUS_NO_RESPONSE: "no_response",
+        }
+        for status in statuses:
+            self.parse_status[names[status]] += 1
+
+    def to_dict(self):
+        return {
+            "ts": round(self.started_at, 3),
+            "provider": self.provider,
+            "model": self.model,
+            **self.labels,
+            "wall_s": round(self.wall_s, 4) if self.wall_s is not None else None,
+            "queue_s": round(self.queue_s, 4),
+            "network_s": round(self.network_s, 4),
+            "requests": self.requests,
+            "retries": self.retries,
+            "errors": [error for _, error, _ in self.attempts if error is not None],
+            "cache_hits": self.cache_hits,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "responses": self.responses,
+            "failed_responses": self.failed_responses,
+            "parse_status": self.parse_status,
+            "cost_usd": self.cost_usd,
+        }
+
+
+# --- 由 llm_interface 调用，没有当前记录时不做任何事 ---
+def add_queue_time(seconds):
+    trace = _current_trace.get()
+    if trace is not None:
+        with trace._lock:
+            trace.queue_s += seconds
+
+
+def record_attempt(seconds, error=None, attempt=0):
+    """attempt 为重试循环中的序号，大于0即为重试"""
+    trace = _current_trace.get()
+    if trace is not None:
+        with trace._lock:
+            trace.network_s += seconds
+            trace.attempts.append((seconds, error, attempt))
+
+
+def record_usage(prompt_tokens, cached_tokens, completion_tokens):
+    trace = _current_trace.get()
+    if trace is not None:
+        with trace._lock:
+            trace.prompt_tokens += prompt_tokens
+            trace.cached_tokens += cached_tokens
+            trace.completion_tokens += completion_tokens
+
+
+def record_cache_hits(count=1):
+    trace = _current_trace.get()
+    if trace is not None and count:
+        with trace._lock:
+            trace.cache_hits += count
+
+
+@contextlib.contextmanager
+def trace_unit(provider, model_name, **labels):
+    """
+    记录一个模拟单元：with 块内的API调用自动计入，退出时写入JSONL轨迹并汇总到指标中。
+    调用方在块内设置 responses/failed_responses 并调用 add_parse_statuses
+    """
+    trace = UnitTrace(provider, model_name, labels)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        trace.wall_s = time.perf_counter() - trace._start
+        _collector.record(trace)
+
+
+# --- 汇总与导出 ---
+class _ModelMetrics:
+    def __init__(self):
+        self.counters = {
+            "units": 0, "requests": 0, "retries": 0, "errors": 0, "cache_hits": 0,
+            "responses": 0, "failed_responses": 0,
+            "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0,
+            "cost_usd": 0.0,
+            "answers_ok": 0, "answers_missing": 0, "answers_invalid": 0, "answers_no_response": 0,
+        }
+        self.queue_s = 0.0
+        self.network_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.network_sum = 0.0
+        self.network_count = 0
+        self.latency_samples = []
+
+
+class TelemetryCollector:
+    """按 (provider, model) 汇总单元记录，写JSONL轨迹，并导出Prometheus文本格式和汇总报告"""
+
+    def __init__(self):
+        self.run_id = None
+        self.metrics = {}
+        self._trace_file = None
+        self._server = None
+        self._lock = threading.Lock()
+        self._rng = random.Random(0)
+
+    def start_run(self, trace_path=None, metrics_port=None):
+        trace_path = trace_path or config.TELEMETRY_TRACE_FILE
+        metrics_port = config.METRICS_PORT if metrics_port is None else metrics_port
+        with self._lock:
+            self.run_id = time.strftime("%Y%m%d_%H%M%S") + "_" + uuid.uuid4().hex[:6]
+            self.metrics = {}
+            if config.TELEMETRY_ENABLED and self._trace_file is None:
+                self._trace_file = open(trace_path, 'a', encoding='utf-8')
+        if metrics_port and self._server is None:
+            self._server = _start_metrics_server(self, metrics_port)
+            print(f"指标端点: http://127.0.0.1:{metrics_port}/metrics")
+
+    def record(self, trace):
+        with self._lock:
+            metrics = self.metrics.setdefault((trace.provider, trace.model), _ModelMetrics())
+            counters = metrics.counters
+            counters["units"] += 1
+            counters["requests"] += trace.requests
+            counters["retries"] += trace.retries
+            counters["errors"] += sum(1 for _, error, _ in trace.attempts if error is not None)
+            counters["cache_hits"] += trace.cache_hits
+            counters["responses"] += trace.responses
+            counters["failed_responses"] += trace.failed_responses
+            counters["prompt_tokens"] += trace.prompt_tokens
+            counters["cached_tokens"] += trace.cached_tokens
+            counters["completion_tokens"] += trace.completion_tokens
+            counters["cost_usd"] += trace.cost_usd or 0.0
+            for name, count in trace.parse_status.items():
+                counters[f"answers_{name}"] += count
+            metrics.queue_s += trace.queue_s
+            for seconds, _, _ in trace.attempts:
+                metrics.network_sum += seconds
+                metrics.network_count += 1
+                metrics.network_buckets[_bucket_index(seconds)] += 1
+                # 蓄水池抽样，长时间运行时内存有界
+                if len(metrics.latency_samples) < RESERVOIR_SIZE:
+                    metrics.latency_samples.append(seconds)
+                else:
+                    slot = self._rng.randrange(metrics.network_count)
+                    if slot < RESERVOIR_SIZE:
+                        metrics.latency_samples[slot] = seconds
+            if self._trace_file is not None:
+                self._trace_file.write(json.dumps({"run_id": self.run_id, **trace.to_dict()}, ensure_ascii=False) + "\n")
+                self._trace_file.flush()
+
+    def prometheus_text(self):
+        """导出为 Prometheus 文本格式（可由 node_exporter 的 textfile collector 读取）"""
+        lines = []
+        with self._lock:
+            items = sorted(self.metrics.items())
+            counter_names = list(_ModelMetrics().counters)
+            for name in counter_names:
+                metric = f"llm_sim_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for (provider, model_name), metrics in items:
+                    lines.append(f'{metric}{{provider="{provider}",model="{model_name}"}} {metrics.counters[name]}')
+            lines.append("# TYPE llm_sim_queue_seconds_total counter")
+            for (provider, model_name), metrics in items:
+                lines.append(f'llm_sim_queue_seconds_total{{provider="{provider}",model="{model_name}"}} {metrics.queue_s:.6f}')
+            lines.append("# TYPE llm_sim_request_seconds histogram")
+            for (provider, model_name), metrics in items:
+                labels = f'provider="{provider}",model="{model_name}"'
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), metrics.network_buckets):
+                    cumulative += count
+                    lines.append(f'llm_sim_request_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"llm_sim_request_seconds_sum{{{labels}}} {metrics.network_sum:.6f}")
+                lines.append(f"llm_sim_request_seconds_count{{{labels}}} {metrics.network_count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path=None):
+        path = path or config.METRICS_FILE
+        # 先写临时文件再替换，采集方不会读到半个文件
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        os.replace(path + ".tmp", path)
+
+    def report_lines(self):
+        """按模型汇总的文字报告"""
+        lines = []
+        with self._lock:
+            for (provider, model_name), metrics in sorted(self.metrics.items()):
+                c = metrics.counters
+                samples = sorted(metrics.latency_samples)
+                p50 = _quantile(samples, 0.5)
+                p95 = _quantile(samples, 0.95)
+                mean_queue = metrics.queue_s / c["units"] if c["units"] else 0
+                total_answers = c["answers_ok"] + c["answers_missing"] + c["answers_invalid"] + c["answers_no_response"]
+                ok_ratio = c["answers_ok"] / total_answers if total_answers else 0
+                cost = f"${c['cost_usd']:.4f}" if model_name in config.MODEL_PRICES else "未知（价格表中没有该模型）"
+                lines.append(
+                    f"  {provider}/{model_name}: {c['units']} 个单元，{c['requests']} 次请求"
+                    f"（重试 {c['retries']}，缓存命中 {c['cache_hits']}，失败回复 {c['failed_responses']}），"
+                    f"请求延迟 p50 {_fmt_seconds(p50)} / p95 {_fmt_seconds(p95)}，平均排队 {mean_queue:.2f}s，"
+                    f"token 输入 {c['prompt_tokens']}（缓存 {c['cached_tokens']}）/ 输出 {c['completion_tokens']}，"
+                    f"有效答案 {ok_ratio:.1%}，估算费用 {cost}"
+                )
+        return lines
+
+    def finish_run(self, write_metrics=True):
+        """写出指标文件、打印汇总报告并关闭轨迹文件；指标端点保持到进程退出"""
+        if not self.metrics:
+            self.close()
+            return
+        if config.TELEMETRY_ENABLED and write_metrics:
+            self.write_prometheus()
+        print("调用遥测汇总:")
+        for line in self.report_lines():
+            print(line)
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._trace_file is not None:
+                self._trace_file.close()
+                self._trace_file = None
+
+
+def _bucket_index(seconds):
+    for index, bound in enumerate(LATENCY_BUCKETS):
+        if seconds <= bound:
+            return index
+    return len(LATENCY_BUCKETS)
+
+
+def _quantile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(len(sorted_values) * q), len(sorted_values) - 1)]
+
+
+def _fmt_seconds(value):
+    return f"{value:.2f}s" if value is not None else "-"
+
+
+def _start_metrics_server(collector, port):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            data = collector.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("content-type", "text/plain; version=0.0.4")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+_collector = TelemetryCollector()
+
+
+def get_collector():
+    return _collector
@@ -0,0 +1,85 @@
+# tests/test_answer_aggregator.py
+import pytest
+import config
+import answer_aggregator
+import answer_parser
+
+SURVEY = [
+    {"id": 1, "text": "你是否同意？", "options": ["1. 同意", "2. 不同意"]},
+    {"id": 2, "text": "你是否满意？", "options": ["A. 满意", "B. 一般", "C. 不满意"]},
+    {"id": 3, "text": "还有什么想说的？", "options": []},
+]
+
+
+@pytest.fixture
+def aggregator(monkeypatch):
+    monkeypatch.setattr(config, "AGGREGATE_ENABLED", True)
+    monkeypatch.setattr(config, "AGGREGATE_CHECKPOINT_INTERVAL", 3600)
+    monkeypatch.setattr(config, "AGGREGATE_MIN_SAMPLES", 100)
+    monkeypatch.setattr(config, "AGGREGATE_CONVERGENCE_SE", 0.05)
+    aggregator = answer_aggregator.AnswerAggregator()
+    aggregator.start_run(SURVEY)
+    return aggregator
+
+
+def _row(index, *answers, model_name="m"):
+    return [f"p{index}", "silicon", model_name, "0", *answers]
+
+
+def test_counts_and_distributions(aggregator):
+    aggregator.add_row(_row(1, "1", "A", "没有"))
+    aggregator.add_row(_row(2, "1", "C", "好"))
+    aggregator.add_row(_row(3, "2", answer_parser.ERROR_INVALID, answer_parser.ERROR_MISSING))
+    distributions = aggregator.distributions("silicon", "m")
+    assert distributions[0, :2].tolist() == pytest.approx([2 / 3, 1 / 3])
+    assert distributions[1].tolist() == pytest.approx([0.5, 0.0, 0.5])
+    stats = aggregator.summary()["silicon"]["models"]["m"]
+    assert stats["rows"] == 3
+    assert stats["error_rate"] == pytest.approx(2 / 9)
+    assert stats["min_answers"] == 2
+
+
+def test_agreement_between_models(aggregator):
+    aggregator.add_row(_row(1, "1", "A", "", model_name="m1"))
+    aggregator.add_row(_row(1, "1", "A", "", model_name="m2"))
+    aggregator.add_row(_row(1, "2", "A", "", model_name="m3"))
+    # 两两重合度：m1-m2 为1，m1-m3 和 m2-m3 为0.5
+    assert aggregator.summary()["silicon"]["agreement"] == pytest.approx(2 / 3)
+
+
+def test_converged_only_after_enough_consistent_answers(aggregator):
+    for index in range(99):
+        aggregator.add_row(_row(index, "1", "B", ""))
+    assert not aggregator.converged("silicon", "m") # 有效答案不足 AGGREGATE_MIN_SAMPLES
+    for index in range(99, 100 + answer_aggregator.CONVERGENCE_CHECK_ROWS):
+        aggregator.add_row(_row(index, "1", "B", ""))
+    assert aggregator.converged("silicon", "m")
+
+
+def test_not_converged_while_answers_are_spread(aggregator, monkeypatch):
+    monkeypatch.setattr(config, "AGGREGATE_CONVERGENCE_SE", 0.04)
+    for index in range(100 + answer_aggregator.CONVERGENCE_CHECK_ROWS):
+        aggregator.add_row(_row(index, str(index % 2 + 1), "ABC"[index % 3], ""))
+    # 答案数已足够，但各选项比例的标准误约为0.04，超过阈值
+    assert not aggregator.converged("silicon", "m")
+
+
+def test_disabled_aggregator_ignores_rows(monkeypatch):
+    monkeypatch.setattr(config, "AGGREGATE_ENABLED", False)
+    aggregator = answer_aggregator.AnswerAggregator()
+    aggregator.start_run(SURVEY)
+    aggregator.add_row(_row(1, "1", "A", ""))
+    assert aggregator.summary() == {}
+    assert not aggregator.converged("silicon", "m")
+
+
+def test_unlabeled_options_answered_by_number(monkeypatch):
+    monkeypatch.setattr(config, "AGGREGATE_ENABLED", True)
+    survey = [{"id": 1, "text": "你对现状的看法？", "options": ["非常同意", "同意", "不同意"]}]
+    parser = answer_parser.SurveyParser(survey)
+    aggregator = answer_aggregator.AnswerAggregator()
+    aggregator.start_run(survey)
+    for index, response in enumerate(["1：2", "1: 3", "1：同意"]):
+        aggregator.add_row(_row(index, *parser.parse_answers(response)))
+    assert aggregator.distributions("silicon", "m")[0].tolist() == pytest.approx([0, 2 / 3, 1 / 3])
+    assert aggregator.summary()["silicon"]["models"]["m"]["error_rate"] == 0
@@ -0,0 +1,131 @@
+# tests/test_answer_parser.py
+import answer_parser
+
+SURVEY = [
+    {"id": 1, "text": "你是否同意？", "options": ["1. 同意", "2. 不同意"]},
+    {"id": 2, "text": "你是否满意？", "options": ["A. 满意", "B. 一般", "C. 不满意"]},
+    {"id": 3, "text": "还有什么想说的？", "options": []},
+    {"id": 4, "text": "你对现状的看法？", "options": ["非常同意", "同意", "不同意"]},
+]
+
+
+def test_parse_valid_answers_in_common_formats():
+    parser = answer_parser.SurveyParser(SURVEY)
+    answers, statuses = parser.parse("题号1：2\n问题 2: [b]\n第3题：没有了\n4: 3")
+    assert answers == ["2", "B", "没有了", "3"]
+    assert statuses == [answer_parser.STATUS_OK] * 4
+    assert parser.stats["answers_ok"] == 4
+
+
+def test_parse_fullwidth_ids_and_option_text():
+    parser = answer_parser.SurveyParser(SURVEY)
+    answers, _ = parser.parse("１：同意\n2. （C）\n3、好\n4：同意")
+    assert answers == ["1", "C", "好", "2"]
+
+
+def test_parse_unlabeled_options_by_position_or_text():
+    parser = answer_parser.SurveyParser(SURVEY)
+    assert parser.parse_answers("4：2")[3] == "2"
+    assert parser.parse_answers("4：（1）")[3] == "1"
+    assert parser.parse_answers("4：不同意")[3] == "3"
+    assert parser.parse_answers("4：4")[3] == answer_parser.ERROR_INVALID
+    assert answer_parser.canonical_labels(SURVEY[3]) == ["1", "2", "3"]
+
+
+def test_parse_missing_answers():
+    parser = answer_parser.SurveyParser(SURVEY)
+    answers, statuses = parser.parse("1: 1\n这一行不是答案\n4: 1")
+    assert answers == ["1", answer_parser.ERROR_MISSING, answer_parser.ERROR_MISSING, "1"]
+    assert statuses == [
+        answer_parser.STATUS_OK, answer_parser.STATUS_MISSING, answer_parser.STATUS_MISSING, answer_parser.STATUS_OK
+    ]
+    assert parser.stats["answers_missing"] == 2
+    assert parser.stats["unparsed_lines"] == 1
+
+
+def test_parse_out_of_range_answers_are_invalid():
+    parser = answer_parser.SurveyParser(SURVEY)
+    answers, statuses = parser.parse("1: 5\n2: D\n3: 好\n9: 1")
+    assert answers[:2] == [answer_parser.ERROR_INVALID, answer_parser.ERROR_INVALID]
+    assert statuses[:2] == [answer_parser.STATUS_INVALID, answer_parser.STATUS_INVALID]
+    assert parser.stats["answers_invalid"] == 2
+    assert parser.stats["unknown_question_ids"] == 1
+
+
+def test_parse_repeated_question_keeps_last_answer():
+    parser = answer_parser.SurveyParser(SURVEY)
+    assert parser.parse_answers("1: 1\n1: 2")[0] == "2"
+
+
+def test_parse_no_response():
+    parser = answer_parser.SurveyParser(SURVEY)
+    answers, statuses = parser.parse(None)
+    assert answers == [answer_parser.ERROR_NO_RESPONSE] * 4
+    assert statuses == [answer_parser.STATUS_NO_RESPONSE] * 4
+    assert parser.stats["no_response"] == 1
+
+
+def test_answer_stream_completes_once_every_answer_is_valid():
+    parser = answer_parser.SurveyParser(SURVEY)
+    stream = parser.answer_stream([1, 2])
+    assert not stream.feed("1: 1\n2: ")
+    assert not stream.feed("D\n2: ") # 无效答案不算
+    assert not stream.feed("B") # 行未结束
+    assert stream.feed("\n")
+    assert stream.text == "1: 1\n2: D\n2: B\n"
+
+
+def _tokens(pieces):
+    """[(token, 候选)] -> get_llm_logprobs 结果中的 (token, UTF-8字节数, 候选) 列表"""
+    return [(token, len(token.encode("utf-8")), alternatives) for token, alternatives in pieces]
+
+
+def test_logprobs_map_answer_offsets_to_tokens():
+    parser = answer_parser.SurveyParser(SURVEY)
+    text = "题号1：2\n题号2：B"
+    tokens = _tokens([
+        ("题号", []), ("1", []), ("：", []), ("2", [("2", -0.1), ("1", -2.4), ("好", -3.0)]), ("\n", []),
+        ("题号", []), ("2", []), ("：", []), ("B", [("B", -0.2), ("A", -1.9), ("C", -2.9)]),
+    ])
+    answers, distributions = parser.parse_logprobs({"text": text, "tokens": tokens})
+    assert answers == ["2", "B", answer_parser.ERROR_MISSING, answer_parser.ERROR_MISSING]
+    # 多字节字符之后的答案也能定位到正确的token，分布只在选项上归一化
+    first, second, third, _ = distributions
+    assert first[1] > first[0] and abs(sum(first) - 1) < 1e-9
+    assert len(second) == 3 and second.index(max(second)) == 1 and abs(sum(second) - 1) < 1e-9
+    assert third is None
+
+
+def test_logprobs_skip_separator_tokens_before_answer():
+    parser = answer_parser.SurveyParser(SURVEY)
+    tokens = _tokens([("2", []), (":", []), (" [", []), ("A", [("A", -0.5), ("B", -1.0), ("好", -0.1)]), ("]", [])])
+    _, distributions = parser.parse_logprobs({"text": "2: [A]", "tokens": tokens})
+    # 非选项的候选token不计入，C 没有出现在候选中
+    assert distributions[1][0] > distributions[1][1] > 0
+    assert distributions[1][2] == 0
+
+
+def test_logprobs_for_unlabeled_options():
+    parser = answer_parser.SurveyParser(SURVEY)
+    tokens = _tokens([("4", []), ("：", []), (" 2", [(" 2", -0.2), (" 3", -1.8), ("同意", -0.5), (" 4", -2.0)])])
+    answers, distributions = parser.parse_logprobs({"text": "4： 2", "tokens": tokens})
+    assert answers[3] == "2"
+    # 按序号编号的候选计入对应选项，选项文本和超出范围的编号不计入
+    assert distributions[3][0] == 0
+    assert distributions[3][1] > distributions[3][2] > 0
+    assert abs(sum(distributions[3]) - 1) < 1e-9
+
+
+def test_logprobs_answer_outside_options_has_no_distribution():
+    parser = answer_parser.SurveyParser(SURVEY)
+    tokens = _tokens([("1", []), (":", []), (" A", [(" A", -0.1), (" B", -1.0)])])
+    answers, distributions = parser.parse_logprobs({"text": "1: A", "tokens": tokens})
+    assert answers[0] == answer_parser.ERROR_INVALID
+    assert distributions[0] is None
+
+
+def test_logprobs_without_result():
+    parser = answer_parser.SurveyParser(SURVEY)
+    answers, distributions = parser.parse_logprobs(None)
+    assert answers == [answer_parser.ERROR_NO_RESPONSE] * 4
+    assert distributions == [None] * 4
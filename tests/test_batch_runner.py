@@ -0,0 +1,99 @@
+# tests/test_batch_runner.py
+import csv
+import json
+import pytest
+import config
+import answer_parser
+import batch_runner
+import result_sink
+import run_manifest
+import survey_planner
+
+TEMPLATE = "请以下面的身份回答问卷。\n{persona_description}\n{survey_questions_formatted}\n"
+MODELS = {"openai": ["gpt-4o"]}
+SURVEY = [{"id": q_id, "text": f"第{q_id}题", "options": ["1. 是", "2. 否"]} for q_id in range(1, 26)]
+PERSONAS = [{"id": "p1", "description": "一位教师"}, {"id": "p2", "description": "一位农民"}]
+
+
+@pytest.fixture(autouse=True)
+def batch_config(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "BATCH_DIR", str(tmp_path / "batch"))
+    monkeypatch.setattr(config, "BATCH_POLL_INTERVAL", 0)
+    monkeypatch.setattr(config, "BATCH_MAX_REQUESTS_PER_FILE", 4) # 同一单元的各块分在不同的文件中
+    monkeypatch.setattr(config, "SAMPLES_PER_UNIT", 2)
+    monkeypatch.setattr(config, "RESULT_FORMATS", ["csv"])
+    monkeypatch.setattr(config, "SURVEY_CHUNKING", "auto")
+    monkeypatch.setattr(config, "DERIVE_MAX_TOKENS", True)
+    monkeypatch.setattr(config, "MAX_TOKENS_PER_RESPONSE", 100)
+    monkeypatch.setattr(config, "MODEL_CONTEXT_TOKENS", {"gpt-4o": 128000})
+
+
+def _read_rows(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))[1:]
+
+
+def test_custom_id_round_trip_and_legacy_ids():
+    custom_id = batch_runner.make_custom_id("silicon", 7, "gpt-4o", [0, 1], 2)
+    assert batch_runner.parse_custom_id(custom_id) == ("silicon", "7", "gpt-4o", [0, 1], 2)
+    assert batch_runner.parse_custom_id('["silicon", "7", "gpt-4o"]') == ("silicon", "7", "gpt-4o", [0], 0)
+
+
+def test_local_backend_run_merges_chunks_across_files(tmp_path):
+    output_file = str(tmp_path / "results.csv")
+    manifest = run_manifest.RunManifest(str(tmp_path / "manifest.jsonl"))
+    backend = batch_runner.LocalBatchBackend(str(tmp_path / "local"), polls_until_done=0)
+    batch_runner.run_batch(
+        [("general", PERSONAS, TEMPLATE)], None, SURVEY, MODELS, {"general": output_file}, manifest, backend
+    )
+    jobs = batch_runner.load_jobs()
+    assert len(jobs) > 1 and all(job["ingested"] for job in jobs)
+    rows = _read_rows(output_file)
+    assert sorted(tuple(row[:4]) for row in rows) == [
+        ("p1", "general", "gpt-4o", "0"), ("p1", "general", "gpt-4o", "1"),
+        ("p2", "general", "gpt-4o", "0"), ("p2", "general", "gpt-4o", "1"),
+    ]
+    # 默认回复对每块中的每题都回答 1，各块拼起来覆盖整份问卷
+    assert all(row[4:] == ["1"] * len(SURVEY) for row in rows)
+    assert manifest.pending_samples("p1", "general", "gpt-4o", 2) == []
+    manifest.close()
+
+
+class _OutputBackend:
+    """只提供批处理输出内容的替身"""
+
+    def __init__(self, records):
+        self.records = records
+
+    def content(self, file_id):
+        return "\n".join(json.dumps(record, ensure_ascii=False) for record in self.records)
+
+
+def test_ingest_keeps_missing_samples_pending_when_fewer_choices_return(tmp_path):
+    survey = SURVEY[:3]
+    plan = survey_planner.plan_survey(survey, TEMPLATE, MODELS)
+    assert plan.num_chunks == 1
+    record = {
+        "custom_id": batch_runner.make_custom_id("general", "p1", "gpt-4o", [0, 1, 2]),
+        "response": {"status_code": 200, "body": {"choices": [
+            {"index": 1, "message": {"content": "1：2\n2：1\n3：1"}},
+            {"index": 0, "message": {"content": "1：1\n2：1\n3：2"}},
+        ]}},
+    }
+    failed = {"custom_id": batch_runner.make_custom_id("general", "p2", "gpt-4o", [0]), "response": {"status_code": 500}}
+    output_file = str(tmp_path / "results.csv")
+    writer = run_manifest.ResultWriter(output_file, result_sink.build_result_headers(survey))
+    manifest = run_manifest.RunManifest(str(tmp_path / "manifest.jsonl"))
+    written = batch_runner.ingest_batch_output(
+        {"output_file_id": "out"}, _OutputBackend([record, failed]), answer_parser.SurveyParser(survey),
+        {"general": plan}, {"general": writer}, manifest, {},
+    )
+    writer.close()
+    assert written == 2
+    assert _read_rows(output_file) == [
+        ["p1", "general", "gpt-4o", "0", "1", "1", "2"],
+        ["p1", "general", "gpt-4o", "1", "2", "1", "1"],
+    ]
+    assert manifest.pending_samples("p1", "general", "gpt-4o", 3) == [2]
+    assert manifest.pending_samples("p2", "general", "gpt-4o", 1) == [0]
+    manifest.close()
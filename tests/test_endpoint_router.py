@@ -0,0 +1,96 @@
+# tests/test_endpoint_router.py
+import asyncio
+import pytest
+import config
+import endpoint_router
+from endpoint_router import Endpoint
+
+ENDPOINTS = [Endpoint("a", "http://a/v1", "k", 1.0), Endpoint("b", "http://b/v1", "k", 1.0)]
+
+
+@pytest.fixture(autouse=True)
+def hedge_config(monkeypatch):
+    monkeypatch.setattr(config, "HEDGE_REQUESTS", False)
+    monkeypatch.setattr(config, "HEDGE_MIN_SAMPLES", 3)
+    monkeypatch.setattr(config, "HEDGE_MIN_DELAY", 0.01)
+    monkeypatch.setattr(config, "HEDGE_MAX_EXTRA", 1)
+
+
+def _stats(router, model_name="m"):
+    return router._stats.get(model_name, {"hedges": 0, "hedge_wins": 0, "failovers": 0})
+
+
+def test_sync_call_fails_over_to_other_endpoint():
+    router = endpoint_router.EndpointRouter()
+    tried = []
+
+    def call(endpoint):
+        tried.append(endpoint.name)
+        return None if len(tried) == 1 else f"ok from {endpoint.name}"
+
+    assert router.call("m", ENDPOINTS, call) == f"ok from {tried[1]}"
+    assert sorted(tried) == ["a", "b"]
+    assert _stats(router)["failovers"] == 1
+
+
+def test_sync_call_returns_none_after_every_endpoint_failed():
+    router = endpoint_router.EndpointRouter()
+    tried = []
+    assert router.call("m", ENDPOINTS, lambda endpoint: tried.append(endpoint.name)) is None
+    assert sorted(tried) == ["a", "b"]
+
+
+def test_failed_endpoint_is_penalised_and_avoided():
+    router = endpoint_router.EndpointRouter()
+    router.record("m", ENDPOINTS[0], 0.1)
+    router.record("m", ENDPOINTS[1], 0.1)
+    router.record("m", ENDPOINTS[0], 0.1, ok=False)
+    assert router._expected_latency("m", "a") > router._expected_latency("m", "b")
+    assert router.choose("m", ENDPOINTS, exclude=["b"]).name == "a"
+    # 全部排除时仍从所有端点中选
+    assert router.choose("m", ENDPOINTS, exclude=["a", "b"]).name in ("a", "b")
+
+
+def test_hedge_delay_needs_enough_samples():
+    router = endpoint_router.EndpointRouter()
+    router.record("m", ENDPOINTS[0], 0.2)
+    assert router.hedge_delay("m") is None
+    for seconds in (0.1, 0.3, 0.4):
+        router.record("m", ENDPOINTS[0], seconds)
+    assert router.hedge_delay("m") == pytest.approx(0.4)
+
+
+def test_async_call_fails_over():
+    router = endpoint_router.EndpointRouter()
+    tried = []
+
+    async def call(endpoint):
+        tried.append(endpoint.name)
+        return None if len(tried) == 1 else endpoint.name
+
+    assert asyncio.run(router.call_async("m", ENDPOINTS, call)) == tried[1]
+    assert _stats(router)["failovers"] == 1
+
+
+def test_async_hedge_wins_and_cancels_slow_request(monkeypatch):
+    monkeypatch.setattr(config, "HEDGE_REQUESTS", True)
+    router = endpoint_router.EndpointRouter()
+    for _ in range(3):
+        router.record("m", ENDPOINTS[0], 0.01)
+    cancelled = []
+
+    async def call(endpoint):
+        if not cancelled:
+            cancelled.append(False)
+            try:
+                await asyncio.sleep(5) # 第一个请求卡住
+            except asyncio.CancelledError:
+                cancelled[0] = True
+                raise
+        return f"hedge via {endpoint.name}"
+
+    result = asyncio.run(asyncio.wait_for(router.call_async("m", ENDPOINTS, call), 2))
+    assert result.startswith("hedge via")
+    assert cancelled == [True]
+    assert _stats(router)["hedges"] == 1
+    assert _stats(router)["hedge_wins"] == 1
@@ -0,0 +1,111 @@
+# tests/test_job_queue.py
+import time
+import pytest
+import job_queue
+
+MODELS = {"openai": ["gpt-4o"]}
+
+
+@pytest.fixture
+def queue_path(tmp_path):
+    return str(tmp_path / "queue.sqlite")
+
+
+def _enqueue(queue, num_personas=2, samples=1):
+    personas = [{"id": f"p{i}", "description": f"人设{i}"} for i in range(num_personas)]
+    return queue.enqueue([("silicon", personas, "模板")], MODELS, lambda model_name: samples)
+
+
+def test_claim_in_enqueue_order_and_no_double_claim(queue_path):
+    queue = job_queue.JobQueue(queue_path, lease_seconds=300, max_attempts=3)
+    assert _enqueue(queue, num_personas=2, samples=2) == 4
+    assert _enqueue(queue, num_personas=2, samples=2) == 0 # 重复入队是安全的
+    first = queue.claim("w1", 3)
+    assert [(job.persona_id, job.sample_index) for job in first] == [("p0", 0), ("p0", 1), ("p1", 0)]
+    assert all(job.attempts == 1 and job.description.startswith("人设") for job in first)
+    second = queue.claim("w2", 3)
+    assert [(job.persona_id, job.sample_index) for job in second] == [("p1", 1)]
+    assert queue.claim("w2", 3) == []
+    queue.close()
+
+
+def test_complete_keeps_first_result(queue_path):
+    queue = job_queue.JobQueue(queue_path)
+    _enqueue(queue, num_personas=1)
+    job = queue.claim("w1", 1)[0]
+    assert queue.complete("w1", job.id, ["1", "2"])
+    assert not queue.complete("w2", job.id, ["2", "2"])
+    assert list(queue.iter_results("silicon")) == [("p0", "gpt-4o", 0, ["1", "2"], None)]
+    assert not queue.has_open_jobs()
+    queue.close()
+
+
+def test_expired_lease_is_taken_over_until_attempts_run_out(queue_path):
+    queue = job_queue.JobQueue(queue_path, lease_seconds=-1, max_attempts=2)
+    _enqueue(queue, num_personas=1)
+    assert queue.claim("w1", 1)[0].attempts == 1
+    # w1 没有续约，租约已过期，由 w2 接手
+    taken_over = queue.claim("w2", 1)
+    assert [job.attempts for job in taken_over] == [2]
+    assert queue.claim("w3", 1) == []
+    assert queue.counts()[job_queue.JOB_FAILED] == 1
+    queue.close()
+
+
+def test_heartbeat_keeps_lease(queue_path):
+    queue = job_queue.JobQueue(queue_path, lease_seconds=300)
+    _enqueue(queue, num_personas=1)
+    queue.claim("w1", 1)
+    assert queue.heartbeat("w1") == 1
+    assert queue.heartbeat("w2") == 0
+    assert queue.claim("w2", 1) == []
+    queue.close()
+
+
+def test_fail_counts_attempts(queue_path):
+    queue = job_queue.JobQueue(queue_path, max_attempts=2)
+    _enqueue(queue, num_personas=1)
+    job = queue.claim("w1", 1)[0]
+    queue.fail("w1", job.id, "无回复")
+    job = queue.claim("w1", 1)[0]
+    assert job.attempts == 2
+    queue.fail("w1", job.id, "无回复")
+    assert queue.counts()[job_queue.JOB_FAILED] == 1
+    assert queue.retry_failed() == 1
+    assert queue.claim("w1", 1)[0].attempts == 1
+    queue.close()
+
+
+def test_release_does_not_count_attempt(queue_path):
+    queue = job_queue.JobQueue(queue_path)
+    _enqueue(queue, num_personas=1)
+    queue.claim("w1", 1)
+    assert queue.release("w1") == 1
+    assert queue.claim("w2", 1)[0].attempts == 1
+    queue.close()
+
+
+def test_defer_waits_until_not_before_without_counting_attempt(queue_path):
+    queue = job_queue.JobQueue(queue_path)
+    _enqueue(queue, num_personas=1)
+    job = queue.claim("w1", 1)[0]
+    until = time.time() + 60
+    queue.defer("w1", [job.id], until, "熔断中")
+    assert queue.claim("w1", 1) == []
+    assert queue.has_open_jobs()
+    assert queue.next_claim_time() == pytest.approx(until)
+    queue.defer("w1", [job.id], time.time() - 1, "熔断中") # 租约已不属于 w1，不做改动
+    assert queue.claim("w1", 1) == []
+    # 到期后可以再领取，推迟不计入领取次数
+    queue._conn.execute("UPDATE jobs SET not_before = ?", (time.time() - 1,))
+    assert [job.attempts for job in queue.claim("w2", 1)] == [1]
+    queue.close()
+
+
+def test_prepare_run_rejects_a_different_run(queue_path):
+    queue = job_queue.JobQueue(queue_path)
+    queue.prepare_run([{"id": 1}], "1. 题目", {"silicon": "模板"}, MODELS)
+    assert queue.load_run() == ([{"id": 1}], "1. 题目", {"silicon": "模板"}, MODELS)
+    with pytest.raises(ValueError):
+        queue.prepare_run([{"id": 2}], "2. 题目", {"silicon": "模板"}, MODELS)
+    queue.close()
@@ -0,0 +1,57 @@
+# tests/test_persona_loader.py
+import json
+import numpy as np
+import pytest
+import persona_loader
+
+
+def _collect(num_snippets, num_sentences, num_personas, seed, shard=(0, 1), block_size=None):
+    blocks = list(persona_loader.iter_general_composition_blocks(
+        num_snippets, num_sentences, num_personas, seed, shard, block_size
+    ))
+    return np.concatenate([block for block, _ in blocks]), np.concatenate([rows for _, rows in blocks])
+
+
+@pytest.mark.parametrize("num_snippets, num_sentences", [(40, 3), (20000, 5)])
+def test_general_compositions_are_unique_and_valid(num_snippets, num_sentences):
+    rows = persona_loader.general_compositions(np.arange(5000), num_snippets, num_sentences, seed=3)
+    ordered = np.sort(rows, axis=1)
+    assert (np.diff(ordered, axis=1) > 0).all() # 同一人设的句子互不相同
+    assert len(np.unique(ordered, axis=0)) == len(rows) # 不同人设的组合互不相同
+    assert rows.min() >= 0 and rows.max() < num_snippets
+
+
+def test_large_libraries_are_split_into_groups():
+    sizes = persona_loader._composition_groups(20000, 5)
+    assert len(sizes) > 1 and sum(sizes) == 20000 and max(sizes) - min(sizes) <= 1
+    assert persona_loader.general_composition_count(20000, 5) <= persona_loader._INT64_MAX
+    assert persona_loader._composition_groups(40, 3) == [40]
+
+
+@pytest.mark.parametrize("num_snippets, num_sentences", [(40, 3), (20000, 5)])
+def test_shards_and_blocks_reproduce_the_full_sequence(num_snippets, num_sentences):
+    indices, full = _collect(num_snippets, num_sentences, 300, seed=11)
+    assert indices.tolist() == list(range(300))
+    for shard_index in range(3):
+        shard_indices, rows = _collect(num_snippets, num_sentences, 300, seed=11, shard=(shard_index, 3), block_size=17)
+        assert shard_indices.tolist() == list(range(shard_index, 300, 3))
+        assert (rows == full[shard_indices]).all()
+    # 多要人设时已有的前缀不变，换种子则组合不同
+    assert (_collect(num_snippets, num_sentences, 400, seed=11)[1][:300] == full).all()
+    assert not (_collect(num_snippets, num_sentences, 300, seed=12)[1] == full).all()
+
+
+def test_request_beyond_available_compositions_is_capped():
+    indices, rows = _collect(5, 2, 100, seed=0)
+    assert len(indices) == 10
+    assert len({tuple(sorted(row)) for row in rows.tolist()}) == 10
+
+
+def test_iter_general_personas_ids_and_sharding(tmp_path):
+    path = tmp_path / "snippets.json"
+    path.write_text(json.dumps([f"句子{i}。" for i in range(30)], ensure_ascii=False), encoding="utf-8")
+    personas = persona_loader.load_general_personas(str(path), num_sentences=3, num_personas=6, seed=1, shard="0/1")
+    assert [persona["id"] for persona in personas] == [f"gen_{i}" for i in range(1, 7)]
+    assert all(persona["description"].count("句子") == 3 for persona in personas)
+    second = persona_loader.load_general_personas(str(path), num_sentences=3, num_personas=6, seed=1, shard="1/2")
+    assert second == personas[1::2]
@@ -0,0 +1,130 @@
+# tests/test_provider_health.py
+import pytest
+import config
+import llm_interface
+import provider_health
+from provider_health import ProviderUnavailable
+
+
+@pytest.fixture(autouse=True)
+def breaker_config(monkeypatch):
+    monkeypatch.setattr(config, "CIRCUIT_BREAKER_ENABLED", True)
+    monkeypatch.setattr(config, "CIRCUIT_FAILURE_THRESHOLD", 3)
+    monkeypatch.setattr(config, "CIRCUIT_COOLDOWN", 30)
+    monkeypatch.setattr(config, "CIRCUIT_MAX_COOLDOWN", 100)
+    monkeypatch.setattr(config, "CIRCUIT_HALF_OPEN_PROBES", 1)
+    provider_health.get_health().reset()
+    yield
+    provider_health.get_health().reset()
+
+
+def _fail(health, provider, times):
+    for _ in range(times):
+        health.before_call(provider)
+        health.record(provider, False)
+
+
+def _expire_cooldown(health, provider):
+    breaker = health._breakers[provider]
+    breaker.opened_at -= breaker.cooldown
+
+
+def test_opens_after_consecutive_failures():
+    health = provider_health.ProviderHealth()
+    _fail(health, "p", 2)
+    health.record("p", True) # 成功后连续失败次数清零
+    _fail(health, "p", 2)
+    assert health.state("p") == provider_health.CLOSED
+    _fail(health, "p", 1)
+    assert health.state("p") == provider_health.OPEN
+    with pytest.raises(ProviderUnavailable) as excinfo:
+        health.before_call("p")
+    assert 0 < excinfo.value.retry_after <= 30
+    assert health.state("other") == provider_health.CLOSED
+
+
+def test_half_open_probe_success_closes():
+    health = provider_health.ProviderHealth()
+    _fail(health, "p", 3)
+    _expire_cooldown(health, "p")
+    health.before_call("p") # 探测请求
+    assert health.state("p") == provider_health.HALF_OPEN
+    with pytest.raises(ProviderUnavailable) as excinfo:
+        health.before_call("p") # 探测名额已满
+    assert excinfo.value.retry_after == provider_health.HALF_OPEN_RETRY_AFTER
+    health.record("p", True)
+    assert health.state("p") == provider_health.CLOSED
+    assert health._breakers["p"].cooldown == 30
+
+
+def test_half_open_probe_failure_doubles_cooldown_up_to_max():
+    health = provider_health.ProviderHealth()
+    _fail(health, "p", 3)
+    for expected in (60, 100, 100):
+        _expire_cooldown(health, "p")
+        _fail(health, "p", 1)
+        assert health.state("p") == provider_health.OPEN
+        assert health._breakers["p"].cooldown == expected
+
+
+def test_neutral_outcome_only_releases_probe():
+    health = provider_health.ProviderHealth()
+    _fail(health, "p", 3)
+    _expire_cooldown(health, "p")
+    health.before_call("p")
+    health.record("p", None)
+    assert health.state("p") == provider_health.HALF_OPEN
+    health.before_call("p") # 名额已归还，可以再次探测
+    _fail(health, "q", 2)
+    health.record("q", None)
+    _fail(health, "q", 1)
+    assert health.state("q") == provider_health.OPEN
+
+
+def test_unavailable_model_is_skipped_after_first_mark():
+    health = provider_health.ProviderHealth()
+    health.check_model("m")
+    with pytest.raises(ProviderUnavailable) as excinfo:
+        health.mark_unavailable("m")
+    assert excinfo.value.retry_after is None
+    with pytest.raises(ProviderUnavailable):
+        health.check_model("m")
+    assert health.report_lines() == ["  m: 无法调用，跳过 2 次调用"]
+
+
+def test_disabled_breaker_never_opens(monkeypatch):
+    monkeypatch.setattr(config, "CIRCUIT_BREAKER_ENABLED", False)
+    health = provider_health.ProviderHealth()
+    _fail(health, "p", 10)
+    health.before_call("p")
+    assert health.state("p") == provider_health.CLOSED
+
+
+def test_call_outcome_by_failure_kind():
+    outcome = llm_interface._call_outcome
+    assert outcome("答案", [llm_interface.FAILURE_TRANSIENT], False) is True
+    assert outcome(None, [llm_interface.FAILURE_REQUEST, llm_interface.FAILURE_RATE_LIMIT], False) is False
+    assert outcome(None, [llm_interface.FAILURE_AUTH], False) is False
+    assert outcome(None, [llm_interface.FAILURE_REQUEST], False) is None
+    assert outcome(None, [llm_interface.FAILURE_ERROR], True) is None
+    assert outcome(None, [], False) is None
+    assert outcome(None, [], True) is False
+
+
+def test_guarded_counts_only_health_failures():
+    health = provider_health.get_health()
+
+    def failing(kind):
+        def call():
+            llm_interface._report_failure(kind)
+            return None
+        return call
+
+    for _ in range(5):
+        assert llm_interface._guarded("p", failing(llm_interface.FAILURE_REQUEST)) is None
+    assert health.state("p") == provider_health.CLOSED
+    for _ in range(3):
+        llm_interface._guarded("p", failing(llm_interface.FAILURE_TRANSIENT))
+    assert health.state("p") == provider_health.OPEN
+    with pytest.raises(ProviderUnavailable):
+        llm_interface._guarded("p", lambda: "答案")
@@ -0,0 +1,65 @@
+# tests/test_rate_limiter.py
+import pytest
+import config
+import rate_limiter
+
+
+def test_parse_duration():
+    assert rate_limiter.parse_duration("1.5") == 1.5
+    assert rate_limiter.parse_duration("6m0s") == 360
+    assert rate_limiter.parse_duration("250ms") == pytest.approx(0.25)
+    assert rate_limiter.parse_duration("soon") is None
+    assert rate_limiter.parse_duration(None) is None
+
+
+def test_retry_after_prefers_milliseconds_header():
+    assert rate_limiter.retry_after_seconds({"retry-after-ms": "1500", "retry-after": "9"}) == 1.5
+    assert rate_limiter.retry_after_seconds({"retry-after": "2s"}) == 2
+    assert rate_limiter.retry_after_seconds(None) is None
+
+
+def test_backoff_delay_is_capped(monkeypatch):
+    monkeypatch.setattr(config, "RETRY_BASE_DELAY", 1)
+    monkeypatch.setattr(config, "RETRY_MAX_DELAY", 8)
+    assert all(0 <= rate_limiter.backoff_delay(10) <= 8 for _ in range(100))
+    assert 8 <= rate_limiter.backoff_delay(0, retry_after=30) <= 9
+
+
+def test_bucket_waits_once_requests_run_out():
+    limiter = rate_limiter.RateLimiter(rpm=2, tpm=1000)
+    assert limiter._reserve(10) == 0
+    assert limiter._reserve(10) == 0
+    # 第三个请求透支一个请求的额度，约需等待 60/2 秒
+    assert limiter._reserve(10) == pytest.approx(30, abs=0.1)
+
+
+def test_bucket_waits_for_tokens_and_caps_oversized_requests():
+    limiter = rate_limiter.RateLimiter(rpm=100, tpm=600)
+    assert limiter._reserve(600) == 0
+    assert limiter._reserve(60) == pytest.approx(6, abs=0.1)
+    # 超过 TPM 的请求按 TPM 计，不会永远等不到额度
+    assert limiter._reserve(10**6) == pytest.approx(66, abs=0.1)
+
+
+def test_record_usage_returns_overestimated_tokens():
+    limiter = rate_limiter.RateLimiter(rpm=100, tpm=600)
+    limiter._reserve(600)
+    limiter.record_usage(600, 540)
+    assert limiter._reserve(60) == pytest.approx(0, abs=0.1)
+
+
+def test_headers_lower_remaining_quota_and_pause_when_exhausted():
+    limiter = rate_limiter.RateLimiter(rpm=100, tpm=10000)
+    limiter.update_from_headers({
+        "x-ratelimit-limit-requests": "50",
+        "x-ratelimit-remaining-requests": "0",
+        "x-ratelimit-reset-requests": "20s",
+    })
+    assert limiter.rpm == 50
+    assert limiter._reserve(1) == pytest.approx(20, abs=0.1)
+
+
+def test_limiters_are_shared_per_provider_and_model():
+    first = rate_limiter.get_limiter("openai", "test-model")
+    assert rate_limiter.get_limiter("openai", "test-model") is first
+    assert rate_limiter.get_limiter("other", "test-model") is not first
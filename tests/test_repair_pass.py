@@ -0,0 +1,73 @@
+# tests/test_repair_pass.py
+import csv
+import pytest
+import config
+import repair_pass
+from answer_parser import ERROR_INVALID, ERROR_MISSING
+
+SURVEY = [
+    {"id": 1, "text": "你是否同意？", "options": ["1. 同意", "2. 不同意"]},
+    {"id": 2, "text": "你是否满意？", "options": ["A. 满意", "B. 不满意"]},
+]
+HEADERS = ["persona_id", "persona_type", "model", "sample_index", "q1", "q2"]
+
+
+@pytest.fixture(autouse=True)
+def repair_config(monkeypatch):
+    monkeypatch.setattr(config, "REPAIR_STATUSES", ["ERROR_MISSING", "ERROR_NO_RESPONSE", "ERROR_INVALID"])
+    monkeypatch.setattr(config, "REPAIR_MAX_ROUNDS", 2)
+
+
+def _write(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows([HEADERS] + rows)
+
+
+def _read(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))[1:]
+
+
+def test_find_targets_only_failed_answers_of_selected_models(tmp_path):
+    path = str(tmp_path / "results.csv")
+    _write(path, [
+        ["p1", "silicon", "m", "0", "1", ERROR_MISSING],
+        ["p2", "silicon", "m", "0", "2", "A"],
+        ["p3", "silicon", "other", "0", ERROR_INVALID, "A"],
+        ["p4", "silicon", "m", "0", ERROR_INVALID, "B"],
+        ["p4", "silicon", "m", "0", "1", "B"], # 同一单元以最后一行为准
+    ])
+    targets = repair_pass.find_repair_targets(path, ["m"], {})
+    assert targets == {("p1", "silicon", "m", 0): ([1], 0)}
+
+
+def test_merge_repairs_and_record_provenance(tmp_path):
+    path = str(tmp_path / "results.csv")
+    _write(path, [
+        ["p1", "silicon", "m", "0", ERROR_INVALID, ERROR_MISSING],
+        ["p2", "silicon", "m", "0", "1", "A"],
+    ])
+    key = ("p1", "silicon", "m", 0)
+    provenance = {}
+    fixed, still_failed = repair_pass.merge_repairs(
+        path, SURVEY, {key: ([0, 1], 1, ["2", ERROR_MISSING])}, provenance
+    )
+    assert (fixed, still_failed) == (1, 1)
+    assert _read(path) == [
+        ["p1", "silicon", "m", "0", "2", ERROR_MISSING],
+        ["p2", "silicon", "m", "0", "1", "A"],
+    ]
+    assert repair_pass.load_provenance(path) == {key: ["repair:1", "failed:1"]}
+
+    # 第二轮后达到 REPAIR_MAX_ROUNDS，不再修复
+    repair_pass.merge_repairs(path, SURVEY, {key: ([1], 2, None)}, provenance)
+    provenance = repair_pass.load_provenance(path)
+    assert provenance[key] == ["repair:1", "failed:2"]
+    assert repair_pass.find_repair_targets(path, ["m"], provenance) == {}
+
+
+def test_repair_rounds_use_distinct_sample_indices():
+    assert repair_pass.repair_rounds(["", "repair:1", "failed:2"]) == 2
+    assert repair_pass.repair_rounds(["", ""]) == 0
+    indices = {repair_pass.repair_sample_index(sample, repair_round) for sample in range(3) for repair_round in range(3)}
+    assert len(indices) == 9
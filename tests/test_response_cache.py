@@ -0,0 +1,60 @@
+# tests/test_response_cache.py
+import time
+import pytest
+import response_cache
+
+
+def _key(prompt, **kwargs):
+    return response_cache.make_cache_key(prompt, None, "m", 0.7, 100, **kwargs)
+
+
+def test_cache_key_covers_sample_and_variant():
+    assert _key("p") == _key("p", sample_index=0)
+    assert len({_key("p"), _key("q"), _key("p", sample_index=1), _key("p", variant="logprobs")}) == 4
+
+
+def test_put_get_and_stats(tmp_path):
+    cache = response_cache.ResponseCache(str(tmp_path / "cache.sqlite"))
+    assert cache.get("k") is None
+    cache.put("k", "m", "答案")
+    cache.put("failed", "m", None) # 失败的回复不缓存
+    assert cache.get("k") == "答案"
+    assert cache.size() == 1
+    assert cache.stats() == {"mode": "readwrite", "hits": 1, "misses": 1, "writes": 1}
+    cache.close()
+    reopened = response_cache.ResponseCache(str(tmp_path / "cache.sqlite"), mode="replay")
+    assert reopened.get("k") == "答案"
+    reopened.put("other", "m", "不写入")
+    assert reopened.size() == 1
+    reopened.close()
+
+
+def test_evicts_least_recently_accessed(tmp_path, monkeypatch):
+    cache = response_cache.ResponseCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr(response_cache.time, "time", lambda: next(clock))
+    for key in ("a", "b", "c"):
+        cache.put(key, "m", key)
+    cache.get("a") # 访问时间只记在内存中，淘汰前写回
+    assert cache.evict() == 1
+    assert cache.get("b") is None
+    assert cache.get("a") == "a" and cache.get("c") == "c"
+    cache.close()
+
+
+def test_expired_entries_miss_and_are_evicted(tmp_path, monkeypatch):
+    cache = response_cache.ResponseCache(str(tmp_path / "cache.sqlite"), max_age_seconds=60)
+    cache.put("k", "m", "答案")
+    now = time.time() + 120
+    monkeypatch.setattr(response_cache.time, "time", lambda: now)
+    assert cache.get("k") is None
+    assert cache.evict() == 1
+    cache.close()
+
+
+def test_off_mode_and_unknown_mode(tmp_path):
+    cache = response_cache.ResponseCache(str(tmp_path / "cache.sqlite"), mode="off")
+    cache.put("k", "m", "答案")
+    assert cache.get("k") is None and not cache.enabled
+    with pytest.raises(ValueError):
+        response_cache.ResponseCache(str(tmp_path / "cache.sqlite"), mode="write")
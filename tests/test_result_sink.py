@@ -0,0 +1,36 @@
+# tests/test_result_sink.py
+import pytest
+import answer_parser
+import persona_loader
+import result_sink
+
+SURVEY = [
+    {"id": 1, "text": "你是否满意？", "options": ["A. 满意", "B. 一般", "C. 不满意"]},
+    {"id": 2, "text": "你对现状的看法？", "options": ["非常同意", "同意", "不同意"]},
+    {"id": 3, "text": "还有什么想说的？", "options": []},
+]
+
+
+def test_encode_answer_uses_canonical_labels():
+    for question in SURVEY[:2]:
+        codes = persona_loader.option_codes(question)
+        for code, label in enumerate(answer_parser.canonical_labels(question), start=1):
+            assert result_sink.encode_answer(label, codes) == (code, answer_parser.STATUS_OK)
+    assert result_sink.encode_answer(answer_parser.ERROR_MISSING, {}) == (0, answer_parser.STATUS_MISSING)
+    assert result_sink.encode_answer("随便说说", {}) == (0, answer_parser.STATUS_OK)
+
+
+def test_parquet_round_trip(tmp_path):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+    parser = answer_parser.SurveyParser(SURVEY)
+    writer = result_sink.ParquetPartitionWriter("general", SURVEY, base_dir=str(tmp_path), row_group_size=10)
+    writer.write_row(["gen_1", "general", "m", "0", *parser.parse_answers("1: B\n2: 2\n3: 好")])
+    writer.write_row(["gen_2", "general", "m", "1", *parser.parse_answers("1: 满意\n2：不同意")])
+    writer.close()
+    table = pq.read_table(str(tmp_path / "persona_type=general" / "model=m")).to_pydict()
+    assert table["q1"] == [2, 1]
+    assert table["q2"] == [2, 3]
+    assert table["q2_status"] == [answer_parser.STATUS_OK, answer_parser.STATUS_OK]
+    assert table["q3_status"] == [answer_parser.STATUS_OK, answer_parser.STATUS_MISSING]
+    assert table["status"] == [result_sink.ROW_OK, result_sink.ROW_PARTIAL]
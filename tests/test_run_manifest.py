@@ -0,0 +1,76 @@
+# tests/test_run_manifest.py
+import pytest
+import run_manifest
+
+HEADERS = ["persona_id", "persona_type", "model", "sample_index", "q1"]
+
+
+def test_manifest_resumes_completed_units(tmp_path):
+    path = str(tmp_path / "manifest.jsonl")
+    manifest = run_manifest.RunManifest(path)
+    manifest.mark_done("p1", "silicon", "gpt-4o", 0)
+    manifest.mark_done("p1", "silicon", "gpt-4o", 2)
+    manifest.mark_done("p1", "silicon", "gpt-4o", 2) # 重复记录只写一次
+    manifest.close()
+
+    resumed = run_manifest.RunManifest(path)
+    assert resumed.is_done("p1", "silicon", "gpt-4o", 0)
+    assert resumed.pending_samples("p1", "silicon", "gpt-4o", 3) == [1]
+    assert resumed.pending_samples("p2", "silicon", "gpt-4o", 2) == [0, 1]
+    resumed.close()
+    with open(path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 2
+
+
+def test_manifest_drops_partial_trailing_line(tmp_path):
+    path = tmp_path / "manifest.jsonl"
+    path.write_text(
+        '{"persona_id": "p1", "persona_type": "silicon", "model": "gpt-4o", "sample": 0}\n'
+        '{"persona_id": "p2", "persona_type": "sil',
+        encoding="utf-8",
+    )
+    manifest = run_manifest.RunManifest(str(path))
+    assert manifest.completed == {("p1", "silicon", "gpt-4o", 0)}
+    manifest.mark_done("p2", "silicon", "gpt-4o", 0)
+    manifest.close()
+    assert run_manifest.load_completed(str(path)) == {
+        ("p1", "silicon", "gpt-4o", 0),
+        ("p2", "silicon", "gpt-4o", 0),
+    }
+
+
+def test_manifest_without_sample_field_means_first_sample(tmp_path):
+    path = tmp_path / "manifest.jsonl"
+    path.write_text('{"persona_id": 7, "persona_type": "cognitive", "model": "m"}\n', encoding="utf-8")
+    assert run_manifest.load_completed(str(path)) == {("7", "cognitive", "m", 0)}
+
+
+def test_result_writer_appends_and_recovers_partial_row(tmp_path):
+    path = str(tmp_path / "results.csv")
+    writer = run_manifest.ResultWriter(path, HEADERS)
+    writer.write_row(["p1", "silicon", "gpt-4o", 0, "A"])
+    writer.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("p2,silicon,gpt") # 崩溃时写了一半的行
+
+    writer = run_manifest.ResultWriter(path, HEADERS)
+    assert writer.existing_keys() == {("p1", "silicon", "gpt-4o", 0)}
+    writer.write_row(["p2", "silicon", "gpt-4o", 1, "B"])
+    writer.close()
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert lines == [",".join(HEADERS), "p1,silicon,gpt-4o,0,A", "p2,silicon,gpt-4o,1,B"]
+
+
+def test_result_writer_rejects_different_headers(tmp_path):
+    path = str(tmp_path / "results.csv")
+    run_manifest.ResultWriter(path, HEADERS).close()
+    with pytest.raises(run_manifest.ResultHeaderMismatch):
+        run_manifest.ResultWriter(path, HEADERS + ["q2"])
+
+
+def test_reconcile_marks_written_results_done(tmp_path):
+    manifest = run_manifest.RunManifest(str(tmp_path / "manifest.jsonl"))
+    manifest.reconcile({("p1", "silicon", "gpt-4o", 1)})
+    assert manifest.is_done("p1", "silicon", "gpt-4o", 1)
+    manifest.close()
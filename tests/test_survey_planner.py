@@ -0,0 +1,79 @@
+# tests/test_survey_planner.py
+import math
+import pytest
+import answer_parser
+import config
+import survey_planner
+
+TEMPLATE = "请以下面的身份回答问卷。\n{persona_description}\n{survey_questions_formatted}\n"
+MODELS = {"openai": ["gpt-4o"]}
+
+
+def _survey(num_questions, open_every=0):
+    return [
+        {"id": q_id, "text": f"第{q_id}题", "options": [] if open_every and q_id % open_every == 0 else ["1. 是", "2. 否"]}
+        for q_id in range(1, num_questions + 1)
+    ]
+
+
+@pytest.fixture(autouse=True)
+def planner_config(monkeypatch):
+    monkeypatch.setattr(config, "SURVEY_CHUNKING", "auto")
+    monkeypatch.setattr(config, "DERIVE_MAX_TOKENS", True)
+    monkeypatch.setattr(config, "MAX_TOKENS_PER_RESPONSE", 100)
+    monkeypatch.setattr(config, "MODEL_CONTEXT_TOKENS", {"gpt-4o": 128000})
+
+
+def test_chunks_respect_answer_budget_and_keep_order():
+    survey = _survey(25)
+    plan = survey_planner.plan_survey(survey, TEMPLATE, MODELS)
+    answer_budget = config.MAX_TOKENS_PER_RESPONSE * config.RESPONSE_TOKEN_MARGIN
+    assert plan.num_chunks == 3
+    assert [q for chunk in plan.chunks for q in chunk] == survey
+    for chunk in plan.chunks:
+        assert sum(survey_planner.question_answer_tokens(q) for q in chunk) <= answer_budget
+    # 均衡切分：各块题数相差不超过1
+    sizes = [len(chunk) for chunk in plan.chunks]
+    assert max(sizes) - min(sizes) <= 1
+
+
+def test_chunks_respect_context_window(monkeypatch):
+    monkeypatch.setattr(config, "MAX_TOKENS_PER_RESPONSE", 4000)
+    monkeypatch.setattr(config, "MODEL_CONTEXT_TOKENS", {"small": 5000})
+    survey = _survey(120)
+    plan = survey_planner.plan_survey(survey, TEMPLATE, {"openai": ["small", "gpt-4o"]})
+    prompt_budget = (
+        5000 - config.MAX_TOKENS_PER_RESPONSE - config.PERSONA_TOKEN_ALLOWANCE
+        - survey_planner.rate_limiter.estimate_tokens(survey_planner._TEMPLATE_FIELD.sub("", TEMPLATE))
+    )
+    assert plan.num_chunks > 1
+    for chunk in plan.chunks:
+        assert sum(survey_planner.question_prompt_tokens(q) for q in chunk) <= prompt_budget
+
+
+def test_short_survey_or_chunking_off_is_one_request():
+    survey = _survey(5)
+    assert survey_planner.plan_survey(survey, TEMPLATE, MODELS).num_chunks == 1
+    assert survey_planner.plan_survey(_survey(50), TEMPLATE, MODELS, mode="off").num_chunks == 1
+
+
+def test_max_tokens_derived_from_chunk_questions():
+    survey = _survey(6, open_every=3)
+    plan = survey_planner.SurveyPlan(survey, [survey[:2], survey[2:]])
+    assert plan.max_tokens(0) == math.ceil(2 * config.ANSWER_TOKENS_PER_QUESTION / config.RESPONSE_TOKEN_MARGIN) + config.DERIVED_MAX_TOKENS_SLACK
+    # 含开放题的块推算值超过上限时按 MAX_TOKENS_PER_RESPONSE 截断
+    assert plan.max_tokens(1) == config.MAX_TOKENS_PER_RESPONSE
+
+
+def test_max_tokens_fixed_when_derivation_disabled(monkeypatch):
+    monkeypatch.setattr(config, "DERIVE_MAX_TOKENS", False)
+    survey = _survey(2)
+    assert survey_planner.SurveyPlan(survey, [survey]).max_tokens(0) == config.MAX_TOKENS_PER_RESPONSE
+
+
+def test_parse_merges_chunks_and_marks_failed_chunk():
+    survey = _survey(4)
+    plan = survey_planner.SurveyPlan(survey, [survey[:2], survey[2:]])
+    parser = answer_parser.SurveyParser(survey)
+    assert plan.parse(parser, ["1: 1\n2: 2", "3: 2\n4: 1"]) == ["1", "2", "2", "1"]
+    assert plan.parse(parser, ["1: 1\n2: 2", None]) == ["1", "2"] + [answer_parser.ERROR_NO_RESPONSE] * 2